@@ -0,0 +1,353 @@
+"""
+Admission control for upstream calls.
+
+Each AdmissionPool caps the upstream calls a worker has in flight. Callers
+beyond the cap wait in a bounded FIFO queue for at most queue_timeout
+seconds. When the queue is full, or the wait runs out, they are rejected at
+once with a Retry-After estimate instead of piling onto the upstream API.
+Chat and vision get separate pools, so one cannot starve the other.
+
+The cap adapts (AIMD): every upstream 429 halves it (at most once per
+cooldown), and every success raises it by 1/limit, back up to the
+configured maximum.
+
+A pool can also hold a HostSemaphore, a cap shared by all the worker
+processes of one host. A per-worker cap alone never triggers under sync
+workers (one request per process) and does not bound the host as a whole;
+the host cap does. It is a set of slot files under a lock directory, each
+held with flock() while a call is in flight, so a crashed worker's slots
+free themselves. It has its own bounded queue (callers beyond it are
+rejected at once) and its own AIMD limit, kept in a state file next to the
+locks so that a 429 seen by any worker throttles the whole host.
+
+Locks come from `threading`, which gunicorn's gevent workers monkey-patch,
+so the same code blocks a thread under sync/gthread workers and yields the
+greenlet under gevent. Host slots are polled with non-blocking flock() for
+the same reason.
+"""
+import fcntl
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Rejected(Exception):
+    """No slot became free; retry_after is a hint in whole seconds."""
+
+    def __init__(self, pool, reason, retry_after):
+        super().__init__(f"{pool}: {reason}")
+        self.pool = pool
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class HostQueueFull(Exception):
+    """All of a HostSemaphore's waiting places are taken."""
+
+
+class HostSemaphore:
+    """
+    Counting semaphore over the processes of one host: up to `size` slot
+    files in `lock_dir`, each taken with an exclusive flock(). Callers that
+    find no free slot wait in one of `max_queue` waiting places (also flock'd
+    files), or are turned away at once when those are taken too.
+
+    The number of usable slots adapts like AdmissionPool.limit (AIMD on 429
+    / success), but lives in a small state file mapped by every process, so
+    one worker's 429 shrinks the cap for the whole host. After a shrink,
+    calls already holding higher-numbered slots run to completion; new calls
+    only get slots below the new limit.
+    """
+
+    _STATE = struct.Struct("dd")     # limit, wall-clock time of the last decrease
+
+    def __init__(self, lock_dir, name, size, max_queue=64, min_limit=1, backoff=0.5, cooldown=2.0,
+                 poll_interval=0.02):
+        self.size = max(1, size)
+        self.max_queue = max(0, max_queue)
+        self.min_limit = max(1, min(min_limit, self.size))
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.poll_interval = poll_interval
+        os.makedirs(lock_dir, mode=0o700, exist_ok=True)
+        self._paths = [os.path.join(lock_dir, f"{name}-{i}.lock") for i in range(self.size)]
+        self._queue_paths = [os.path.join(lock_dir, f"{name}-queue-{i}.lock") for i in range(self.max_queue)]
+        self._state_path = os.path.join(lock_dir, f"{name}.state")
+        self._files = self._queue_files = None
+        self._state_fd = self._state = None
+        self._pid = None
+        self._held = set()       # slots taken by this process
+        self._queued = set()     # waiting places taken by this process
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # Called with the lock held. flock() belongs to the open file, so a
+        # forked worker must not reuse its parent's descriptors.
+        if self._pid == os.getpid():
+            return
+        self._files = [open(path, "a+") for path in self._paths]
+        self._queue_files = [open(path, "a+") for path in self._queue_paths]
+        self._state_fd = os.open(self._state_path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._state_fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._state_fd).st_size < self._STATE.size:
+                os.pwrite(self._state_fd, self._STATE.pack(float(self.size), 0.0), 0)
+        finally:
+            fcntl.flock(self._state_fd, fcntl.LOCK_UN)
+        self._state = mmap.mmap(self._state_fd, self._STATE.size)
+        self._pid = os.getpid()
+        self._held = set()
+        self._queued = set()
+
+    def _read_state(self):
+        # Called with the lock held, after _open().
+        limit, last_decrease = self._STATE.unpack_from(self._state)
+        return min(float(self.size), max(float(self.min_limit), limit)), last_decrease
+
+    @property
+    def limit(self):
+        """Current number of usable slots, shared by all processes."""
+        with self._lock:
+            self._open()
+            return self._read_state()[0]
+
+    def try_acquire(self):
+        with self._lock:
+            self._open()
+            usable = int(self._read_state()[0])
+            for i in range(usable):
+                slot = (self._next + i) % usable
+                if slot in self._held:
+                    continue
+                try:
+                    fcntl.flock(self._files[slot], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                self._held.add(slot)
+                self._next = (slot + 1) % usable
+                return slot
+        return None
+
+    def _take_queue_place(self):
+        with self._lock:
+            self._open()
+            for place in range(self.max_queue):
+                if place in self._queued:
+                    continue
+                try:
+                    fcntl.flock(self._queue_files[place], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                self._queued.add(place)
+                return place
+        return None
+
+    def _leave_queue(self, place):
+        with self._lock:
+            if place in self._queued and self._pid == os.getpid():
+                fcntl.flock(self._queue_files[place], fcntl.LOCK_UN)
+                self._queued.discard(place)
+
+    def acquire(self, deadline):
+        """
+        A slot index, polling until time.monotonic() passes deadline; None if
+        none freed up. Raises HostQueueFull at once if max_queue callers on
+        this host are already waiting.
+        """
+        slot = self.try_acquire()
+        if slot is not None:
+            return slot
+        place = self._take_queue_place()
+        if place is None:
+            raise HostQueueFull()
+        try:
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                slot = self.try_acquire()
+                if slot is not None:
+                    return slot
+            return None
+        finally:
+            self._leave_queue(place)
+
+    def release(self, slot):
+        with self._lock:
+            if slot in self._held and self._pid == os.getpid():
+                fcntl.flock(self._files[slot], fcntl.LOCK_UN)
+                self._held.discard(slot)
+
+    def observe_status(self, status):
+        """Shared AIMD: 429 shrinks the host limit (once per cooldown), success grows it. True if it shrank."""
+        with self._lock:
+            self._open()
+            limit, _ = self._read_state()
+            if status != 429 and not (200 <= status < 300 and limit < self.size):
+                return False
+            fcntl.flock(self._state_fd, fcntl.LOCK_EX)
+            try:
+                limit, last_decrease = self._read_state()
+                if status == 429:
+                    now = time.time()
+                    if now - last_decrease < self.cooldown:
+                        return False
+                    self._STATE.pack_into(self._state, 0, max(float(self.min_limit), limit * self.backoff), now)
+                    return True
+                self._STATE.pack_into(self._state, 0, min(float(self.size), limit + 1.0 / limit), last_decrease)
+                return False
+            finally:
+                fcntl.flock(self._state_fd, fcntl.LOCK_UN)
+
+    def held(self):
+        with self._lock:
+            return len(self._held)
+
+
+class Ticket:
+    """An admitted call: when it started and the host slot it holds (None without a host cap)."""
+
+    __slots__ = ("started", "host_slot")
+
+    def __init__(self, started, host_slot=None):
+        self.started = started
+        self.host_slot = host_slot
+
+
+class AdmissionPool:
+    def __init__(self, name, max_in_flight, max_queue, queue_timeout,
+                 min_limit=1, backoff=0.5, cooldown=2.0, host=None, on_event=None):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.min_limit = max(1, min(min_limit, self.max_in_flight))
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.host = host
+        self.on_event = on_event
+        self.limit = float(self.max_in_flight)
+        self.in_flight = 0
+        self.waiting = 0
+        self._hold_ewma = 1.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition(threading.Lock())
+        self.counters = {"admitted": 0, "queued": 0, "rejected_full": 0, "rejected_timeout": 0,
+                         "rejected_host": 0, "throttled": 0, "host_throttled": 0}
+
+    def _count(self, name):
+        # Called with the lock held.
+        self.counters[name] += 1
+        if self.on_event is not None:
+            self.on_event(self.name, name)
+
+    def _has_room(self):
+        return self.in_flight < int(self.limit)
+
+    def _retry_after(self):
+        """Rough time until a queued caller would get a slot."""
+        estimate = self._hold_ewma * (self.waiting + 1) / max(1, int(self.limit))
+        return max(1, min(60, math.ceil(estimate)))
+
+    def acquire(self):
+        """Take a slot (waiting in the queue if needed); returns a Ticket for release() or raises Rejected."""
+        deadline = time.monotonic() + self.queue_timeout
+        with self._cond:
+            if not (self._has_room() and self.waiting == 0):
+                if self.waiting >= self.max_queue:
+                    self._count("rejected_full")
+                    raise Rejected(self.name, "queue full", self._retry_after())
+                self._count("queued")
+                self.waiting += 1
+                try:
+                    while not self._has_room():
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._count("rejected_timeout")
+                            raise Rejected(self.name, "queue timeout", self._retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+        host_slot = None
+        if self.host is not None:
+            # Waits out the rest of the queue budget for a slot on this host.
+            try:
+                host_slot = self.host.acquire(deadline)
+                reason = "host queue timeout"
+            except HostQueueFull:
+                host_slot, reason = None, "host queue full"
+            if host_slot is None:
+                with self._cond:
+                    self.in_flight -= 1
+                    self._cond.notify()
+                    self._count("rejected_host")
+                    raise Rejected(self.name, reason, self._retry_after())
+        with self._cond:
+            self._count("admitted")
+        return Ticket(time.monotonic(), host_slot)
+
+    def try_acquire(self):
+        """Take a slot only if one is free right now (never queues); returns a Ticket or None."""
+        with self._cond:
+            if not (self._has_room() and self.waiting == 0):
+                return None
+            self.in_flight += 1
+        host_slot = None
+        if self.host is not None:
+            host_slot = self.host.try_acquire()
+            if host_slot is None:
+                with self._cond:
+                    self.in_flight -= 1
+                    self._cond.notify()
+                return None
+        with self._cond:
+            self._count("admitted")
+        return Ticket(time.monotonic(), host_slot)
+
+    def release(self, ticket):
+        if ticket.host_slot is not None:
+            self.host.release(ticket.host_slot)
+        with self._cond:
+            self.in_flight -= 1
+            self._hold_ewma += 0.2 * ((time.monotonic() - ticket.started) - self._hold_ewma)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        ticket = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def observe_status(self, status):
+        """Feed back one upstream response status: 429 shrinks the limits, success grows them."""
+        if self.host is not None and self.host.observe_status(status):
+            with self._cond:
+                self._count("host_throttled")
+        with self._cond:
+            if status == 429:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                    self._count("throttled")
+            elif 200 <= status < 300 and self.limit < self.max_in_flight:
+                grew = int(self.limit + 1.0 / self.limit) > int(self.limit)
+                self.limit = min(float(self.max_in_flight), self.limit + 1.0 / self.limit)
+                if grew:
+                    self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats.update(limit=round(self.limit, 2), max_in_flight=self.max_in_flight,
+                         in_flight=self.in_flight, waiting=self.waiting, max_queue=self.max_queue)
+        if self.host is not None:
+            stats.update(host_max_in_flight=self.host.size, host_limit=round(self.host.limit, 2),
+                         host_max_queue=self.host.max_queue, host_slots_held=self.host.held())
+        return stats
@@ -1,15 +1,186 @@
 import os
-import base64
+import json
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g, has_request_context, make_response, stream_with_context
 from flask_cors import CORS
 
+import admission
+import breaker
+import cache
+import engine
+import hedging
+import imaging
+import metrics
+import question_cache
+import router
+import sessions
+import singleflight
+import statedir
+import timing
+import uploads
+import upstream
+
 app = Flask(__name__)
+app.request_class = uploads.SpoolingRequest
+app.config["MAX_CONTENT_LENGTH"] = uploads.MAX_UPLOAD_BYTES
 CORS(app)
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-OPENAI_MODEL = "gpt-4.1-mini"
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
+OPENAI_API_URL = upstream.CHAT_COMPLETIONS_URL
+
+# Per-tool models and the set of backends calls are spread over; a single
+# OPENAI_API_BASE backend unless UPSTREAM_BACKENDS is set (see router.py).
+model_router = router.from_env(OPENAI_MODEL, upstream.OPENAI_API_BASE)
+
+
+# Bump a tool's version whenever its prompt text changes, so cached answers
+# produced by the old prompt are no longer served.
+PROMPT_VERSIONS = {
+    "bmi-analysis": 2,
+    "dose-x": 1,
+    "cardiac-risk": 2,
+    "lab-blood": 2,
+    "chromosome": 1,
+    "cancer-cell": 1,
+    "chest-xray": 1,
+    "doctor-chat": 1,
+}
+
+response_cache = cache.ResponseCache(
+    max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "86400")),
+    disk_path=os.environ.get("RESPONSE_CACHE_PATH") or None,
+    disk_max_entries=int(os.environ.get("RESPONSE_CACHE_DISK_MAX_ENTRIES", "100000")),
+    on_event=lambda event: metrics.CACHE_EVENTS.labels("response", event).inc(),
+)
+
+
+def _state_file(env_name, filename):
+    """Path from env_name ("" = none), else filename in the private "cache" state dir if available."""
+    if env_name in os.environ:
+        return os.environ[env_name] or None
+    directory = statedir.private_dir("cache")
+    return os.path.join(directory, filename) if directory else None
+
+
+# Vision results are keyed on the image hash and shared across workers through
+# a SQLite file in the per-user state directory (see statedir.py) by default;
+# set VISION_CACHE_PATH="" to keep it in memory only.
+vision_cache = cache.ResponseCache(
+    max_entries=int(os.environ.get("VISION_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("VISION_CACHE_TTL", "604800")),
+    disk_path=_state_file("VISION_CACHE_PATH", "vision-cache.sqlite"),
+    disk_max_entries=int(os.environ.get("VISION_CACHE_MAX_ENTRIES", "20000")),
+    disk_max_bytes=int(os.environ.get("VISION_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    on_event=lambda event: metrics.CACHE_EVENTS.labels("vision", event).inc(),
+)
+
+# Free-text doctor-chat questions: a stored answer is reused for a paraphrase
+# whose estimated word-set similarity reaches QUESTION_CACHE_THRESHOLD, has the
+# same negation / population words and at least QUESTION_CACHE_MIN_WORDS words
+# (shorter questions only match exactly; see question_cache.py).
+# Per worker process, in memory; QUESTION_CACHE_SIZE=0 turns it off.
+doctor_chat_cache = question_cache.QuestionCache(
+    max_entries=int(os.environ.get("QUESTION_CACHE_SIZE", "5000")),
+    threshold=float(os.environ.get("QUESTION_CACHE_THRESHOLD", "0.9")),
+    ttl=float(os.environ.get("QUESTION_CACHE_TTL", "86400")),
+    min_words=int(os.environ.get("QUESTION_CACHE_MIN_WORDS", "4")),
+    on_event=lambda event: metrics.CACHE_EVENTS.labels("question", event).inc(),
+)
+
+# Multi-turn doctor-chat sessions. Shared across workers through a SQLite file
+# in the per-user state directory by default; SESSION_STORE_PATH="" keeps them
+# per process.
+doctor_chat_sessions = sessions.SessionStore(
+    path=_state_file("SESSION_STORE_PATH", "sessions.sqlite"),
+    max_sessions=int(os.environ.get("SESSION_MAX_SESSIONS", "10000")),
+    max_bytes=int(os.environ.get("SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+    idle_ttl=float(os.environ.get("SESSION_IDLE_TTL", "3600")),
+    on_event=lambda event: metrics.SESSION_EVENTS.labels(event).inc(),
+)
+# Token budgets for the history part of a session prompt.
+SESSION_CONTEXT_TOKENS = int(os.environ.get("SESSION_CONTEXT_TOKENS", "1200"))
+SESSION_SUMMARY_TOKENS = int(os.environ.get("SESSION_SUMMARY_TOKENS", "300"))
+SESSION_RECENT_TURNS = int(os.environ.get("SESSION_RECENT_TURNS", "6"))
+
+# Identical concurrent upstream calls share one request. COALESCE_LOCK_DIR
+# extends this across the gunicorn workers of one host.
+COALESCE_ENABLED = os.environ.get("COALESCE_ENABLED", "1") != "0"
+coalescer = singleflight.SingleFlight(
+    lock_dir=os.environ.get("COALESCE_LOCK_DIR") or None,
+    wait_timeout=float(os.environ.get("COALESCE_WAIT_TIMEOUT", "90")),
+    on_event=lambda event: metrics.COALESCE_EVENTS.labels(event).inc(),
+)
+
+# Caps on concurrent upstream calls, with a short bounded queue in front;
+# separate pools keep chat and vision from starving each other. The
+# *_MAX_IN_FLIGHT caps hold per worker; the *_HOST_MAX_IN_FLIGHT caps hold
+# across all workers of this host (slot files under ADMISSION_LOCK_DIR), so
+# they apply under sync workers too; each has its own bounded queue
+# (*_HOST_MAX_QUEUE) and shrinks for the whole host when upstream answers
+# 429. A host cap of 0 turns it off.
+ADMISSION_LOCK_DIR = os.environ.get("ADMISSION_LOCK_DIR") or statedir.private_dir("admission")
+
+
+def _host_semaphore(name, size, max_queue):
+    if size <= 0 or not ADMISSION_LOCK_DIR:
+        return None
+    return admission.HostSemaphore(ADMISSION_LOCK_DIR, name, size, max_queue=max_queue)
+
+
+chat_admission = admission.AdmissionPool(
+    "chat",
+    max_in_flight=int(os.environ.get("ADMISSION_CHAT_MAX_IN_FLIGHT", "32")),
+    max_queue=int(os.environ.get("ADMISSION_CHAT_MAX_QUEUE", "64")),
+    queue_timeout=float(os.environ.get("ADMISSION_CHAT_QUEUE_TIMEOUT", "10")),
+    host=_host_semaphore("chat", int(os.environ.get("ADMISSION_CHAT_HOST_MAX_IN_FLIGHT", "64")),
+                         int(os.environ.get("ADMISSION_CHAT_HOST_MAX_QUEUE", "64"))),
+    on_event=lambda pool, event: metrics.ADMISSION_EVENTS.labels(pool, event).inc(),
+)
+vision_admission = admission.AdmissionPool(
+    "vision",
+    max_in_flight=int(os.environ.get("ADMISSION_VISION_MAX_IN_FLIGHT", "8")),
+    max_queue=int(os.environ.get("ADMISSION_VISION_MAX_QUEUE", "16")),
+    queue_timeout=float(os.environ.get("ADMISSION_VISION_QUEUE_TIMEOUT", "20")),
+    host=_host_semaphore("vision", int(os.environ.get("ADMISSION_VISION_HOST_MAX_IN_FLIGHT", "16")),
+                         int(os.environ.get("ADMISSION_VISION_HOST_MAX_QUEUE", "16"))),
+    on_event=lambda pool, event: metrics.ADMISSION_EVENTS.labels(pool, event).inc(),
+)
+ADMISSION_POOLS = {"chat": chat_admission, "chat_stream": chat_admission, "vision": vision_admission}
+
+# Fail fast while upstream keeps failing or breaching its latency SLO, instead
+# of letting every request wait out the full read timeout.
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", "5"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "15"))
+chat_breaker = breaker.CircuitBreaker(
+    "chat", BREAKER_FAILURES,
+    slo_seconds=float(os.environ.get("BREAKER_CHAT_SLO", "20")),
+    open_seconds=BREAKER_OPEN_SECONDS,
+    on_event=lambda name, event: metrics.BREAKER_EVENTS.labels(name, event).inc(),
+)
+vision_breaker = breaker.CircuitBreaker(
+    "vision", BREAKER_FAILURES,
+    slo_seconds=float(os.environ.get("BREAKER_VISION_SLO", "45")),
+    open_seconds=BREAKER_OPEN_SECONDS,
+    on_event=lambda name, event: metrics.BREAKER_EVENTS.labels(name, event).inc(),
+)
+BREAKERS = {"chat": chat_breaker, "chat_stream": chat_breaker, "vision": vision_breaker}
+
+# Opt-in hedging of text calls: a duplicate request after the recent p95
+# latency. HEDGE_BUDGET is the extra upstream load allowed (at most 1.0).
+chat_hedger = None
+if os.environ.get("HEDGE_ENABLED", "0") == "1":
+    chat_hedger = hedging.Hedger(
+        "chat",
+        ThreadPoolExecutor(max_workers=int(os.environ.get("HEDGE_MAX_WORKERS", "64")), thread_name_prefix="hedge"),
+        budget_ratio=float(os.environ.get("HEDGE_BUDGET", "0.1")),
+        quantile=float(os.environ.get("HEDGE_QUANTILE", "95")),
+        on_event=lambda name, event: metrics.HEDGE_EVENTS.labels(name, event).inc(),
+    )
 
 
 def _require_api_key():
@@ -18,61 +189,363 @@ def _require_api_key():
     Nếu chưa có (ví dụ khi chạy qua WSGI mà không set env),
     trả về lỗi 500 để tránh gọi OpenAI mà không có key.
     """
-    if not OPENAI_API_KEY:
-        return jsonify({"error": "OPENAI_API_KEY is not configured on the server."}), 500
+    if not OPENAI_API_KEY and model_router.needs_default_key:
+        return {"error": "OPENAI_API_KEY is not configured on the server."}, 500
     return None
 
 
-def call_openai_chat(messages, temperature=0.2, max_tokens=800):
-    """Generic helper for text-only chat."""
+def _json_response(body, status):
+    """jsonify(body) with `status`; busy errors also get a Retry-After header."""
+    response = jsonify(body)
+    response.status_code = status
+    if status == 503 and "retry_after" in body:
+        response.headers["Retry-After"] = str(body["retry_after"])
+    return response
+
+
+def _as_response(err):
+    """Turn a plain (body, status) error into the response routes return."""
+    if err is None:
+        return None
+    return _json_response(*err)
+
+
+def _openai_headers(backend=None):
+    # router.from_env() leaves api_key None only on backends meant to use
+    # OPENAI_API_KEY; a backend with its own api_key_env never gets here unset.
+    api_key = backend.api_key if backend is not None and backend.api_key is not None else OPENAI_API_KEY
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+
+
+def _post_via_router(make_body, model, tool, kind, read_timeout, stream=False):
+    """model_router.post() with this app's headers, admission feedback and metrics."""
+    return model_router.post(
+        make_body, model, tool, kind, _openai_headers, read_timeout, stream=stream,
+        on_attempt=ADMISSION_POOLS[kind].observe_status,
+        on_result=lambda backend, status, seconds: metrics.observe_upstream(kind, status, seconds, backend.name),
+    )
+
+
+def _post_and_parse(payload, read_timeout, label, kind="chat", tool=None, image=None):
+    """
+    One upstream round trip. Returns (answer, None) or (None, (error body, status));
+    both are plain JSON values so the outcome can be shared between coalesced callers.
+    `kind` labels the call in the upstream metrics, `tool` selects cheap
+    backends in the router. With `image` (an imaging.NormalizedImage) the
+    payload's IMAGE_URL_PLACEHOLDER is filled with its base64 data URL.
+    """
+    bodies = []
+
+    def make_body(model):
+        # Built per backend, since backends may serve the model under another name.
+        with metrics.phase("serialize"):
+            if image is None:
+                body = json.dumps({**payload, "model": model}).encode("utf-8")
+            else:
+                # Base64 is encoded chunk by chunk while the body is being sent.
+                body = uploads.image_payload_body({**payload, "model": model}, image.stream, image.mime)
+        metrics.observe_bytes("upstream_request", len(body))
+        bodies.append(body)
+        return body
+
+    circuit = BREAKERS[kind]
+    try:
+        token = circuit.before_call()
+    except breaker.CircuitOpen as e:
+        return None, _circuit_open_error(e.retry_after)
+
+    start = time.perf_counter()
+    try:
+        resp, backend = _post_via_router(make_body, payload["model"], tool, kind, read_timeout)
+    except requests.RequestException as e:
+        circuit.record(token, False, time.perf_counter() - start)
+        return None, ({"error": f"Error calling {label}: {e}"}, 502)
+    elapsed = time.perf_counter() - start
+    circuit.record(token, resp.status_code < 500, elapsed)
+    # A streamed vision body is base64-encoded while it is sent; report that separately.
+    encode_seconds = sum(getattr(body, "encode_seconds", 0.0) for body in bodies)
+    if encode_seconds:
+        metrics.add_phase("encode", encode_seconds)
+    metrics.add_phase("upstream", elapsed - encode_seconds)
+
+    if resp.status_code != 200:
+        return None, ({
+            "error": f"{label} returned status {resp.status_code} (backend {backend.name})",
+            "details": resp.text
+        }, 502)
+
+    with metrics.phase("parse"):
+        data = resp.json()
+    metrics.observe_bytes("upstream_response", len(resp.content))
+    metrics.observe_tokens(kind, payload["model"], data.get("usage"))
+    try:
+        answer = data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError):
+        return None, ({"error": f"Unexpected response format from {label}.", "raw": data}, 502)
+
+    return answer, None
+
+
+def _unavailable_error(message, retry_after):
+    """Plain 503 error; retry_after becomes the Retry-After header."""
+    return {"error": message, "retry_after": retry_after}, 503
+
+
+def _busy_error(rejected):
+    return _unavailable_error("The AI service is busy right now; please try again shortly.", rejected.retry_after)
+
+
+def _circuit_open_error(retry_after):
+    return _unavailable_error("The AI service is not responding right now; please try again shortly.", retry_after)
+
+
+def _admitted(pool, fn):
+    """Run fn() in one of pool's upstream slots; a plain 503 error if none frees up in time."""
+    try:
+        with pool.slot():
+            return fn()
+    except admission.Rejected as e:
+        return None, _busy_error(e)
+
+
+def _coalesced(key, fn):
+    """Run fn() through the single-flight layer, so identical concurrent calls share one upstream request."""
+    if not COALESCE_ENABLED:
+        return fn()
+    answer, err = coalescer.do(key, fn)
+    return answer, (tuple(err) if err else None)
+
+
+def chat_completion(messages, temperature=0.2, max_tokens=800, tool=None):
+    """
+    Text-only chat without Flask objects: (answer, None) or (None, (error body, status)).
+    `tool` picks the model and backends (see router.py).
+    """
     err = _require_api_key()
     if err:
         return None, err
 
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
+    payload = {
+        "model": model_router.model_for(tool),
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
     }
+    retry_after = chat_breaker.open_retry_after()
+    if retry_after:
+        return None, _circuit_open_error(retry_after)
+
+    def attempt():
+        return _post_and_parse(payload, 40, "OpenAI", tool=tool)
+
+    def primary():
+        return _admitted(chat_admission, attempt)
+
+    def hedge():
+        # The duplicate only goes out if a slot is free right now; it never queues.
+        ticket = chat_admission.try_acquire()
+        if ticket is None:
+            return None
+        try:
+            return attempt()
+        finally:
+            chat_admission.release(ticket)
+
+    def hedged():
+        with metrics.phase("upstream"):
+            return chat_hedger.run(primary, hedge)
+
+    key = singleflight.payload_key("chat", payload)
+    return _coalesced(key, hedged if chat_hedger is not None else primary)
+
+
+def call_openai_chat(messages, temperature=0.2, max_tokens=800, tool=None):
+    """Generic helper for text-only chat."""
+    answer, err = chat_completion(messages, temperature, max_tokens, tool)
+    return answer, _as_response(err)
+
+
+def call_openai_chat_stream(messages, temperature=0.2, max_tokens=800, tool=None):
+    """
+    Streaming variant of call_openai_chat.
+    Returns (DeltaStream of text deltas, None) once upstream has accepted the
+    request, or (None, error response) like the non-streaming helper.
+    """
+    err = _require_api_key()
+    if err:
+        return None, _as_response(err)
+
+    model = model_router.model_for(tool)
     payload = {
-        "model": OPENAI_MODEL,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
+        "stream": True,
+        # Adds a final chunk with token usage, for the metrics.
+        "stream_options": {"include_usage": True},
     }
 
     try:
-        resp = requests.post(OPENAI_API_URL, headers=headers, json=payload, timeout=40)
+        ticket = chat_admission.acquire()
+    except admission.Rejected as e:
+        return None, _as_response(_busy_error(e))
+    try:
+        token = chat_breaker.before_call()
+    except breaker.CircuitOpen as e:
+        chat_admission.release(ticket)
+        return None, _as_response(_circuit_open_error(e.retry_after))
+
+    start = time.perf_counter()
+    try:
+        resp, _ = _post_via_router(
+            lambda backend_model: json.dumps({**payload, "model": backend_model}).encode("utf-8"),
+            model, tool, "chat_stream", read_timeout=40, stream=True,
+        )
     except requests.RequestException as e:
+        chat_admission.release(ticket)
+        chat_breaker.record(token, False, time.perf_counter() - start)
         return None, (jsonify({"error": f"Error calling OpenAI: {e}"}), 502)
+    # Latency up to the response headers, i.e. until the stream starts.
+    elapsed = time.perf_counter() - start
+    chat_breaker.record(token, resp.status_code < 500, elapsed)
+    metrics.add_phase("upstream", elapsed)
 
     if resp.status_code != 200:
+        chat_admission.release(ticket)
         return None, (jsonify({
             "error": f"OpenAI returned status {resp.status_code}",
             "details": resp.text
         }), 502)
 
-    data = resp.json()
-    try:
-        answer = data["choices"][0]["message"]["content"]
-    except (KeyError, IndexError):
-        return None, (jsonify({"error": "Unexpected response format from OpenAI.", "raw": data}), 502)
+    return DeltaStream(resp, lambda: chat_admission.release(ticket), model=model), None
 
-    return answer, None
 
+class DeltaStream:
+    """
+    Iterator over the text deltas of a streamed completion. close() (run
+    when iteration ends, or by the response even if it never started)
+    releases the connection and the admission slot, exactly once.
+    """
 
-def call_openai_vision(image_bytes, system_prompt, user_instruction, temperature=0.2, max_tokens=800):
+    def __init__(self, resp, on_close=None, model=""):
+        self.resp = resp
+        self.on_close = on_close
+        self.model = model
+        self._closed = False
+
+    def __iter__(self):
+        try:
+            # chunk_size=None hands over each chunk as it arrives instead of
+            # waiting for a full read buffer, which would delay the first token.
+            for line in self.resp.iter_lines(chunk_size=None):
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip().decode("utf-8")
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                    if chunk.get("usage"):
+                        metrics.observe_tokens("chat_stream", self.model, chunk["usage"])
+                    piece = chunk["choices"][0]["delta"].get("content")
+                except (ValueError, KeyError, IndexError):
+                    continue
+                if piece:
+                    yield piece
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.resp.close()
+        if self.on_close is not None:
+            self.on_close()
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(deltas, on_done=None):
     """
-    Helper for vision (image + text) using Chat Completions.
-    We send a data URL (base64) to GPT as an image_url.
+    Relay text deltas to the browser as Server-Sent Events:
+    "delta" events with {"text": ...}, then one "done" event with the full
+    {"answer": ...}, or an "error" event if upstream breaks off mid-stream.
+    on_done(answer), if given, sees the full answer of a completed stream.
+    """
+    def events():
+        parts = []
+        try:
+            for piece in deltas:
+                parts.append(piece)
+                yield _sse("delta", {"text": piece})
+        except requests.RequestException as e:
+            yield _sse("error", {"error": f"Error while streaming from OpenAI: {e}"})
+            return
+        answer = "".join(parts)
+        if on_done is not None and answer:
+            on_done(answer)
+        yield _sse("done", {"answer": answer})
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if hasattr(deltas, "close"):
+        response.call_on_close(deltas.close)
+    return response
+
+
+def _wants_stream(data):
+    """Opt-in streaming: {"stream": true} in the body or an Accept: text/event-stream header."""
+    return bool(data.get("stream")) or "text/event-stream" in request.headers.get("Accept", "")
+
+
+def vision_completion(image, system_prompt, user_instruction, temperature=0.2, max_tokens=800, image_sha256=None,
+                      tool=None):
+    """
+    Vision (image + text) chat without Flask objects: (answer, None) or
+    (None, (error body, status)). `image` is raw bytes or a seekable file
+    (e.g. the spooled upload); the base64 text is streamed into the request
+    body rather than built in memory. `tool` picks the model and backends.
     """
     err = _require_api_key()
     if err:
         return None, err
 
-    # Encode image as base64
-    image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-    # For simplicity we label as JPEG; using .jpg images is recommended.
-    image_data_url = f"data:image/jpeg;base64,{image_b64}"
+    retry_after = vision_breaker.open_retry_after()
+    if retry_after:
+        return None, _circuit_open_error(retry_after)
+
+    image = uploads.as_stream(image)
+    model = model_router.model_for(tool)
+    key = singleflight.payload_key(
+        "vision", model, image_sha256 or uploads.hash_stream(image),
+        system_prompt, user_instruction, temperature, max_tokens,
+    )
+    # The vision slot also covers image normalization, which bounds decode memory.
+    return _coalesced(key, lambda: _admitted(
+        vision_admission,
+        lambda: _send_vision(image, system_prompt, user_instruction, temperature, max_tokens, model, tool),
+    ))
+
+
+def _send_vision(image, system_prompt, user_instruction, temperature, max_tokens, model, tool):
+    # Downscale / re-encode / strip metadata, then label with the real MIME type.
+    with metrics.phase("normalize"):
+        image = imaging.normalize(image)
+    metrics.observe_bytes("image_in", image.bytes_in)
+    metrics.observe_bytes("image_out", image.bytes_out)
+    if has_request_context():
+        g.image_bytes = (image.bytes_in, image.bytes_out)
+        app.logger.info("vision image %s: %d -> %d bytes (%s)",
+                        request.path, image.bytes_in, image.bytes_out, image.mime)
 
     # Chat Completions format: system content is string,
     # user content is an array of parts (text + image_url)
@@ -91,7 +564,7 @@ def call_openai_vision(image_bytes, system_prompt, user_instruction, temperature
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": image_data_url,
+                        "url": uploads.IMAGE_URL_PLACEHOLDER,
                         # "detail": "high",  # you can enable this if you want higher-cost, higher-detail vision
                     },
                 },
@@ -99,47 +572,321 @@ def call_openai_vision(image_bytes, system_prompt, user_instruction, temperature
         },
     ]
 
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-    }
     payload = {
-        "model": OPENAI_MODEL,
+        "model": model,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
+    return _post_and_parse(payload, 60, "OpenAI (vision)", kind="vision", tool=tool, image=image)
 
-    try:
-        resp = requests.post(OPENAI_API_URL, headers=headers, json=payload, timeout=60)
-    except requests.RequestException as e:
-        return None, (jsonify({"error": f"Error calling OpenAI (vision): {e}"}), 502)
 
-    if resp.status_code != 200:
-        return None, (jsonify({
-            "error": f"OpenAI (vision) returned status {resp.status_code}",
-            "details": resp.text
-        }), 502)
+def call_openai_vision(image, system_prompt, user_instruction, temperature=0.2, max_tokens=800, image_sha256=None,
+                       tool=None):
+    """
+    Helper for vision (image + text) using Chat Completions.
+    We send a data URL (base64) to GPT as an image_url.
+    """
+    answer, err = vision_completion(image, system_prompt, user_instruction, temperature, max_tokens, image_sha256,
+                                    tool)
+    return answer, _as_response(err)
+
+
+def _cache_mode():
+    """
+    Cache control for the current request: ?cache=bypass|refresh or the
+    X-Cache-Mode header. "bypass" skips the cache entirely, "refresh" skips
+    the lookup but stores the fresh answer.
+    """
+    mode = (request.args.get("cache") or request.headers.get("X-Cache-Mode") or "").strip().lower()
+    return mode if mode in ("bypass", "refresh") else "use"
+
+
+def _through_cache(store, key, compute, mode):
+    """
+    Serve `key` from `store` according to `mode` ("use", "bypass" or "refresh"),
+    else run compute(). Returns (answer, err, cache status for the X-Cache header).
+    """
+    if mode == "use":
+        answer = store.get(key)
+        if answer is not None:
+            return answer, None, "HIT"
+        status = "MISS"
+    elif mode == "bypass":
+        store.note_bypass()
+        status = "BYPASS"
+    else:
+        status = "REFRESH"
+
+    answer, err = compute()
+    if err:
+        return None, err, status
+    if mode != "bypass":
+        store.set(key, answer)
+    return answer, None, status
+
+
+# Each vision tool registers a *_prompts function returning its
+# (system prompt, user instruction); the upload routes and offline scripts
+# run them through run_vision_tool().
+VISION_TOOLS = {}
+
+
+def vision_tool(name):
+    """Register a *_prompts function under its tool name."""
+    def register(prompts):
+        VISION_TOOLS[name] = prompts
+        return prompts
+    return register
+
+
+def run_vision_tool(tool, image, cache_mode="use"):
+    """
+    Run a vision tool on an image (bytes or a seekable file) behind the
+    content-addressed vision cache; a repeated image is answered without
+    encoding or calling upstream. Returns (body, status, cache status);
+    plain values only, so it is safe to call outside a request.
+    """
+    system_prompt, user_instruction = VISION_TOOLS[tool]()
+    image = uploads.as_stream(image)
+    with metrics.phase("hash"):
+        digest = uploads.hash_stream(image)
+    key = cache.make_key(tool, PROMPT_VERSIONS[tool], {"sha256": digest, "model": model_router.model_for(tool)})
+    answer, err, cache_status = _through_cache(
+        vision_cache, key,
+        lambda: vision_completion(image, system_prompt, user_instruction, image_sha256=digest, tool=tool),
+        cache_mode,
+    )
+    if err:
+        body, status = err
+        return body, status, cache_status
+    return {"analysis": answer}, 200, cache_status
+
+
+def vision_tool_api(tool):
+    """Shared body of the image upload routes."""
+    with metrics.phase("form"):
+        file = request.files.get("image")
+    if not file:
+        return jsonify({"error": "No image uploaded."}), 400
+
+    # Spooled to disk for large uploads; never read into one bytes object.
+    body, status, cache_status = run_vision_tool(tool, file.stream, _cache_mode())
+    if cache_status:
+        g.cache_status = cache_status
+    return _json_response(body, status)
+
+
+# ========= Text tool plumbing =========
+#
+# Each JSON text tool has a build_* function that validates the payload and
+# builds the prompt, returning (ToolCall, None) or (None, (error body, status)).
+# The HTTP routes, /api/batch and offline scripts all run tools through
+# run_tool_call(), so validation, prompts and caching live in one place.
+
+# local_body, when set, is a complete answer computed on the server (mode=fast):
+# run_tool_call() returns it as-is without calling upstream.
+# question, when set, is free text looked up in the near-duplicate doctor_chat_cache.
+ToolCall = namedtuple("ToolCall", "tool messages cache_inputs result_key options local_body question",
+                      defaults=(None, None))
+
+TEXT_TOOLS = {}
+
+
+def _fast_mode(data):
+    """mode=fast: answer from the local engine without calling the model."""
+    return str(data.get("mode") or "").strip().lower() == "fast"
 
-    data = resp.json()
+
+def _non_scalar_error(data, fields):
+    """400 if any of these fields is a JSON list or object; the tools take one value each."""
+    bad = [field for field in fields if isinstance(data.get(field), (list, dict))]
+    if bad:
+        return {"error": f"{', '.join(bad)} must be single values, not lists or objects."}, 400
+    return None
+
+
+def _as_float(value):
+    """A scalar request value as a float, NaN if it is not a number."""
     try:
-        answer = data["choices"][0]["message"]["content"]
-    except (KeyError, IndexError):
-        return None, (jsonify({"error": "Unexpected response format from OpenAI (vision).", "raw": data}), 502)
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _fast_body(text, computed):
+    return {"analysis": text, "computed": computed, "mode": "fast"}
+
+
+def text_tool(name):
+    """Register a build_* function under its tool name."""
+    def register(builder):
+        TEXT_TOOLS[name] = builder
+        return builder
+    return register
+
+
+def question_key(call):
+    """doctor_chat_cache key of a ToolCall with a free-text question."""
+    namespace = f"{call.tool}:{PROMPT_VERSIONS[call.tool]}:{model_router.model_for(call.tool)}"
+    return namespace, call.question
+
+
+def run_tool_call(call, cache_mode="use"):
+    """
+    Run a built ToolCall upstream, through the response cache when the tool
+    has cache inputs (or the near-duplicate cache for a free-text question).
+    Returns (body, status, cache status or None); plain values only, so it
+    is safe to call outside a request.
+    """
+    if call.local_body is not None:
+        return call.local_body, 200, None
+
+    def compute():
+        return chat_completion(call.messages, tool=call.tool, **call.options)
+
+    if call.question is not None:
+        answer, err, cache_status = _through_cache(doctor_chat_cache, question_key(call), compute, cache_mode)
+    elif call.cache_inputs is None:
+        answer, err = compute()
+        cache_status = None
+    else:
+        # Keyed on the model too, so re-assigning a tool's model does not serve stale answers.
+        key = cache.make_key(call.tool, PROMPT_VERSIONS[call.tool],
+                             {**call.cache_inputs, "model": model_router.model_for(call.tool)})
+        answer, err, cache_status = _through_cache(response_cache, key, compute, cache_mode)
+    if err:
+        body, status = err
+        return body, status, cache_status
+    return {call.result_key: answer}, 200, cache_status
+
+
+def run_text_tool(tool, data, cache_mode="use"):
+    """Validate, build and run one text tool on a JSON payload: (body, status, cache status)."""
+    call, err = TEXT_TOOLS[tool](data)
+    if err:
+        body, status = err
+        return body, status, None
+    return run_tool_call(call, cache_mode)
+
+
+def text_tool_api(tool, data=None):
+    """Shared body of the JSON text routes."""
+    if data is None:
+        with metrics.phase("form"):
+            data = request.get_json(silent=True) or {}
+    if "mode" in request.args:
+        data = {**data, "mode": request.args["mode"]}
+    body, status, cache_status = run_text_tool(tool, data, _cache_mode())
+    if cache_status:
+        g.cache_status = cache_status
+    return _json_response(body, status)
+
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@app.before_request
+def _start_instrumentation():
+    if request.path.startswith("/api/"):
+        metrics.start_request(_route_label())
+        metrics.observe_bytes("request", request.content_length)
+        timing.start_request()
+
+
+@app.after_request
+def _finish_instrumentation(response):
+    timing.finish_request(_route_label(), response)
+    metrics.finish_request(request.method, response)
+    return response
+
+
+@app.after_request
+def _add_cache_header(response):
+    status = g.get("cache_status")
+    if status:
+        response.headers["X-Cache"] = status
+    image_bytes = g.get("image_bytes")
+    if image_bytes:
+        response.headers["X-Image-Bytes-In"] = str(image_bytes[0])
+        response.headers["X-Image-Bytes-Out"] = str(image_bytes[1])
+    return response
+
+
+@app.errorhandler(413)
+def _upload_too_large(e):
+    limit_mb = uploads.MAX_UPLOAD_BYTES / (1024 * 1024)
+    return jsonify({"error": f"Upload too large (max {limit_mb:g} MB)."}), 413
 
-    return answer, None
+
+@app.route("/metrics", methods=["GET"])
+def metrics_api():
+    """Prometheus scrape endpoint; covers all gunicorn workers when PROMETHEUS_MULTIPROC_DIR is set."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@app.route("/api/cache-stats", methods=["GET"])
+def cache_stats_api():
+    """Hit/miss counters of the response, vision and question caches (for this worker process)."""
+    return jsonify({"response": response_cache.stats(), "vision": vision_cache.stats(),
+                    "question": doctor_chat_cache.stats()})
+
+
+@app.route("/api/admission-stats", methods=["GET"])
+def admission_stats_api():
+    """Limits, queue depth and rejections of the upstream admission pools (this worker, plus the host caps)."""
+    return jsonify({"chat": chat_admission.stats(), "vision": vision_admission.stats()})
+
+
+@app.route("/api/breaker-stats", methods=["GET"])
+def breaker_stats_api():
+    """State and counters of the upstream circuit breakers (for this worker process)."""
+    return jsonify({"chat": chat_breaker.stats(), "vision": vision_breaker.stats()})
+
+
+@app.route("/api/hedge-stats", methods=["GET"])
+def hedge_stats_api():
+    """Hedged text calls and how often the duplicate won (for this worker process)."""
+    return jsonify({"enabled": chat_hedger is not None, "chat": chat_hedger.stats() if chat_hedger else None})
+
+
+@app.route("/api/router-stats", methods=["GET"])
+def router_stats_api():
+    """Per-tool models and per-backend latency / error EWMAs (for this worker process)."""
+    return jsonify(model_router.stats())
+
+
+@app.route("/api/session-stats", methods=["GET"])
+def session_stats_api():
+    """Doctor-chat session store usage; ?session_id= adds that session's size and token savings."""
+    body = {"store": doctor_chat_sessions.stats()}
+    session_id = request.args.get("session_id")
+    if session_id:
+        session = doctor_chat_sessions.peek(session_id) if sessions.SESSION_ID.match(session_id) else None
+        if session is None:
+            return jsonify({"error": "Unknown or expired session."}), 404
+        body["session"] = session.stats()
+    return jsonify(body)
+
+
+@app.route("/api/coalescing-stats", methods=["GET"])
+def coalescing_stats_api():
+    """How many upstream calls were led vs. coalesced (for this worker process)."""
+    return jsonify(coalescer.stats())
 
 
 # ========= Vision endpoints =========
 
 @app.route("/api/chromosome", methods=["POST"])
 def chromosome_api():
-    file = request.files.get("image")
-    if not file:
-        return jsonify({"error": "No image uploaded."}), 400
+    return vision_tool_api("chromosome")
 
-    image_bytes = file.read()
 
+@vision_tool("chromosome")
+def chromosome_prompts():
+    """Prompts for chromosome / karyotype spread images."""
     system_prompt = (
         "You are Doctor Cal, an AI assistant role-playing as a friendly virtual doctor in cytogenetics. "
         "You speak in simple, conversational English with only a few basic medical terms. "
@@ -165,20 +912,17 @@ def chromosome_api():
         "Do not structure the answer as 1), 2), 3) and do not use bullet points."
     )
 
-    answer, err = call_openai_vision(image_bytes, system_prompt, user_instruction)
-    if err:
-        return err
-    return jsonify({"analysis": answer})
+    return system_prompt, user_instruction
 
 
 @app.route("/api/cancer-cell", methods=["POST"])
 def cancer_cell_api():
-    file = request.files.get("image")
-    if not file:
-        return jsonify({"error": "No image uploaded."}), 400
+    return vision_tool_api("cancer-cell")
 
-    image_bytes = file.read()
 
+@vision_tool("cancer-cell")
+def cancer_cell_prompts():
+    """Prompts for microscopy / cytology images of cells."""
     system_prompt = (
         "You are Doctor Cal, an AI assistant role-playing as a friendly virtual doctor in histopathology. "
         "You speak in simple, conversational English with only a few basic medical terms. "
@@ -204,20 +948,17 @@ def cancer_cell_api():
         "Do not use bullet points or numbered steps in your final answer."
     )
 
-    answer, err = call_openai_vision(image_bytes, system_prompt, user_instruction)
-    if err:
-        return err
-    return jsonify({"analysis": answer})
+    return system_prompt, user_instruction
 
 
 @app.route("/api/chest-xray", methods=["POST"])
 def chest_xray_api():
-    file = request.files.get("image")
-    if not file:
-        return jsonify({"error": "No image uploaded."}), 400
+    return vision_tool_api("chest-xray")
 
-    image_bytes = file.read()
 
+@vision_tool("chest-xray")
+def chest_xray_prompts():
+    """Prompts for chest X-ray images."""
     system_prompt = (
         "You are Doctor Cal, an AI assistant role-playing as a friendly virtual doctor in chest radiology. "
         "You speak in simple, conversational English with only a few basic medical terms. "
@@ -243,23 +984,44 @@ def chest_xray_api():
         "Do not use bullet points or numbered steps in your final answer."
     )
 
-    answer, err = call_openai_vision(image_bytes, system_prompt, user_instruction)
-    if err:
-        return err
-    return jsonify({"analysis": answer})
+    return system_prompt, user_instruction
 
 
 # ========= Numeric / text endpoints =========
 
 @app.route("/api/bmi-analysis", methods=["POST"])
 def bmi_analysis_api():
-    data = request.get_json(silent=True) or {}
+    return text_tool_api("bmi-analysis")
+
+
+@text_tool("bmi-analysis")
+def build_bmi_analysis(data):
+    """Validate a BMI request and build its prompt."""
     weight = data.get("weight")
     height_cm = data.get("height_cm")
     sex = data.get("sex")
 
     if weight is None or height_cm is None:
-        return jsonify({"error": "Missing weight or height_cm."}), 400
+        return None, ({"error": "Missing weight or height_cm."}, 400)
+    err = _non_scalar_error(data, ("weight", "height_cm", "sex"))
+    if err:
+        return None, err
+
+    bmi = float(engine.bmi(_as_float(weight), _as_float(height_cm))[0])
+    category = str(engine.bmi_category(bmi)[0])
+    if _fast_mode(data):
+        if category == "unknown":
+            return None, ({"error": "weight and height_cm must be positive numbers."}, 400)
+        return ToolCall("bmi-analysis", None, None, "analysis", {}, _fast_body(
+            "Hi, I'm Doctor Cal, your virtual AI doctor. "
+            f"With a weight of {weight} kg and a height of {height_cm} cm, your BMI works out to about {bmi:.1f}. "
+            f"On the Asian-oriented cut-offs that I use, that falls in the {category} range "
+            "(under 18.5 is underweight, 18.5 to 22.9 is normal, 23 to 24.9 is overweight and 25 or more is obese). "
+            "BMI is only a rough screening number: it does not see muscle, bone or where body fat sits, "
+            "so regular movement, balanced meals and good sleep matter more than any single value. "
+            "Remember, I'm an AI, and this is general information for learning only, not medical advice or a diagnosis.",
+            {"bmi": round(bmi, 1), "category": category},
+        )), None
 
     system_prompt = (
         "You are Doctor Cal, an AI assistant role-playing as a friendly virtual doctor. "
@@ -272,13 +1034,18 @@ def bmi_analysis_api():
 
     user_prompt = (
         f"The user reports: weight = {weight} kg, height = {height_cm} cm, sex = {sex or 'not specified'}.\n"
-        "Internally, calculate the BMI and think about whether it fits an Asian-oriented category such as underweight, "
-        "normal, overweight, or obese.\n\n"
+        + (
+            f"The server has already calculated BMI = {bmi:.1f}, which is in the '{category}' range on "
+            "Asian-oriented cut-offs. Use these values as given; do not recalculate or show the arithmetic.\n\n"
+            if category != "unknown" else
+            "Internally, calculate the BMI and think about whether it fits an Asian-oriented category such as underweight, "
+            "normal, overweight, or obese.\n\n"
+        ) +
         "Then give your final answer as if you are speaking directly to the user:\n"
         "- Start by saying something like: \"Hi, I'm Doctor Cal, your virtual AI doctor.\" "
-        "- Tell them what BMI you calculated and which category it roughly falls into, using simple language.\n"
+        "- Tell them their BMI and which category it roughly falls into, using simple language.\n"
         "- Give a short explanation about what that means and a few general lifestyle suggestions in normal sentences.\n"
-        "- Do NOT use numbered lists or bullet points; just write 1–3 short paragraphs.\n"
+        "- Do NOT use numbered lists or bullet points; just write 1–2 short paragraphs.\n"
         "- At the end, clearly say this is general information for learning only and not medical advice or a diagnosis."
     )
 
@@ -287,21 +1054,28 @@ def bmi_analysis_api():
         {"role": "user", "content": user_prompt},
     ]
 
-    answer, err = call_openai_chat(messages)
-    if err:
-        return err
-    return jsonify({"analysis": answer})
+    inputs = {
+        "weight": cache.canonical_number(weight),
+        "height_cm": cache.canonical_number(height_cm),
+        "sex": cache.canonical_text(sex),
+    }
+    return ToolCall("bmi-analysis", messages, inputs, "analysis", {"max_tokens": 450}), None
 
 
 @app.route("/api/dose-x", methods=["POST"])
 def dose_x_api():
-    data = request.get_json(silent=True) or {}
+    return text_tool_api("dose-x")
+
+
+@text_tool("dose-x")
+def build_dose_x(data):
+    """Validate a Drug X dosing request and build its prompt."""
     weight = data.get("weight")
     age = data.get("age")
     egfr = data.get("egfr")
 
     if weight is None or age is None:
-        return jsonify({"error": "Missing weight or age."}), 400
+        return None, ({"error": "Missing weight or age."}, 400)
 
     system_prompt = (
         "You are Doctor Cal, an AI assistant role-playing as a friendly virtual doctor in pharmacology. "
@@ -330,15 +1104,22 @@ def dose_x_api():
         {"role": "user", "content": user_prompt},
     ]
 
-    answer, err = call_openai_chat(messages)
-    if err:
-        return err
-    return jsonify({"analysis": answer})
+    inputs = {
+        "weight": cache.canonical_number(weight),
+        "age": cache.canonical_number(age),
+        "egfr": cache.canonical_number(egfr),
+    }
+    return ToolCall("dose-x", messages, inputs, "analysis", {}), None
 
 
 @app.route("/api/cardiac-risk", methods=["POST"])
 def cardiac_risk_api():
-    data = request.get_json(silent=True) or {}
+    return text_tool_api("cardiac-risk")
+
+
+@text_tool("cardiac-risk")
+def build_cardiac_risk(data):
+    """Validate a cardiac risk request and build its prompt."""
     age = data.get("age")
     sex = data.get("sex")
     sbp = data.get("sbp")
@@ -347,7 +1128,35 @@ def cardiac_risk_api():
     chol = data.get("chol")
 
     if age is None or sbp is None:
-        return jsonify({"error": "Missing age or systolic blood pressure."}), 400
+        return None, ({"error": "Missing age or systolic blood pressure."}, 400)
+    err = _non_scalar_error(data, ("age", "sex", "sbp", "smoker", "diabetes", "chol"))
+    if err:
+        return None, err
+
+    risk = engine.cardiac_risk_factors(_as_float(age), sex, _as_float(sbp), smoker, diabetes, _as_float(chol))
+    factor_words = {
+        "age": f"your age ({age})",
+        "blood_pressure": f"a systolic blood pressure of {sbp} mmHg",
+        "smoking": "smoking",
+        "diabetes": "diabetes",
+        "cholesterol": f"a total cholesterol of {chol} mmol/L",
+    }
+    present = [factor_words[name] for name, flags in risk["factors"].items() if flags[0]]
+    band = str(risk["band"][0])
+    present_text = ", ".join(present) if present else "none of the usual factors I check"
+
+    if _fast_mode(data):
+        return ToolCall("cardiac-risk", None, None, "analysis", {}, _fast_body(
+            "Hi, I'm Doctor Cal, your virtual AI doctor. "
+            f"Looking at the details you gave, I count {len(present)} of the common heart risk factors: {present_text}. "
+            f"In rough, qualitative terms that puts the picture in the {band} range. "
+            "Not smoking, staying active, eating plenty of vegetables and less salt, and keeping blood pressure, "
+            "blood sugar and cholesterol in check are the general habits that pull heart risk down. "
+            "Remember, I'm an AI, and this is only an approximate, educational explanation, "
+            "not a real guideline-based risk score or medical advice.",
+            {"risk_factor_count": int(risk["count"][0]), "band": band,
+             "factors": {name: bool(flags[0]) for name, flags in risk["factors"].items()}},
+        )), None
 
     system_prompt = (
         "You are Doctor Cal, an AI assistant role-playing as a friendly virtual doctor in cardiovascular health. "
@@ -366,13 +1175,13 @@ def cardiac_risk_api():
         f"- Smoker: {smoker}\n"
         f"- Diabetes: {diabetes}\n"
         f"- Total cholesterol: {chol if chol is not None else 'not provided'} mmol/L\n\n"
-        "Internally, think about a rough, qualitative 10-year cardiovascular risk category "
-        "(for example low, borderline, intermediate, or high) based on these factors.\n\n"
+        f"The server has already counted {len(present)} risk factor(s) present: {present_text}. "
+        f"Qualitatively that is a '{band}' picture. Take these as given rather than working them out again.\n\n"
         "Then give your final answer in natural language as Doctor Cal talking to the user. "
         "Start with something like: \"Hi, I'm Doctor Cal, your virtual AI doctor.\" "
         "In a few sentences, say roughly whether their risk sounds lower or higher and which factors are pushing the risk up. "
         "Offer a few general lifestyle suggestions in plain English. "
-        "Do not use bullet points or numbered steps; just write 1–3 short paragraphs. "
+        "Do not use bullet points or numbered steps; just write 1–2 short paragraphs. "
         "At the end, clearly say that this is only an approximate, educational explanation and not a real guideline-based risk score or medical advice."
     )
 
@@ -381,21 +1190,57 @@ def cardiac_risk_api():
         {"role": "user", "content": user_prompt},
     ]
 
-    answer, err = call_openai_chat(messages)
-    if err:
-        return err
-    return jsonify({"analysis": answer})
+    inputs = {
+        "age": cache.canonical_number(age),
+        "sex": cache.canonical_text(sex),
+        "sbp": cache.canonical_number(sbp),
+        "smoker": cache.canonical_bool(smoker),
+        "diabetes": cache.canonical_bool(diabetes),
+        "chol": cache.canonical_number(chol),
+    }
+    return ToolCall("cardiac-risk", messages, inputs, "analysis", {"max_tokens": 500}), None
 
 
 @app.route("/api/lab-blood", methods=["POST"])
 def lab_blood_api():
-    data = request.get_json(silent=True) or {}
+    return text_tool_api("lab-blood")
+
+
+@text_tool("lab-blood")
+def build_lab_blood(data):
+    """Validate a blood count request and build its prompt."""
     hb = data.get("hb")
     wbc = data.get("wbc")
     plt = data.get("plt")
+    sex = data.get("sex")
 
     if hb is None or wbc is None or plt is None:
-        return jsonify({"error": "Missing Hb, WBC or PLT."}), 400
+        return None, ({"error": "Missing Hb, WBC or PLT."}, 400)
+    err = _non_scalar_error(data, ("hb", "wbc", "plt", "sex"))
+    if err:
+        return None, err
+
+    flags = engine.lab_flags(_as_float(hb), _as_float(wbc), _as_float(plt), sex)
+    hb_flag, wbc_flag, plt_flag = (str(flags[k][0]) for k in ("hb", "wbc", "plt"))
+    hb_low, hb_high = flags["hb_range"][0]
+    ranges_text = (
+        f"Hb {hb_low:g}–{hb_high:g} g/dL, WBC {engine.WBC_RANGE[0]:g}–{engine.WBC_RANGE[1]:g} x10^9/L, "
+        f"PLT {engine.PLT_RANGE[0]:g}–{engine.PLT_RANGE[1]:g} x10^9/L"
+    )
+
+    if _fast_mode(data):
+        if "unknown" in (hb_flag, wbc_flag, plt_flag):
+            return None, ({"error": "Hb, WBC and PLT must be numbers."}, 400)
+        return ToolCall("lab-blood", None, None, "analysis", {}, _fast_body(
+            "Hi, I'm Doctor Cal, your virtual AI doctor. "
+            f"Compared with typical adult ranges ({ranges_text}), your hemoglobin of {hb} g/dL looks {hb_flag}, "
+            f"your white cells at {wbc} x10^9/L look {wbc_flag}, and your platelets at {plt} x10^9/L look {plt_flag}. "
+            "Reference ranges differ between labs, and a single value outside them can have many harmless "
+            "or temporary explanations. "
+            "Remember, I'm an AI, and this is only an educational explanation; real lab results must be "
+            "interpreted by a doctor who knows the full clinical picture.",
+            {"hb": hb_flag, "wbc": wbc_flag, "plt": plt_flag},
+        )), None
 
     system_prompt = (
         "You are Doctor Cal, an AI assistant role-playing as a friendly virtual doctor in hematology. "
@@ -411,13 +1256,14 @@ def lab_blood_api():
         f"- Hemoglobin (Hb): {hb} g/dL\n"
         f"- White blood cells (WBC): {wbc} x10^9/L\n"
         f"- Platelets (PLT): {plt} x10^9/L\n\n"
-        "Internally, think about whether each value looks low, normal, or high compared with typical adult reference ranges. "
-        "Also think of a few general educational examples of what might cause low or high values.\n\n"
+        f"Compared with typical adult ranges ({ranges_text}) the server has already classified them as: "
+        f"Hb {hb_flag}, WBC {wbc_flag}, PLT {plt_flag}. Use these classifications as given.\n"
+        "Internally, think of a few general educational examples of what might cause any low or high values.\n\n"
         "Then answer like Doctor Cal talking to the user. "
         "Start with something like: \"Hi, I'm Doctor Cal, your virtual AI doctor.\" "
         "Describe in simple words whether the hemoglobin, white cells and platelets look low, normal or high, "
         "and give a brief explanation in normal sentences. "
-        "Do not use bullet points or numbered steps; just write 1–3 short paragraphs. "
+        "Do not use bullet points or numbered steps; just write 1–2 short paragraphs. "
         "Avoid naming specific diseases as a firm diagnosis; keep it general. "
         "At the end, clearly say that this is only an educational explanation and real lab results must be interpreted by a doctor who knows the full clinical picture."
     )
@@ -427,19 +1273,115 @@ def lab_blood_api():
         {"role": "user", "content": user_prompt},
     ]
 
-    answer, err = call_openai_chat(messages)
-    if err:
-        return err
-    return jsonify({"analysis": answer})
+    inputs = {
+        "hb": cache.canonical_number(hb),
+        "wbc": cache.canonical_number(wbc),
+        "plt": cache.canonical_number(plt),
+        "sex": cache.canonical_text(sex),
+    }
+    return ToolCall("lab-blood", messages, inputs, "analysis", {"max_tokens": 500}), None
 
 
 @app.route("/api/doctor-chat", methods=["POST"])
 def doctor_chat_api():
-    data = request.get_json(silent=True) or {}
+    """
+    Free-text question; {"stream": true} streams the answer as SSE.
+    "session": true starts a server-side conversation under a new ID,
+    returned in the body and in the X-Session-ID header; "session_id"
+    continues it. IDs the server did not issue are rejected with 404.
+    """
+    with metrics.phase("form"):
+        data = request.get_json(silent=True) or {}
+    session, err = _open_session(data)
+    if err:
+        return _as_response(err)
+    call, err = build_doctor_chat(data, session)
+    if err:
+        return _as_response(err)
+    question = data["question"].strip()
+
+    if _wants_stream(data):
+        response = make_response(_doctor_chat_stream(call, session, question))
+    else:
+        body, status, cache_status = run_tool_call(call, _cache_mode())
+        if cache_status:
+            g.cache_status = cache_status
+        if session is not None:
+            if status == 200:
+                _record_turn(session, question, body[call.result_key])
+            body = {**body, "session_id": session.id}
+        response = _json_response(body, status)
+    if session is not None:
+        response.headers["X-Session-ID"] = session.id
+    return response
+
+
+def _doctor_chat_stream(call, session, question):
+    # Same cache semantics as _through_cache(), with a cached answer sent as one delta.
+    mode = _cache_mode() if call.question is not None else "bypass"
+    key = question_key(call)
+    if mode == "use":
+        answer = doctor_chat_cache.get(key)
+        if answer is not None:
+            g.cache_status = "HIT"
+            if session is not None:
+                _record_turn(session, question, answer)
+            return sse_response([answer])
+        g.cache_status = "MISS"
+    elif mode == "bypass":
+        if call.question is not None:
+            doctor_chat_cache.note_bypass()
+            g.cache_status = "BYPASS"
+    else:
+        g.cache_status = "REFRESH"
+    deltas, err = call_openai_chat_stream(call.messages, tool=call.tool, **call.options)
+    if err:
+        return err
+
+    def on_done(answer):
+        if mode != "bypass":
+            doctor_chat_cache.set(key, answer)
+        if session is not None:
+            _record_turn(session, question, answer)
+    return sse_response(deltas, on_done=on_done)
+
+
+def _open_session(data):
+    """
+    The doctor-chat session a request belongs to: (Session or None, None),
+    or (None, (error body, status)) for a malformed session_id or one this
+    server did not issue (or that has expired).
+    """
+    session_id = data.get("session_id")
+    if session_id is None:
+        if not data.get("session"):
+            return None, None
+        with metrics.phase("session"):
+            return doctor_chat_sessions.create(), None
+    if not isinstance(session_id, str) or not sessions.SESSION_ID.match(session_id):
+        return None, ({"error": "session_id must be 8-64 letters, digits, '-' or '_'."}, 400)
+    with metrics.phase("session"):
+        session = doctor_chat_sessions.load(session_id)
+    if session is None:
+        return None, ({"error": "Unknown or expired session; start a new one with \"session\": true."}, 404)
+    return session, None
+
+
+def _record_turn(session, question, answer):
+    session.add_turn(question, answer, SESSION_RECENT_TURNS, SESSION_SUMMARY_TOKENS)
+    doctor_chat_sessions.save(session)
+
+
+@text_tool("doctor-chat")
+def build_doctor_chat(data, session=None):
+    """
+    Validate a free-text question and build its prompt; with a session that
+    has history, the prompt carries the conversation so far (see sessions.py).
+    """
     question = (data.get("question") or "").strip()
 
     if not question:
-        return jsonify({"error": "Missing question."}), 400
+        return None, ({"error": "Missing question."}, 400)
 
     system_prompt = (
         "You are Doctor Cal, an AI assistant role-playing as a friendly virtual doctor. "
@@ -462,15 +1404,109 @@ def doctor_chat_api():
         f"User question: {question}"
     )
 
+    options = {"temperature": 0.4, "max_tokens": 900}
+    if session is not None and session.has_history:
+        messages, sent, full = sessions.build_messages(
+            session, system_prompt, user_prompt, SESSION_CONTEXT_TOKENS, SESSION_SUMMARY_TOKENS)
+        metrics.SESSION_HISTORY_TOKENS.labels("sent").inc(sent)
+        metrics.SESSION_HISTORY_TOKENS.labels("full").inc(full)
+        # The answer depends on the conversation, so the question cache does not apply.
+        return ToolCall("doctor-chat", messages, None, "answer", options), None
+
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
 
-    answer, err = call_openai_chat(messages, temperature=0.4, max_tokens=900)
-    if err:
-        return err
-    return jsonify({"answer": answer})
+    return ToolCall("doctor-chat", messages, None, "answer", options, question=question), None
+
+
+# ========= Batch endpoint =========
+
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "50"))
+BATCH_DEADLINE = float(os.environ.get("BATCH_DEADLINE", "60"))
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BATCH_MAX_WORKERS", "8")),
+    thread_name_prefix="batch",
+)
+
+
+def _run_batch_item(index, item, cache_mode):
+    """One batch item -> result dict; failures stay inside the item."""
+    tool = item.get("tool") if isinstance(item, dict) else None
+    payload = item.get("payload") if isinstance(item, dict) else None
+    if tool not in TEXT_TOOLS:
+        return {"index": index, "tool": tool, "status": 400,
+                "error": f"Unknown tool. Use one of: {', '.join(sorted(TEXT_TOOLS))}."}
+    if not isinstance(payload, dict):
+        return {"index": index, "tool": tool, "status": 400, "error": "Missing payload object."}
+    try:
+        body, status, _ = run_text_tool(tool, payload, cache_mode)
+    except Exception as e:  # isolate unexpected failures to this item
+        app.logger.exception("batch item %d (%s) failed", index, tool)
+        body, status = {"error": f"Internal error: {e}"}, 500
+    return {"index": index, "tool": tool, "status": status, **body}
+
+
+def _deadline_result(index, item):
+    tool = item.get("tool") if isinstance(item, dict) else None
+    return {"index": index, "tool": tool, "status": 504, "error": "Batch deadline exceeded."}
+
+
+@app.route("/api/batch", methods=["POST"])
+def batch_api():
+    """
+    Run several text tools concurrently:
+    {"items": [{"tool": "bmi-analysis", "payload": {...}}, ...], "deadline_s": 30, "stream": false}.
+    Returns {"results": [...]} in request order, or with "stream": true (or
+    ?stream=1) one NDJSON line per item as soon as it finishes. Items still
+    running at the deadline are reported with status 504.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Missing items list."}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Too many items (max {BATCH_MAX_ITEMS})."}), 400
+
+    try:
+        deadline_s = min(float(data.get("deadline_s", BATCH_DEADLINE)), BATCH_DEADLINE)
+    except (TypeError, ValueError):
+        return jsonify({"error": "deadline_s must be a number."}), 400
+    deadline = time.monotonic() + deadline_s
+    cache_mode = _cache_mode()
+
+    futures = {
+        batch_executor.submit(_run_batch_item, i, item, cache_mode): i
+        for i, item in enumerate(items)
+    }
+
+    if data.get("stream") or request.args.get("stream") in ("1", "true"):
+        def lines():
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()),
+                                     return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    yield json.dumps(future.result()) + "\n"
+            for future in pending:
+                future.cancel()
+                i = futures[future]
+                yield json.dumps(_deadline_result(i, items[i])) + "\n"
+
+        return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+    done, pending = wait(futures, timeout=max(0, deadline - time.monotonic()))
+    results = [None] * len(items)
+    for future in done:
+        results[futures[future]] = future.result()
+    for future in pending:
+        future.cancel()
+        i = futures[future]
+        results[i] = _deadline_result(i, items[i])
+    return jsonify({"results": results})
 
 
 if __name__ == "__main__":
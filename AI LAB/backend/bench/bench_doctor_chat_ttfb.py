@@ -0,0 +1,79 @@
+"""
+Time-to-first-byte of /api/doctor-chat: JSON reply vs SSE streaming.
+
+A streaming mock upstream emits --tokens tokens, the first after
+--latency-ms and then one every --token-ms. The backend runs in-process on
+a werkzeug server; for each mode we time the first useful byte the browser
+would get (the whole JSON body, or the first "delta" event) and the total.
+Every request bypasses the answer caches, so each one waits on upstream.
+
+    python bench/bench_doctor_chat_ttfb.py --latency-ms 400 --token-ms 20 --tokens 300
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+from mock_upstream import make_server  # noqa: E402
+
+BYPASS = {"X-Cache-Mode": "bypass"}
+
+
+def _json_once(url):
+    start = time.perf_counter()
+    resp = requests.post(url, json={"question": "What is high blood pressure?"}, headers=BYPASS, timeout=120)
+    resp.json()
+    total = time.perf_counter() - start
+    return total, total
+
+
+def _sse_once(url):
+    start = time.perf_counter()
+    first = None
+    with requests.post(url, json={"question": "What is high blood pressure?", "stream": True},
+                       headers=BYPASS, stream=True, timeout=120) as resp:
+        for line in resp.iter_lines(chunk_size=None):
+            if first is None and line.startswith(b"event: delta"):
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=400)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("-n", type=int, default=5)
+    args = parser.parse_args()
+
+    mock = make_server(latency_ms=args.latency_ms, token_ms=args.token_ms, completion_tokens=args.tokens)
+    threading.Thread(target=mock.serve_forever, daemon=True).start()
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{mock.server_address[1]}/v1"
+    os.environ["OPENAI_API_KEY"] = "test"
+
+    from werkzeug.serving import make_server as make_wsgi_server
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_wsgi_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/doctor-chat"
+
+    print(f"upstream: first token after {args.latency_ms:.0f} ms, {args.tokens} tokens every {args.token_ms:.0f} ms")
+    for label, fn in (("json", _json_once), ("sse", _sse_once)):
+        runs = [fn(url) for _ in range(args.n)]
+        ttfb = statistics.median(r[0] for r in runs) * 1000
+        total = statistics.median(r[1] for r in runs) * 1000
+        print(f"{label:<5} TTFB p50 {ttfb:8.1f} ms   total p50 {total:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Lookup latency and hit rate of the near-duplicate doctor-chat question cache.
+
+    python bench/bench_question_cache.py --entries 100000 --lookups 20000
+
+Fills a QuestionCache with synthetic questions (3-7 content words drawn
+from a Zipf-distributed vocabulary), then times lookups of exact repeats,
+paraphrases (filler words, abbreviations, case and punctuation) and unseen
+questions, and prints a few real FAQ question pairs with their estimated
+similarity and whether the cache would match them, for tuning
+QUESTION_CACHE_THRESHOLD.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from question_cache import QuestionCache  # noqa: E402
+
+PREFIXES = ["", "doctor cal, ", "hi, can you tell me ", "please explain ", "i want to know "]
+
+FAQ_PAIRS = [
+    ("What is high blood pressure?", "what does high BP mean"),
+    ("What is high blood pressure?", "What is low blood pressure?"),
+    ("What are the symptoms of diabetes?", "signs of diabetes?"),
+    ("How do I lower my blood pressure?", "how to reduce BP"),
+    ("Is aspirin safe for kids?", "is aspirin safe for children"),
+    ("What causes migraines?", "Why do I get migraines?"),
+    ("normal blood sugar level for non diabetics", "normal blood sugar level for diabetics"),
+    ("can adults take adult cough syrup safely", "can children take adult cough syrup safely"),
+]
+
+
+class _Vocabulary:
+    """Made-up words with Zipf-like frequencies; "blood pressure" is among the common ones."""
+
+    def __init__(self, rng, size=20000):
+        self.rng = rng
+        self.words = ["blood pressure"] + [
+            "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+            for _ in range(size - 1)
+        ]
+        self.weights = [1.0 / (rank + 1) for rank in range(size)]
+
+    def question(self):
+        words = set(self.rng.choices(self.words, self.weights, k=self.rng.randint(3, 7)))
+        return "what is " + " ".join(words)
+
+
+def _paraphrase(rng, question):
+    text = rng.choice(PREFIXES) + question.replace("blood pressure", "BP").replace("what is ", "what does ")
+    return text + " mean?" if rng.random() < 0.5 else text.upper()
+
+
+def _timed(cache, keys):
+    samples, hits = [], 0
+    for key in keys:
+        start = time.perf_counter()
+        answer = cache.get(key)
+        samples.append((time.perf_counter() - start) * 1e6)
+        hits += answer is not None
+    return samples, hits
+
+
+def _report(label, samples, hits):
+    samples = sorted(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(f"{label:<12} p50 {statistics.median(samples):7.1f} us   p99 {p99:7.1f} us   "
+          f"hit rate {hits / len(samples):6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cache = QuestionCache(max_entries=args.entries, threshold=args.threshold)
+    vocabulary = _Vocabulary(rng)
+    questions = [vocabulary.question() for _ in range(args.entries)]
+
+    start = time.perf_counter()
+    for q in questions:
+        cache.set(("bench", q), f"answer to {q}")
+    fill = time.perf_counter() - start
+    print(f"filled {len(cache)} entries in {fill:.1f} s ({fill / args.entries * 1e6:.0f} us/insert)")
+
+    picks = [rng.choice(questions) for _ in range(args.lookups)]
+    _report("exact", *_timed(cache, [("bench", q) for q in picks]))
+    _report("paraphrase", *_timed(cache, [("bench", _paraphrase(rng, q)) for q in picks]))
+    _report("unseen", *_timed(cache, [("bench", vocabulary.question()) for _ in range(args.lookups)]))
+
+    stats = cache.stats()
+    print(f"index {stats['index_bytes'] / 1e6:.1f} MB, answers {stats['answer_bytes'] / 1e6:.1f} MB")
+    print()
+    for a, b in FAQ_PAIRS:
+        verdict = "match" if cache.matches(a, b) else "no match"
+        print(f"{cache.similarity(a, b):4.2f}  {verdict:<8}  {a!r} ~ {b!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Per-request latency: bare requests.post (old code path) vs the pooled upstream session.
+
+    python bench/bench_upstream.py -n 200
+    python bench/bench_upstream.py --base-url https://my-tls-mock.local/v1
+
+Without --base-url a plain-HTTP mock is started in-process, so the saving
+shown is only the TCP handshake; against a TLS endpoint the gap is larger.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests  # noqa: E402
+
+PAYLOAD = {
+    "model": "gpt-4.1-mini",
+    "messages": [{"role": "user", "content": "ping"}],
+    "temperature": 0.2,
+    "max_tokens": 16,
+}
+HEADERS = {"Authorization": "Bearer test", "Content-Type": "application/json"}
+
+
+def _timed(fn, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        resp = fn()
+        resp.content
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<16} mean {statistics.mean(samples):7.2f} ms   p50 {statistics.median(samples):7.2f} ms   p95 {p95:7.2f} ms")
+    return statistics.mean(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=200, help="requests per client")
+    parser.add_argument("--base-url", help="existing upstream to target instead of the in-process mock")
+    args = parser.parse_args()
+
+    if args.base_url:
+        os.environ["OPENAI_API_BASE"] = args.base_url
+    else:
+        from mock_upstream import make_server
+        server = make_server()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    import upstream
+
+    url = upstream.CHAT_COMPLETIONS_URL
+    bare = _timed(lambda: requests.post(url, headers=HEADERS, json=PAYLOAD, timeout=40), args.n)
+    pooled = _timed(lambda: upstream.post_chat_completion(PAYLOAD, HEADERS, read_timeout=40), args.n)
+
+    print(f"{args.n} requests to {url}")
+    bare_mean = _report("requests.post", bare)
+    pooled_mean = _report("pooled session", pooled)
+    print(f"saved per request: {bare_mean - pooled_mean:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
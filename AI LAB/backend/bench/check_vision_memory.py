@@ -0,0 +1,136 @@
+"""
+Peak RSS growth of the backend while it serves one large vision upload.
+
+The app runs in a child process (werkzeug threaded server) against an
+in-process mock upstream. For each case the child's peak-RSS counter
+(/proc/<pid>/status VmHWM) is reset, one upload is sent, and the growth
+over the idle RSS is reported. Exits non-zero if any case exceeds its
+budget, so it can guard against regressions in CI:
+
+    python bench/check_vision_memory.py --size-mb 20 --max-peak-mb 24
+
+tests/test_vision_memory.py runs the same cases with the default budgets
+under pytest.
+
+The budget is --max-peak-mb for the pass-through (undecodable) upload. Images
+that get normalized must be decoded by Pillow, so their budget also allows
+--max-decode-factor times the decoded RGB bitmap.
+
+Linux only (relies on /proc).
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+import requests
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+from mock_upstream import make_server  # noqa: E402
+
+CHILD = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from werkzeug.serving import make_server
+import app
+srv = make_server("127.0.0.1", 0, app.app, threaded=True)
+print(srv.server_port, flush=True)
+srv.serve_forever()
+"""
+
+
+def _proc_kb(pid, field):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise RuntimeError(f"{field} not found for pid {pid}")
+
+
+def _reset_peak(pid):
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _make_upload(path, kind, size_mb):
+    if kind == "opaque":
+        # Not decodable as an image: exercises the pass-through streaming path.
+        with open(path, "wb") as f:
+            for _ in range(int(size_mb)):
+                f.write(os.urandom(1024 * 1024))
+        return 0
+    from PIL import Image
+    edge = 1000
+    tile = Image.frombytes("RGB", (edge, edge), os.urandom(edge * edge * 3))
+    img = Image.new("RGB", (edge * 6, edge * 4))
+    for x in range(6):
+        for y in range(4):
+            img.paste(tile, (x * edge, y * edge))
+    img.save(path, format="JPEG" if kind == "jpeg" else "PNG", quality=95)
+    return img.width * img.height
+
+
+def run_case(kind, args, upstream_base):
+    env = dict(os.environ, OPENAI_API_BASE=upstream_base, OPENAI_API_KEY="test",
+               VISION_CACHE_PATH="", VISION_CACHE_SIZE="0",
+               MAX_UPLOAD_MB=str(args.size_mb * 2 + 8))
+    child = subprocess.Popen([sys.executable, "-c", CHILD, BACKEND_DIR], env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    with tempfile.NamedTemporaryFile(suffix=".img", delete=False) as tmp:
+        path = tmp.name
+    try:
+        port = int(child.stdout.readline())
+        base = f"http://127.0.0.1:{port}"
+        # Warm up imports and pools with a tiny request first.
+        requests.post(base + "/api/chest-xray", files={"image": ("w.jpg", io.BytesIO(b"warmup"))}, timeout=60)
+
+        pixels = _make_upload(path, kind, args.size_mb)
+        upload_mb = os.path.getsize(path) / (1024 * 1024)
+        idle_kb = _proc_kb(child.pid, "VmRSS")
+        if not _reset_peak(child.pid):
+            print("warning: cannot reset VmHWM; figures include start-up peak")
+
+        with open(path, "rb") as f:
+            resp = requests.post(base + "/api/chest-xray", files={"image": ("x.img", f)}, timeout=120)
+        peak_kb = _proc_kb(child.pid, "VmHWM")
+    finally:
+        child.terminate()
+        child.wait(timeout=10)
+        os.unlink(path)
+
+    growth_mb = max(0, peak_kb - idle_kb) / 1024
+    budget_mb = args.max_peak_mb + args.max_decode_factor * pixels * 3 / (1024 * 1024)
+    print(f"{kind:<7} upload {upload_mb:6.1f} MB   status {resp.status_code}   "
+          f"X-Image-Bytes-Out {resp.headers.get('X-Image-Bytes-Out', '-'):>9}   "
+          f"peak RSS growth {growth_mb:6.1f} MB (budget {budget_mb:.0f} MB)")
+    return resp.status_code == 200 and growth_mb <= budget_mb
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=20, help="size of the opaque upload")
+    parser.add_argument("--max-peak-mb", type=float, default=24)
+    parser.add_argument("--max-decode-factor", type=float, default=2.0)
+    parser.add_argument("--cases", default="opaque,jpeg,png")
+    args = parser.parse_args()
+
+    server = make_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    upstream_base = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    ok = all([run_case(kind, args, upstream_base) for kind in args.cases.split(",")])
+    print("OK" if ok else "FAIL: peak RSS growth over budget")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Concurrent throughput of the sync vs async (gevent) serving modes.
+
+Starts a slow mock upstream, then for each mode boots gunicorn with
+gunicorn.conf.py and fires --concurrency simultaneous /api/bmi-analysis
+requests at it. Requests bypass the response cache and single-flight
+coalescing is turned off (payloads repeat every 40 requests), so every one
+of them makes its own upstream call:
+
+    python bench/load_serving.py --concurrency 200 --latency-ms 2000 --workers 2
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+from mock_upstream import make_server  # noqa: E402
+
+
+def _wait_ready(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not come up at {url}")
+
+
+def run_mode(mode, args, upstream_base, port):
+    env = dict(
+        os.environ,
+        SERVING_MODE=mode,
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(args.workers),
+        OPENAI_API_BASE=upstream_base,
+        OPENAI_API_KEY="test",
+        COALESCE_ENABLED="0",
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        _wait_ready(base + "/")
+
+        def one(i):
+            start = time.perf_counter()
+            try:
+                resp = requests.post(base + "/api/bmi-analysis",
+                                     json={"weight": 60 + i % 40, "height_cm": 170},
+                                     headers={"X-Cache-Mode": "bypass"}, timeout=args.client_timeout)
+                ok = resp.status_code == 200
+            except requests.RequestException:
+                ok = False
+            return ok, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(one, range(args.concurrency)))
+        wall = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+    latencies = sorted(t for ok, t in results if ok)
+    ok_count = len(latencies)
+    errors = len(results) - ok_count
+    print(f"{mode:<6} ok {ok_count:>4}/{args.concurrency}   errors {errors:>4}   wall {wall:6.2f} s   "
+          f"throughput {ok_count / wall:7.1f} req/s   "
+          f"p50 {statistics.median(latencies) if latencies else float('nan'):6.2f} s   "
+          f"max {latencies[-1] if latencies else float('nan'):6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=2000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--client-timeout", type=float, default=120)
+    parser.add_argument("--modes", default="sync,async")
+    args = parser.parse_args()
+
+    server = make_server(latency_ms=args.latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    upstream_base = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    print(f"{args.concurrency} concurrent requests, upstream latency {args.latency_ms:.0f} ms, {args.workers} workers")
+    for offset, mode in enumerate(args.modes.split(",")):
+        run_mode(mode.strip(), args, upstream_base, 8600 + offset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""
+Load test of all eight /api routes against a local mock upstream.
+
+For each (worker class, worker count) in the matrix this boots gunicorn with
+gunicorn.conf.py, drives it with --concurrency closed-loop clients for
+--duration seconds (after --warmup) and reports throughput, p50/p95/p99
+latency overall and per route, and the gunicorn processes' peak RSS and
+CPU. Vision routes upload generated images of realistic sizes (a phone
+photo, a grayscale scan and a small JPEG); every upload is made unique and
+every request bypasses the response caches, so the numbers measure the full
+upstream path.
+
+    python bench/loadtest.py --workers 2,4 --classes sync,gthread,gevent \\
+        --concurrency 64 --duration 30 --latency-ms 400 --sigma 0.4 --save bench/results/baseline.json
+
+Later, after changing the upstream path, compare against that run; the exit
+status is non-zero if throughput or p95 regressed by more than --max-regression %:
+
+    python bench/loadtest.py ... --baseline bench/results/baseline.json
+
+Linux only (reads /proc for RSS and CPU).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import requests
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+VISION_ROUTES = ("/api/chromosome", "/api/cancer-cell", "/api/chest-xray")
+ALL_ROUTES = VISION_ROUTES + (
+    "/api/bmi-analysis", "/api/dose-x", "/api/cardiac-risk", "/api/lab-blood", "/api/doctor-chat",
+)
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+# ---------- request mix ----------
+
+def make_images(seed):
+    """Realistic uploads: smooth content plus sensor noise, so they compress like real photos."""
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+
+    def photo(width, height, quality):
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        base = np.stack([128 + 90 * np.sin(x / 300 + c) * np.cos(y / 200 - c) for c in (0, 1, 2)], axis=-1)
+        pixels = np.clip(base + rng.normal(0, 6, base.shape), 0, 255).astype(np.uint8)
+        out = io.BytesIO()
+        Image.fromarray(pixels).save(out, format="JPEG", quality=quality)
+        return out.getvalue()
+
+    def scan(edge):
+        y, x = np.mgrid[0:edge, 0:edge].astype(np.float32)
+        base = 100 + 80 * np.exp(-((x - edge / 2) ** 2 + (y - edge / 2) ** 2) / (2 * (edge / 4) ** 2))
+        pixels = np.clip(base + rng.normal(0, 4, base.shape), 0, 255).astype(np.uint8)
+        out = io.BytesIO()
+        Image.fromarray(pixels, mode="L").save(out, format="PNG")
+        return out.getvalue()
+
+    return [("phone.jpg", photo(4032, 3024, 90)), ("scan.png", scan(2048)), ("small.jpg", photo(1024, 768, 85))]
+
+
+def make_request(route, i, images, stream_chat):
+    """(kwargs for requests.post, streamed?) for request number i on route; inputs vary with i."""
+    if route in VISION_ROUTES:
+        name, data = images[i % len(images)]
+        # A few unique trailing bytes defeat the vision cache and request coalescing.
+        return {"files": {"image": (name, data + i.to_bytes(8, "big"))}}, False
+    payloads = {
+        "/api/bmi-analysis": {"weight": 50 + i % 60, "height_cm": 150 + i % 45, "sex": "female"},
+        "/api/dose-x": {"weight": 50 + i % 60, "age": 20 + i % 60, "egfr": 60 + i % 50},
+        "/api/cardiac-risk": {"age": 30 + i % 50, "sex": "male", "sbp": 110 + i % 60,
+                              "smoker": i % 2 == 0, "diabetes": i % 3 == 0, "chol": 4 + (i % 30) / 10},
+        "/api/lab-blood": {"hb": 10 + (i % 80) / 10, "wbc": 3 + (i % 100) / 10, "plt": 100 + i % 400},
+        "/api/doctor-chat": {"question": f"What does a blood pressure of {100 + i % 80} mean? ({i})"},
+    }
+    payload = payloads[route]
+    if route == "/api/doctor-chat" and stream_chat:
+        return {"json": {**payload, "stream": True}, "stream": True}, True
+    return {"json": payload}, False
+
+
+# ---------- gunicorn processes ----------
+
+def _proc_stat(pid):
+    """(parent pid, CPU seconds, RSS bytes) of a process, or None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    except (OSError, StopIteration, ValueError):
+        return None
+    return int(fields[1]), (int(fields[11]) + int(fields[12])) / CLK_TCK, rss_kb * 1024
+
+
+def _workers(master_pid):
+    pids = []
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            stat = _proc_stat(int(name))
+            if stat and stat[0] == master_pid:
+                pids.append(int(name))
+    return pids
+
+
+class ResourceSampler(threading.Thread):
+    """Samples RSS and CPU of the gunicorn master and its workers."""
+
+    def __init__(self, master_pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.cpu = {}
+        self.peak_rss = 0
+        self.peak_worker_rss = 0
+        self._halt = threading.Event()
+
+    def snapshot_cpu(self):
+        return sum(self.cpu.values())
+
+    def run(self):
+        while not self._halt.is_set():
+            total_rss = 0
+            for pid in [self.master_pid] + _workers(self.master_pid):
+                stat = _proc_stat(pid)
+                if stat is None:
+                    continue
+                self.cpu[pid] = stat[1]
+                total_rss += stat[2]
+                if pid != self.master_pid:
+                    self.peak_worker_rss = max(self.peak_worker_rss, stat[2])
+            self.peak_rss = max(self.peak_rss, total_rss)
+            self._halt.wait(self.interval)
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+def _gunicorn_env(worker_class, workers, args, upstream_base, port, metrics_dir):
+    env = dict(
+        os.environ,
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(workers),
+        OPENAI_API_BASE=upstream_base,
+        OPENAI_API_KEY="test",
+        VISION_CACHE_PATH="",
+        PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+        REQUEST_LOG="0",
+    )
+    if worker_class == "gevent":
+        env["SERVING_MODE"] = "async"
+    else:
+        env.update(SERVING_MODE="sync", GUNICORN_WORKER_CLASS=worker_class, GUNICORN_THREADS=str(args.threads))
+    return env
+
+
+def _wait_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not come up at {url}")
+
+
+# ---------- load and report ----------
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))]
+
+
+def _client(base, routes, images, args, seed, measure_from, stop_at, results):
+    rng = random.Random(seed)
+    session = requests.Session()
+    session.headers["X-Cache-Mode"] = "bypass"
+    while True:
+        now = time.perf_counter()
+        if now >= stop_at:
+            return
+        route = rng.choice(routes)
+        kwargs, streamed = make_request(route, rng.randrange(1 << 30), images, args.stream_chat)
+        start = time.perf_counter()
+        try:
+            resp = session.post(base + route, timeout=args.client_timeout, **kwargs)
+            if streamed:
+                for _ in resp.iter_content(chunk_size=None):
+                    pass
+            status = resp.status_code
+        except requests.RequestException:
+            status = "error"
+        end = time.perf_counter()
+        if start >= measure_from and end <= stop_at:
+            results.append((route, status, end - start))
+
+
+def run_config(worker_class, workers, args, routes, images, upstream_base, port):
+    metrics_dir = tempfile.mkdtemp(prefix="ailab-loadtest-metrics-")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=BACKEND_DIR, env=_gunicorn_env(worker_class, workers, args, upstream_base, port, metrics_dir),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    results = []
+    try:
+        _wait_ready(base + "/")
+        sampler = ResourceSampler(proc.pid)
+        sampler.start()
+        measure_from = time.perf_counter() + args.warmup
+        stop_at = measure_from + args.duration
+        clients = [
+            threading.Thread(target=_client, args=(base, routes, images, args, args.seed + n,
+                                                   measure_from, stop_at, results), daemon=True)
+            for n in range(args.concurrency)
+        ]
+        for t in clients:
+            t.start()
+        time.sleep(max(0.0, measure_from - time.perf_counter()))
+        cpu_start = sampler.snapshot_cpu()
+        for t in clients:
+            t.join()
+        cpu_seconds = sampler.snapshot_cpu() - cpu_start
+        sampler.stop()
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+    ok = sorted(t for _, status, t in results if status == 200)
+    by_route = defaultdict(list)
+    for route, status, t in results:
+        if status == 200:
+            by_route[route].append(t)
+    summary = {
+        "worker_class": worker_class,
+        "workers": workers,
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "throughput_rps": len(ok) / args.duration,
+        "p50_ms": _ms(percentile(ok, 50)),
+        "p95_ms": _ms(percentile(ok, 95)),
+        "p99_ms": _ms(percentile(ok, 99)),
+        "peak_rss_mb": sampler.peak_rss / (1024 * 1024),
+        "peak_worker_rss_mb": sampler.peak_worker_rss / (1024 * 1024),
+        "cpu_percent": 100.0 * cpu_seconds / args.duration,
+        "routes": {
+            route: {"ok": len(ts), "p50_ms": _ms(percentile(sorted(ts), 50)),
+                    "p95_ms": _ms(percentile(sorted(ts), 95)), "p99_ms": _ms(percentile(sorted(ts), 99))}
+            for route, ts in sorted(by_route.items())
+        },
+    }
+    return summary
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def _fmt(value, width=8, digits=0):
+    return f"{'-':>{width}}" if value is None else f"{value:{width}.{digits}f}"
+
+
+def print_summary(s, per_route):
+    print(f"{s['worker_class']:<8}{s['workers']:>3}  "
+          f"{_fmt(s['throughput_rps'], 8, 1)} req/s  ok {s['ok']:>6}  err {s['errors']:>5}  "
+          f"p50 {_fmt(s['p50_ms'])}  p95 {_fmt(s['p95_ms'])}  p99 {_fmt(s['p99_ms'])} ms  "
+          f"RSS {s['peak_rss_mb']:7.0f} MB (worker {s['peak_worker_rss_mb']:5.0f})  CPU {s['cpu_percent']:6.0f}%")
+    if per_route:
+        for route, r in s["routes"].items():
+            print(f"    {route:<20} ok {r['ok']:>6}  p50 {_fmt(r['p50_ms'])}  "
+                  f"p95 {_fmt(r['p95_ms'])}  p99 {_fmt(r['p99_ms'])} ms")
+
+
+def compare(results, baseline, max_regression):
+    """Print the change against a stored run; returns False if any config regressed too far."""
+    old = {(s["worker_class"], s["workers"]): s for s in baseline["results"]}
+    if baseline.get("params") != results["params"]:
+        print("note: baseline was recorded with different parameters:", baseline.get("params"))
+    ok = True
+    print(f"\ncompared with baseline ({max_regression:g}% tolerance):")
+    for s in results["results"]:
+        b = old.get((s["worker_class"], s["workers"]))
+        if b is None:
+            print(f"{s['worker_class']:<8}{s['workers']:>3}  no baseline")
+            continue
+        changes = []
+        for field, higher_is_better in (("throughput_rps", True), ("p95_ms", False), ("p99_ms", False)):
+            if not b[field] or s[field] is None:
+                continue
+            delta = 100.0 * (s[field] - b[field]) / b[field]
+            worse = -delta if higher_is_better else delta
+            flag = ""
+            if field != "p99_ms" and worse > max_regression:
+                flag, ok = " REGRESSION", False
+            changes.append(f"{field} {delta:+6.1f}%{flag}")
+        print(f"{s['worker_class']:<8}{s['workers']:>3}  " + "   ".join(changes))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="2", help="comma-separated worker counts")
+    parser.add_argument("--classes", default="sync,gthread,gevent", help="comma-separated worker classes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per gthread worker")
+    parser.add_argument("--routes", default=",".join(ALL_ROUTES))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--client-timeout", type=float, default=120)
+    parser.add_argument("--stream-chat", action="store_true", help="request doctor-chat as SSE")
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--latency-dist", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--sigma", type=float, default=0.4)
+    parser.add_argument("--token-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--per-route", action="store_true", help="also print per-route percentiles")
+    parser.add_argument("--save", help="write the results as JSON (e.g. a new baseline)")
+    parser.add_argument("--baseline", help="JSON from an earlier --save to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0)
+    args = parser.parse_args()
+
+    routes = [r.strip() for r in args.routes.split(",") if r.strip()]
+    unknown = set(routes) - set(ALL_ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "mock_upstream.py"), "--port", "0",
+         "--latency-ms", str(args.latency_ms), "--latency-dist", args.latency_dist,
+         "--jitter-ms", str(args.jitter_ms), "--sigma", str(args.sigma), "--token-ms", str(args.token_ms),
+         "--error-rate", str(args.error_rate), "--seed", str(args.seed)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        upstream_base = mock.stdout.readline().split()[-1]
+        images = make_images(args.seed) if set(routes) & set(VISION_ROUTES) else []
+        print("uploads: " + ", ".join(f"{name} {len(data) / 1e6:.1f} MB" for name, data in images))
+        print(f"{args.concurrency} clients, {args.duration:g} s per config, upstream {args.latency_dist} "
+              f"{args.latency_ms:g} ms, error rate {args.error_rate:g}\n")
+
+        params = {k: v for k, v in vars(args).items()
+                  if k not in ("workers", "classes", "per_route", "save", "baseline", "max_regression")}
+        results = {"params": params, "results": []}
+        port = 8700
+        for worker_class in args.classes.split(","):
+            for workers in (int(w) for w in args.workers.split(",")):
+                summary = run_config(worker_class.strip(), workers, args, routes, images, upstream_base, port)
+                results["results"].append(summary)
+                print_summary(summary, args.per_route)
+                port += 1
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nsaved {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Local stand-in for the chat-completions endpoint.
+
+Run it and point the backend at it:
+
+    python bench/mock_upstream.py --port 8099 --latency-ms 50
+    OPENAI_API_BASE=http://127.0.0.1:8099/v1 OPENAI_API_KEY=test gunicorn app:app
+
+The wait before the first token can be fixed, uniform (latency +- jitter)
+or log-normal (median latency, spread sigma), and a fraction of calls can
+fail with an error status, e.g. a flaky, slow-tailed upstream:
+
+    python bench/mock_upstream.py --latency-ms 400 --latency-dist lognormal --sigma 0.5 \
+        --error-rate 0.02 --error-status 503 --seed 1
+
+Several instances on different ports stand in for the backends of
+UPSTREAM_BACKENDS (see router.py); replies echo the requested model, so it
+shows which backend/model combination answered.
+"""
+import argparse
+import json
+import math
+import random
+import socket
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockCompletionsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency_s = 0.0
+    token_s = 0.0
+    completion_tokens = 8
+    latency_dist = "fixed"
+    jitter_s = 0.0
+    sigma = 0.0
+    error_rate = 0.0
+    error_status = 503
+    rng = random.Random()
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out as separate writes; without NODELAY, Nagle
+        # plus the client's delayed ACK adds ~40 ms to every keep-alive reply.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _tokens(self):
+        words = ["Hi,", "I'm", "Doctor", "Cal", "(mock)."]
+        return [words[i % len(words)] + " " for i in range(self.completion_tokens)]
+
+    def _latency(self):
+        if self.latency_dist == "uniform":
+            return max(0.0, self.rng.uniform(self.latency_s - self.jitter_s, self.latency_s + self.jitter_s))
+        if self.latency_dist == "lognormal":
+            return self.latency_s * math.exp(self.rng.gauss(0.0, self.sigma))
+        return self.latency_s
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        try:
+            request = json.loads(raw)
+            stream = bool(request.get("stream"))
+            include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+            model = request.get("model") or "mock"
+        except ValueError:
+            stream = include_usage = False
+            model = "mock"
+
+        latency = self._latency()
+        if latency:
+            time.sleep(latency)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self._send_json(self.error_status, {"error": {"message": "mock upstream error", "type": "server_error"}})
+            return
+        if stream:
+            self._stream_reply(include_usage)
+            return
+
+        if self.token_s:
+            time.sleep(self.token_s * self.completion_tokens)
+        self._send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(self._tokens()).strip()},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(),
+        })
+
+    def _usage(self):
+        return {"prompt_tokens": 10, "completion_tokens": self.completion_tokens,
+                "total_tokens": 10 + self.completion_tokens}
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_reply(self, include_usage=False):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(self._tokens()):
+            if i and self.token_s:
+                time.sleep(self.token_s)
+            event = {"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        if include_usage:
+            event = {"choices": [], "usage": self._usage()}
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def make_server(host="127.0.0.1", port=0, latency_ms=0.0, token_ms=0.0, completion_tokens=8,
+                latency_dist="fixed", jitter_ms=0.0, sigma=0.0, error_rate=0.0, error_status=503, seed=None):
+    """
+    Build (but do not start) a mock server; port 0 picks a free port.
+    latency_ms is the wait before the first token (the median for
+    "lognormal"), token_ms the gap between tokens; non-streaming replies take
+    latency + completion_tokens * token_ms. A fraction error_rate of calls
+    answers error_status instead. seed makes the latency/error sequence repeatable.
+    """
+    if latency_dist not in ("fixed", "uniform", "lognormal"):
+        raise ValueError(f"unknown latency distribution {latency_dist!r}")
+    handler = type("Handler", (MockCompletionsHandler,), {
+        "latency_s": latency_ms / 1000.0,
+        "token_s": token_ms / 1000.0,
+        "completion_tokens": completion_tokens,
+        "latency_dist": latency_dist,
+        "jitter_s": jitter_ms / 1000.0,
+        "sigma": sigma,
+        "error_rate": error_rate,
+        "error_status": error_status,
+        "rng": random.Random(seed),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-ms", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=8)
+    parser.add_argument("--latency-dist", choices=("fixed", "uniform", "lognormal"), default="fixed")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="half-width for --latency-dist uniform")
+    parser.add_argument("--sigma", type=float, default=0.5, help="log-space spread for --latency-dist lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency_ms, args.token_ms, args.completion_tokens,
+                         args.latency_dist, args.jitter_ms, args.sigma, args.error_rate, args.error_status,
+                         args.seed)
+    print(f"Mock completions server on http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
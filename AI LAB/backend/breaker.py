@@ -0,0 +1,119 @@
+"""
+Circuit breaker for upstream calls.
+
+Closed: calls pass; `failure_threshold` failures in a row open the breaker.
+A failure is an exception, a 5xx, or a call slower than `slo_seconds` (a
+success that breaches the latency SLO still means upstream is degraded).
+Open: calls fail immediately with CircuitOpen for `open_seconds`.
+Half-open: up to `half_open_probes` calls go through as probes; a good probe
+closes the breaker, a bad one opens it again.
+
+    token = breaker.before_call()      # may raise CircuitOpen
+    ... call upstream ...
+    breaker.record(token, ok, seconds)
+"""
+import math
+import threading
+import time
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"circuit {name} is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, slo_seconds=None, open_seconds=15.0,
+                 half_open_probes=1, on_event=None):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.slo_seconds = slo_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.on_event = on_event
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.counters = {"opened": 0, "closed": 0, "rejected": 0, "failures": 0, "slo_breaches": 0}
+
+    def _count(self, name):
+        # Called with the lock held.
+        self.counters[name] += 1
+        if self.on_event is not None:
+            self.on_event(self.name, name)
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._probes = 0
+        self._count("opened")
+
+    def open_retry_after(self):
+        """Seconds until calls may pass again if the breaker is open, else None (no state change)."""
+        with self._lock:
+            if self.state != OPEN:
+                return None
+            remaining = self._opened_at + self.open_seconds - time.monotonic()
+            return max(1, math.ceil(remaining)) if remaining > 0 else None
+
+    def before_call(self):
+        """Admit a call (returns a token for record()) or raise CircuitOpen."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    self._count("rejected")
+                    raise CircuitOpen(self.name, max(1, math.ceil(remaining)))
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self._count("rejected")
+                    raise CircuitOpen(self.name, 1)
+                self._probes += 1
+                return HALF_OPEN
+            return CLOSED
+
+    def record(self, token, ok, seconds):
+        """Outcome of a call admitted with `token`; ok=False for errors and 5xx."""
+        slow = self.slo_seconds is not None and seconds > self.slo_seconds
+        with self._lock:
+            if not ok:
+                self._count("failures")
+            elif slow:
+                self._count("slo_breaches")
+            failed = not ok or slow
+            if token == HALF_OPEN:
+                if self.state != HALF_OPEN:
+                    return
+                self._probes -= 1
+                if failed:
+                    self._open(time.monotonic())
+                else:
+                    self.state = CLOSED
+                    self.consecutive_failures = 0
+                    self._count("closed")
+                return
+            if self.state != CLOSED:
+                # Started before the breaker opened; the probes decide now.
+                return
+            if not failed:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self._open(time.monotonic())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(state=self.state, consecutive_failures=self.consecutive_failures,
+                         failure_threshold=self.failure_threshold, slo_seconds=self.slo_seconds)
+            if self.state == OPEN:
+                stats["opens_again_in"] = round(max(0.0, self._opened_at + self.open_seconds - time.monotonic()), 1)
+        return stats
@@ -0,0 +1,272 @@
+"""
+Offline bulk runs of the AI Lab tools over CSV / JSONL cohorts.
+
+    python bulk.py lab-blood cohort.csv -o results.jsonl --concurrency 8 --rate 5
+    python bulk.py bmi-analysis cohort.jsonl -o bmi.jsonl --mode fast
+    python bulk.py chest-xray --images xrays/ -o xray.jsonl
+    python bulk.py chest-xray manifest.csv --images xrays/ -o xray.jsonl     # "image" column names the file
+
+Rows go through the same builders, caches and upstream path as the HTTP
+routes (run_text_tool / run_vision_tool), without HTTP in between. CSV
+columns and JSONL keys are the route's JSON fields; empty CSV cells count
+as missing. Vision tools read the file named in the --image-column of each
+row from --images, or every file in --images when no input file is given.
+
+Input is streamed: at most 2 x --concurrency rows are held at a time, so
+files larger than memory are fine. --rate caps the rows started per second
+across all threads. Results are appended to the JSONL output as they
+finish (completion order, each line carries its "row" number):
+
+    {"row": 12, "id": "P0012", "tool": "lab-blood", "status": 200, "analysis": "..."}
+
+Progress is checkpointed to <output>.ckpt: every row below a watermark,
+plus the few finished rows above it, and the output size at that point.
+After a crash, --resume truncates the output to that size and skips the
+finished rows, so no row is lost or written twice. Rows rejected as busy
+(429 / 503) are retried up to --retries times; other failures are written
+with their status and not retried.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import app as ailab
+
+RETRY_STATUSES = (429, 503)
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart (no limit for rate <= 0)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+class Checkpoint:
+    """Finished input rows: all rows below `watermark`, plus the few in `done` above it."""
+
+    def __init__(self, job, watermark=0, done=(), output_bytes=0, counts=None):
+        self.job = job
+        self.watermark = watermark
+        self.done = set(done)
+        self.output_bytes = output_bytes
+        self.counts = counts or {"ok": 0, "failed": 0}
+
+    def is_done(self, row):
+        return row < self.watermark or row in self.done
+
+    def mark(self, row, ok):
+        self.done.add(row)
+        while self.watermark in self.done:
+            self.done.remove(self.watermark)
+            self.watermark += 1
+        self.counts["ok" if ok else "failed"] += 1
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["job"], data["watermark"], data["done"], data["output_bytes"], data["counts"])
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"job": self.job, "watermark": self.watermark, "done": sorted(self.done),
+                       "output_bytes": self.output_bytes, "counts": self.counts}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+def iter_rows(path, fmt):
+    """(payload, None) per input row, or (None, error) for a row that cannot be parsed."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                yield {k: (v if v != "" else None) for k, v in row.items() if k is not None}, None
+            return
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                payload = json.loads(line)
+            except ValueError as e:
+                yield None, f"Invalid JSON: {e}"
+                continue
+            if isinstance(payload, dict):
+                yield payload, None
+            else:
+                yield None, "Each JSONL line must be an object."
+
+
+def iter_image_dir(directory, column):
+    for name in sorted(os.listdir(directory)):
+        if os.path.isfile(os.path.join(directory, name)) and not name.startswith("."):
+            yield {column: name}, None
+
+
+def _input_format(path, fmt):
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def run_row(args, payload):
+    """One row through its tool: (body, status)."""
+    if args.tool in ailab.VISION_TOOLS:
+        name = payload.get(args.image_column)
+        if not name:
+            return {"error": f"Missing {args.image_column!r} column."}, 400
+        path = os.path.join(args.images, name)
+        try:
+            with open(path, "rb") as image:
+                body, status, _ = ailab.run_vision_tool(args.tool, image, args.cache)
+        except OSError as e:
+            return {"error": f"Cannot read image: {e}"}, 400
+        return body, status
+
+    if args.mode:
+        payload = {**payload, "mode": args.mode}
+    body, status, _ = ailab.run_text_tool(args.tool, payload, args.cache)
+    return body, status
+
+
+def _work(args, limiter, row, payload, error):
+    result = {"row": row, "id": (payload or {}).get(args.id_column), "tool": args.tool}
+    if args.tool in ailab.VISION_TOOLS and payload:
+        result["image"] = payload.get(args.image_column)
+    if error:
+        return {**result, "status": 400, "error": error}
+
+    for attempt in range(args.retries + 1):
+        limiter.wait()
+        try:
+            body, status = run_row(args, payload)
+        except Exception as e:  # keep one bad row from ending the run
+            body, status = {"error": f"Internal error: {e}"}, 500
+        if status not in RETRY_STATUSES or attempt == args.retries:
+            break
+        time.sleep(min(60.0, float(body.get("retry_after") or 2 ** attempt)))
+    return {**result, "status": status, **body}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tool", choices=sorted(set(ailab.TEXT_TOOLS) | set(ailab.VISION_TOOLS)))
+    parser.add_argument("input", nargs="?", help="CSV or JSONL file (optional for vision tools with --images)")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results file")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format (default: from the extension)")
+    parser.add_argument("--images", help="directory holding the images for vision tools")
+    parser.add_argument("--image-column", default="image")
+    parser.add_argument("--id-column", default="id", help="input column copied to each result as \"id\"")
+    parser.add_argument("--concurrency", type=int, default=8, help="rows in flight at once")
+    parser.add_argument("--rate", type=float, default=0.0, help="max rows started per second (0 = no limit)")
+    parser.add_argument("--retries", type=int, default=2, help="retries for rows rejected as busy (429/503)")
+    parser.add_argument("--mode", choices=("fast",), help="mode=fast: answer numeric tools locally, no upstream")
+    parser.add_argument("--cache", choices=("use", "bypass", "refresh"), default="use")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="results between checkpoints")
+    parser.add_argument("--resume", action="store_true", help="continue from <output>.ckpt")
+    args = parser.parse_args()
+
+    vision = args.tool in ailab.VISION_TOOLS
+    if vision and not args.images:
+        parser.error(f"{args.tool} needs --images")
+    if not args.input and not vision:
+        parser.error("an input file is required")
+    args.concurrency = max(1, args.concurrency)
+
+    if args.input:
+        rows = iter_rows(args.input, _input_format(args.input, args.format))
+    else:
+        rows = iter_image_dir(args.images, args.image_column)
+
+    job = {"tool": args.tool, "input": os.path.abspath(args.input or args.images)}
+    ckpt_path = args.output + ".ckpt"
+    if args.resume and os.path.exists(ckpt_path):
+        checkpoint = Checkpoint.load(ckpt_path)
+        if checkpoint.job != job:
+            parser.error(f"{ckpt_path} belongs to a different job: {checkpoint.job}")
+        out = open(args.output, "r+b")
+        out.truncate(checkpoint.output_bytes)
+        out.seek(checkpoint.output_bytes)
+        print(f"resuming after {checkpoint.watermark + len(checkpoint.done)} finished rows", file=sys.stderr)
+    else:
+        if os.path.exists(args.output) and os.path.getsize(args.output):
+            parser.error(f"{args.output} exists without a checkpoint to resume from; remove it first"
+                         if args.resume else f"{args.output} exists; pass --resume to continue it or remove it")
+        checkpoint = Checkpoint(job)
+        out = open(args.output, "wb")
+
+    limiter = RateLimiter(args.rate)
+    started = time.monotonic()
+    processed = since_save = 0
+
+    def save():
+        out.flush()
+        os.fsync(out.fileno())
+        checkpoint.output_bytes = out.tell()
+        checkpoint.save(ckpt_path)
+
+    def collect(futures):
+        nonlocal processed, since_save
+        for future in futures:
+            result = future.result()
+            out.write(json.dumps(result, ensure_ascii=False).encode("utf-8") + b"\n")
+            checkpoint.mark(result["row"], result["status"] == 200)
+            processed += 1
+            since_save += 1
+        if since_save >= args.checkpoint_every:
+            since_save = 0
+            save()
+            counts = checkpoint.counts
+            print(f"{counts['ok']} ok, {counts['failed']} failed, "
+                  f"{processed / (time.monotonic() - started):.1f} rows/s", file=sys.stderr)
+
+    pool = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="bulk")
+    pending = set()
+    try:
+        for row, (payload, error) in enumerate(rows):
+            if checkpoint.is_done(row):
+                continue
+            while len(pending) >= 2 * args.concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(pool.submit(_work, args, limiter, row, payload, error))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    except KeyboardInterrupt:
+        print("interrupted; saving finished rows", file=sys.stderr)
+        for future in pending:
+            future.cancel()
+        collect([f for f in pending if not f.cancelled()])
+        raise SystemExit(130)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        save()
+        out.close()
+
+    counts = checkpoint.counts
+    print(f"done: {counts['ok']} ok, {counts['failed']} failed in {time.monotonic() - started:.1f} s "
+          f"-> {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
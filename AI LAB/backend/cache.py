@@ -0,0 +1,311 @@
+"""
+Response caches for the deterministic text tools and the vision tools.
+
+Two tiers: a per-process LRU with TTL, and an optional SQLite file that
+all gunicorn workers on the host share. Keys are built from the tool name,
+its prompt version and the *normalized* request inputs, so 70, "70" and
+70.0 kg all land on the same entry. Vision results are content-addressed:
+the key is a hash of the uploaded image bytes.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+_TRUE_WORDS = {"true", "yes", "y", "1", "on"}
+_FALSE_WORDS = {"false", "no", "n", "0", "off"}
+
+
+def canonical_number(value):
+    """70, "70", "70.0" and 70.00001 -> "70"; anything non-numeric falls back to text."""
+    if value is None:
+        return None
+    try:
+        return format(float(value), ".6g")
+    except (TypeError, ValueError):
+        return canonical_text(value)
+
+
+def canonical_bool(value):
+    """
+    True / "yes" / "Y" / 1 / 1.0 -> True, False / "no" / 0 / "0.0" -> False,
+    unknown -> text. Like engine.to_bool_array, any non-zero finite number is true.
+    """
+    if value is None or isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    try:
+        number = float(text)
+    except ValueError:
+        pass
+    else:
+        return math.isfinite(number) and number != 0
+    if text in _TRUE_WORDS:
+        return True
+    if text in _FALSE_WORDS:
+        return False
+    return text
+
+
+def canonical_text(value):
+    if value is None:
+        return None
+    text = str(value).strip().lower()
+    return text or None
+
+
+def make_key(tool, prompt_version, inputs):
+    """Stable hex key for (tool, prompt version, normalized inputs)."""
+    blob = json.dumps([tool, prompt_version, inputs], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class MemoryLRU:
+    """Thread-safe LRU with a per-entry expiry time."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteStore:
+    """
+    Small key/value table in a local SQLite file shared across worker processes.
+    Each process uses one connection behind a lock (reopened after a fork);
+    per-thread connections would leak one per greenlet under gevent workers.
+    WAL mode lets readers and the single writer of different processes
+    proceed concurrently. Bounded by entry count and, optionally, by the
+    total size of the stored values.
+    """
+
+    def __init__(self, path, max_entries, ttl, max_bytes=None, prune_every=64):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prune_every = max(1, prune_every)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._writes = 0
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._create_schema(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _create_schema(conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " size INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+        if "size" not in columns:
+            conn.execute("ALTER TABLE entries ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires_at)")
+        # Row count and total size, kept current by triggers, so a prune can
+        # tell whether a cap is exceeded without scanning the table.
+        conn.execute("CREATE TABLE IF NOT EXISTS totals ("
+                     " id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL, bytes INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO totals SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM entries")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN"
+                     " UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size; END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN"
+                     " UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size; END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS entries_resize AFTER UPDATE OF size ON entries BEGIN"
+                     " UPDATE totals SET bytes = bytes - OLD.size + NEW.size; END")
+
+    def _conn(self):
+        # Called with the lock held.
+        if self._connection is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._connection = conn
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            conn = self._conn()
+            row = conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        blob = json.dumps(value)
+        with self._lock:
+            conn = self._conn()
+            # An upsert rather than INSERT OR REPLACE: REPLACE's implicit
+            # delete would not fire the trigger that keeps `totals` right.
+            conn.execute(
+                "INSERT INTO entries (key, value, expires_at, accessed_at, size) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at,"
+                " accessed_at = excluded.accessed_at, size = excluded.size",
+                (key, blob, now + self.ttl, now, len(blob)),
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._prune(conn, now)
+
+    def prune(self, now=None):
+        """Drop expired rows, then the least recently used ones beyond max_entries / max_bytes."""
+        with self._lock:
+            self._prune(self._conn(), now or time.time())
+
+    def _prune(self, conn, now):
+        # Called with the lock held. Every query here walks an index, and the
+        # eviction loop only runs while a cap is exceeded, so the cost depends
+        # on the rows removed rather than on the size of the table.
+        conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+        while True:
+            entries, total = conn.execute("SELECT entries, bytes FROM totals").fetchone()
+            excess_entries = entries - self.max_entries
+            excess_bytes = total - self.max_bytes if self.max_bytes else 0
+            if excess_entries <= 0 and excess_bytes <= 0:
+                return
+            oldest = conn.execute(
+                "SELECT key, size FROM entries ORDER BY accessed_at LIMIT ?",
+                (max(excess_entries, 0) + (64 if excess_bytes > 0 else 0),),
+            ).fetchall()
+            victims = []
+            for key, size in oldest:
+                if excess_entries <= 0 and excess_bytes <= 0:
+                    break
+                victims.append((key,))
+                excess_entries -= 1
+                excess_bytes -= size
+            if not victims:
+                return
+            conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def total_bytes(self):
+        with self._lock:
+            return self._conn().execute("SELECT bytes FROM totals").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn().execute("SELECT entries FROM totals").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    Memory LRU in front of an optional shared SQLite tier, with hit/miss counters.
+    If the SQLite file cannot be opened, the cache logs it and stays memory-only.
+    on_event(name), if given, is called with each counter name as it is bumped.
+    """
+
+    def __init__(self, max_entries=1024, ttl=86400, disk_path=None, disk_max_entries=100000,
+                 disk_max_bytes=None, disk_prune_every=64, on_event=None):
+        self.memory = MemoryLRU(max_entries, ttl)
+        self.disk = None
+        if disk_path:
+            try:
+                self.disk = SqliteStore(disk_path, disk_max_entries, ttl,
+                                        max_bytes=disk_max_bytes, prune_every=disk_prune_every)
+            except (sqlite3.Error, OSError) as e:
+                log.warning("cache file %s unavailable, keeping the cache in memory: %s", disk_path, e)
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypasses": 0}
+        self.on_event = on_event
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+        if self.on_event is not None:
+            self.on_event(name)
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except sqlite3.Error:
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+                self._count("disk_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except sqlite3.Error:
+                pass
+        self._count("stores")
+
+    def note_bypass(self):
+        self._count("bypasses")
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        counters["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        counters["memory_entries"] = len(self.memory)
+        if self.disk is not None:
+            try:
+                counters["disk_entries"] = len(self.disk)
+                counters["disk_bytes"] = self.disk.total_bytes()
+            except sqlite3.Error:
+                counters["disk_entries"] = None
+        counters["pid"] = os.getpid()
+        return counters
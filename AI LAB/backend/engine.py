@@ -0,0 +1,138 @@
+"""
+Local, deterministic computations behind the numeric tools.
+
+BMI with Asian-oriented categories, reference-range flags for Hb / WBC /
+PLT and a qualitative count of cardiovascular risk factors. Every function
+takes scalars or equal-length arrays (numpy broadcasting), so the same code
+answers one request in microseconds or scores a whole cohort at once.
+Missing or non-numeric values become NaN and yield "unknown".
+
+These are teaching approximations, not clinical reference values.
+"""
+import numpy as np
+
+# WHO Asia-Pacific BMI cut-offs (kg/m²).
+BMI_EDGES = np.array([18.5, 23.0, 25.0])
+BMI_LABELS = np.array(["underweight", "normal", "overweight", "obese"])
+
+# Sex is carried as a small integer code so per-sex thresholds are array lookups.
+SEX_UNKNOWN, SEX_MALE, SEX_FEMALE = 0, 1, 2
+_SEX_WORDS = {"m": SEX_MALE, "male": SEX_MALE, "man": SEX_MALE,
+              "f": SEX_FEMALE, "female": SEX_FEMALE, "woman": SEX_FEMALE}
+
+# Typical adult ranges, indexed by sex code: unknown, male, female.
+HB_LOW = np.array([12.0, 13.5, 12.0])    # g/dL
+HB_HIGH = np.array([17.5, 17.5, 15.5])
+WBC_RANGE = (4.0, 11.0)     # x10^9/L
+PLT_RANGE = (150.0, 450.0)  # x10^9/L
+
+SBP_ELEVATED = 130.0  # mmHg
+CHOL_HIGH = 5.2       # mmol/L, total cholesterol
+AGE_RISK = np.array([50.0, 45.0, 55.0])
+
+RISK_BANDS = np.array(["lower", "mildly raised", "moderately raised", "higher"])
+
+_TRUE_WORDS = {"true", "yes", "y", "1", "on"}
+
+
+def to_float_array(values):
+    """Numbers, numeric strings, None or garbage -> float array with NaN for the unusable ones."""
+    try:
+        return np.atleast_1d(np.array(values, dtype=float))
+    except (TypeError, ValueError):
+        pass
+    flat = np.atleast_1d(np.asarray(values, dtype=object))
+    out = np.full(flat.shape, np.nan)
+    for i, v in enumerate(flat):
+        try:
+            out[i] = float(v)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+def _map_distinct(values, fn, dtype):
+    """Apply fn once per distinct value (as text) instead of once per record."""
+    text = np.atleast_1d(np.asarray(values, dtype=object)).astype(str)
+    distinct, inverse = np.unique(text, return_inverse=True)
+    return np.array([fn(v) for v in distinct], dtype=dtype)[inverse.reshape(text.shape)]
+
+
+def _truthy_text(text):
+    """"yes" / "1" / "1.0" / "2" -> True; "no", "0.0", "nan", garbage -> False."""
+    text = text.strip().lower()
+    try:
+        number = float(text)
+    except ValueError:
+        return text in _TRUE_WORDS
+    return bool(np.isfinite(number) and number != 0)
+
+
+def to_bool_array(values):
+    """Booleans, yes/no words or numbers (any non-zero finite one is true) -> bool array."""
+    arr = np.atleast_1d(np.asarray(values))
+    if arr.dtype == bool:
+        return arr
+    if arr.dtype.kind in "iuf":
+        return np.isfinite(arr) & (arr != 0)
+    return _map_distinct(values, _truthy_text, bool)
+
+
+def to_sex_codes(values, n=1):
+    """"M" / "female" / None ... -> SEX_* codes; None alone means unknown for all n records."""
+    if values is None:
+        return np.zeros(n, dtype=int)
+    return _map_distinct(values, lambda v: _SEX_WORDS.get(v.strip().lower(), SEX_UNKNOWN), int)
+
+
+def bmi(weight_kg, height_cm):
+    weight = to_float_array(weight_kg)
+    height_m = to_float_array(height_cm) / 100.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        value = weight / (height_m * height_m)
+    value[~np.isfinite(value) | (weight <= 0) | (height_m <= 0)] = np.nan
+    return value
+
+
+def bmi_category(bmi_value):
+    value = np.atleast_1d(np.asarray(bmi_value, dtype=float))
+    labels = BMI_LABELS[np.searchsorted(BMI_EDGES, value, side="right")]
+    return np.where(np.isnan(value), "unknown", labels)
+
+
+def _flag(value, low, high):
+    return np.select([np.isnan(value), value < low, value > high], ["unknown", "low", "high"], "normal")
+
+
+def lab_flags(hb, wbc, plt, sex=None):
+    """Dict of "low" / "normal" / "high" arrays for each count, plus the Hb range used."""
+    hb = to_float_array(hb)
+    sexes = to_sex_codes(sex, len(hb))
+    hb_low, hb_high = HB_LOW[sexes], HB_HIGH[sexes]
+    return {
+        "hb": _flag(hb, hb_low, hb_high),
+        "wbc": _flag(to_float_array(wbc), *WBC_RANGE),
+        "plt": _flag(to_float_array(plt), *PLT_RANGE),
+        "hb_range": np.stack([hb_low, hb_high], axis=-1),
+    }
+
+
+def cardiac_risk_factors(age, sex, sbp, smoker, diabetes, chol):
+    """
+    Boolean array per risk factor, their count and a qualitative band.
+    Unknown cholesterol simply does not count as a factor.
+    """
+    ages = to_float_array(age)
+    factors = {
+        "age": ages >= AGE_RISK[to_sex_codes(sex, len(ages))],
+        "blood_pressure": to_float_array(sbp) >= SBP_ELEVATED,
+        "smoking": to_bool_array(smoker),
+        "diabetes": to_bool_array(diabetes),
+        "cholesterol": to_float_array(chol) >= CHOL_HIGH,
+    }
+    count = np.sum(np.stack(list(factors.values())), axis=0)
+    return {
+        "factors": factors,
+        "count": count,
+        "band": RISK_BANDS[np.minimum(count, len(RISK_BANDS) - 1)],
+    }
@@ -0,0 +1,75 @@
+"""
+Gunicorn settings for the AI LAB backend.
+
+    gunicorn app:app                      # SERVING_MODE=sync (default)
+    SERVING_MODE=async gunicorn app:app   # cooperative gevent workers
+
+In async mode each worker runs every request in a greenlet and the
+upstream HTTP calls yield while waiting, so one process can hold hundreds
+of in-flight OpenAI calls instead of one per worker. The Flask routes are
+unchanged; only the worker class differs.
+
+Upstream admission: the per-worker caps in admission.py only bind when a
+worker runs several requests at once (gthread / gevent). The host-wide caps
+(ADMISSION_*_HOST_MAX_IN_FLIGHT) are shared by all workers through slot
+files, so they also hold with the default sync workers.
+
+Metrics: every worker writes its Prometheus samples under
+PROMETHEUS_MULTIPROC_DIR, so /metrics reports the sum over all workers. By
+default that is a fresh directory per server start inside the per-user
+state directory (see statedir.py), removed again on shutdown, so two
+deployments on one host never share samples.
+"""
+import glob
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import statedir  # noqa: E402
+
+SERVING_MODE = os.environ.get("SERVING_MODE", "sync").lower()
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+
+# Vision calls may wait up to 60 s on upstream; keep the worker alive past that.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "90"))
+graceful_timeout = 30
+
+if SERVING_MODE == "async":
+    worker_class = "gevent"
+    worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "500"))
+    # Let the per-worker upstream pool grow with the number of greenlets,
+    # otherwise most in-flight calls would open throwaway connections.
+    os.environ.setdefault("UPSTREAM_POOL_SIZE", str(worker_connections))
+else:
+    worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+    threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+
+# Must be set before the workers import prometheus_client.
+_OWN_METRICS_DIR = None
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    # mkdtemp creates it with mode 0700.
+    _OWN_METRICS_DIR = tempfile.mkdtemp(prefix="prometheus-", dir=statedir.private_dir("metrics"))
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = _OWN_METRICS_DIR
+
+
+def on_starting(server):
+    # Samples from a previous run would otherwise be added to this one's.
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.unlink(path)
+
+
+def on_exit(server):
+    if _OWN_METRICS_DIR:
+        shutil.rmtree(_OWN_METRICS_DIR, ignore_errors=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,118 @@
+"""
+Budgeted request hedging.
+
+Hedger.run(primary, hedge) starts primary(); if it has not finished after
+the recent p95 latency, it also starts hedge() and returns whichever
+succeeds first. The slower attempt keeps running in the background and
+its result is dropped.
+
+Hedges are paid for from a token budget that earns `budget_ratio` tokens
+per call (capped at `burst`). With budget_ratio <= 1, hedging can never
+more than double upstream load. Until `min_samples` latencies have been
+seen there is no p95, so nothing is hedged.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class Hedger:
+    def __init__(self, name, executor, budget_ratio=0.1, burst=10.0, quantile=95, min_samples=20,
+                 min_delay=0.05, window=500, on_event=None):
+        self.name = name
+        self.executor = executor
+        self.budget_ratio = min(1.0, max(0.0, budget_ratio))
+        self.burst = burst
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.on_event = on_event
+        self._latencies = deque(maxlen=window)
+        self._delay = None
+        self._since_update = 0
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "hedged": 0, "hedge_wins": 0, "primary_wins": 0,
+                         "skipped_budget": 0, "skipped_no_slot": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+        if self.on_event is not None:
+            self.on_event(self.name, name)
+
+    def observe(self, seconds):
+        """Latency of one successful attempt; the hedge delay is refreshed every 16 samples."""
+        with self._lock:
+            self._latencies.append(seconds)
+            self._since_update += 1
+            if self._since_update >= 16 and len(self._latencies) >= self.min_samples:
+                self._since_update = 0
+                ranked = sorted(self._latencies)
+                p = ranked[min(len(ranked) - 1, int(len(ranked) * self.quantile / 100.0))]
+                self._delay = max(self.min_delay, p)
+
+    def _take_token(self):
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    def _timed(self, fn):
+        def attempt():
+            start = time.perf_counter()
+            result = fn()
+            if result is not None and result[1] is None:
+                self.observe(time.perf_counter() - start)
+            return result
+        return attempt
+
+    def run(self, primary, hedge):
+        """
+        primary() and hedge() return (answer, err); hedge() may return None
+        when it cannot start (e.g. no admission slot). Returns the first
+        successful result, else the primary's error.
+        """
+        with self._lock:
+            self.counters["calls"] += 1
+            self._tokens = min(self.burst, self._tokens + self.budget_ratio)
+            delay = self._delay
+        first = self.executor.submit(self._timed(primary))
+        if delay is None or wait([first], timeout=delay).done:
+            return first.result()
+        if not self._take_token():
+            self._count("skipped_budget")
+            return first.result()
+
+        self._count("hedged")
+        second = self.executor.submit(self._timed(hedge))
+        pending = {first, second}
+        failed = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result is None:
+                    # The hedge never went out: refund it.
+                    with self._lock:
+                        self.counters["hedged"] -= 1
+                        self._tokens = min(self.burst, self._tokens + 1.0)
+                    self._count("skipped_no_slot")
+                    continue
+                if result[1] is None:
+                    self._count("hedge_wins" if future is second else "primary_wins")
+                    return result
+                if failed is None or future is first:
+                    failed = result
+        return failed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(delay_ms=None if self._delay is None else round(self._delay * 1000, 1),
+                         budget_ratio=self.budget_ratio, tokens=round(self._tokens, 2),
+                         samples=len(self._latencies))
+        stats["hedge_win_rate"] = round(stats["hedge_wins"] / stats["hedged"], 4) if stats["hedged"] else 0.0
+        return stats
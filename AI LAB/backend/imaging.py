@@ -0,0 +1,149 @@
+"""
+Image normalization before an upload is sent to the vision model.
+
+Uploads are sniffed for their real format, downscaled to VISION_MAX_EDGE,
+stripped of metadata and re-encoded as JPEG or WebP. The model never looks
+at more than ~1.5k pixels per edge anyway, so shipping a 20 MB PNG only
+costs upload time and latency. Transcoding runs on a small worker pool so
+the request thread (or the gevent hub) is not tied up by Pillow.
+
+An upload that is already fine is sent as is: a format and mode the API
+accepts, a single frame, within MAX_EDGE and without EXIF metadata. So is
+one whose re-encoded version would not be smaller, unless it carries EXIF
+metadata (which is always stripped). Re-encoding those would only add
+bytes and JPEG artifacts.
+"""
+import io
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow missing: fall back to sending the original bytes.
+    Image = None
+
+NORMALIZE_ENABLED = os.environ.get("VISION_NORMALIZE", "1") != "0"
+MAX_EDGE = int(os.environ.get("VISION_MAX_EDGE", "1536"))
+OUTPUT_FORMAT = os.environ.get("VISION_IMAGE_FORMAT", "jpeg").lower()
+QUALITY = int(os.environ.get("VISION_IMAGE_QUALITY", "85"))
+# Decoding costs ~3 bytes per pixel; larger images are streamed through unmodified.
+MAX_PIXELS = int(os.environ.get("VISION_MAX_PIXELS", str(50_000_000)))
+TRANSCODE_WORKERS = int(os.environ.get("VISION_TRANSCODE_WORKERS", "2"))
+
+_OUTPUT_MIME = {"jpeg": "image/jpeg", "webp": "image/webp"}
+# Formats the vision API takes directly, and the modes each can be sent in.
+_SENDABLE_MODES = {
+    "JPEG": {"RGB", "L"},
+    "PNG": {"RGB", "RGBA", "L", "LA", "P", "1"},
+    "GIF": {"P", "L"},
+    "WEBP": {"RGB", "RGBA"},
+}
+
+NormalizedImage = namedtuple("NormalizedImage", "stream mime bytes_in bytes_out transcoded")
+
+_executor = None
+
+
+def sniff_mime(data):
+    """Best-effort MIME type from the leading magic bytes; None if unknown."""
+    head = bytes(data[:12])
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"BM"):
+        return "image/bmp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    return None
+
+
+def _sendable(img):
+    """Whether the upstream API can take this (still undecoded) image without conversion."""
+    return (img.mode in _SENDABLE_MODES.get(img.format, ())
+            and max(img.size) <= MAX_EDGE
+            and getattr(img, "n_frames", 1) == 1)
+
+
+def _transcode(stream):
+    """
+    (re-encoded stream, MIME type, whether the original may still be sent
+    if it is smaller), or (None, None, True) to send the original as is.
+    """
+    img = Image.open(stream)
+    if img.width * img.height > MAX_PIXELS:
+        raise ValueError("image too large to decode")
+    # Anything with EXIF is re-encoded, which drops the metadata.
+    original_ok = img.format in _SENDABLE_MODES and not img.getexif()
+    if original_ok and _sendable(img):
+        return None, None, True
+    if img.format == "JPEG":
+        # Let libjpeg decode at a reduced scale instead of full size then shrinking.
+        img.draft("RGB", (MAX_EDGE, MAX_EDGE))
+    ImageOps.exif_transpose(img, in_place=True)
+    img.thumbnail((MAX_EDGE, MAX_EDGE), Image.LANCZOS)
+
+    if img.mode in ("I;16", "I;16B", "I;16L", "I"):
+        # 16-bit greyscale (common for X-ray PNGs): scale down to 8-bit.
+        img = img.convert("I").point(lambda v: v * (1 / 256)).convert("L")
+    elif img.mode not in ("RGB", "L"):
+        if "A" in img.getbands() or img.mode == "P":
+            rgba = img.convert("RGBA")
+            background = Image.new("RGB", rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+
+    out = io.BytesIO()
+    fmt = OUTPUT_FORMAT if OUTPUT_FORMAT in _OUTPUT_MIME else "jpeg"
+    # No exif=/icc_profile= arguments: the re-encoded file carries no metadata.
+    if fmt == "webp":
+        img.save(out, format="WEBP", quality=QUALITY, method=4)
+    else:
+        img.save(out, format="JPEG", quality=QUALITY, optimize=True, progressive=True)
+    out.seek(0)
+    return out, _OUTPUT_MIME[fmt], original_ok
+
+
+def _run_in_pool(fn, *args):
+    global _executor
+    try:
+        from gevent import get_hub, monkey
+        if monkey.is_module_patched("threading"):
+            # Under gevent workers "threads" are greenlets; use the hub's real OS thread pool.
+            return get_hub().threadpool.apply(fn, args)
+    except ImportError:
+        pass
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix="transcode")
+    return _executor.submit(fn, *args).result()
+
+
+def normalize(stream):
+    """
+    Return a NormalizedImage for an uploaded image (a seekable file object).
+    Pillow reads straight from the (possibly disk-spooled) upload; anything it
+    cannot decode, or that is best sent as is (see the module docstring), is
+    passed through untouched with its sniffed MIME type.
+    """
+    stream.seek(0)
+    sniffed = sniff_mime(stream.read(12)) or "image/jpeg"
+    stream.seek(0, os.SEEK_END)
+    size_in = stream.tell()
+    stream.seek(0)
+    if not NORMALIZE_ENABLED or Image is None:
+        return NormalizedImage(stream, sniffed, size_in, size_in, False)
+    try:
+        out, mime, original_ok = _run_in_pool(_transcode, stream)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        out, original_ok = None, True
+    if out is None or (original_ok and out.getbuffer().nbytes >= size_in):
+        stream.seek(0)
+        return NormalizedImage(stream, sniffed, size_in, size_in, False)
+    return NormalizedImage(out, mime, size_in, out.getbuffer().nbytes, True)
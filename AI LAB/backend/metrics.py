@@ -0,0 +1,141 @@
+"""
+Prometheus metrics for the /api/* routes and the upstream calls behind them.
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+(gunicorn.conf.py sets this up), and /metrics merges all workers' files, so
+a scrape sees the whole service no matter which worker answers it. Without
+that variable (e.g. `python app.py`) the in-process registry is exported.
+
+Request phases are timed with `with metrics.phase("name"):`; the durations
+are kept on flask.g for the current request and observed once it finishes.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 90)
+BYTES_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256 B .. 64 MB
+
+REQUESTS = Counter(
+    "ailab_http_requests_total", "Requests to /api/* routes.", ["route", "method", "status"])
+REQUEST_LATENCY = Histogram(
+    "ailab_http_request_duration_seconds", "Time until the response is returned (streams: until headers).",
+    ["route"], buckets=LATENCY_BUCKETS)
+IN_PROGRESS = Gauge(
+    "ailab_http_requests_in_progress", "Requests currently being handled.", ["route"],
+    multiprocess_mode="livesum")
+PHASE_LATENCY = Histogram(
+    "ailab_request_phase_duration_seconds", "Time spent in each phase of a request.",
+    ["route", "phase"], buckets=LATENCY_BUCKETS)
+PAYLOAD_BYTES = Histogram(
+    "ailab_payload_bytes", "Sizes of request, response, upstream and image payloads.",
+    ["route", "kind"], buckets=BYTES_BUCKETS)
+
+UPSTREAM_REQUESTS = Counter(
+    "ailab_upstream_requests_total", "Upstream chat-completions calls by backend and outcome.",
+    ["kind", "backend", "status"])
+UPSTREAM_LATENCY = Histogram(
+    "ailab_upstream_duration_seconds", "Upstream wait per call and backend, retries included.",
+    ["kind", "backend"], buckets=LATENCY_BUCKETS)
+TOKENS = Counter(
+    "ailab_upstream_tokens_total", "Tokens reported in the upstream usage field.", ["kind", "model", "type"])
+
+CACHE_EVENTS = Counter(
+    "ailab_cache_events_total", "Response cache lookups and writes.", ["cache", "event"])
+ADMISSION_EVENTS = Counter(
+    "ailab_admission_events_total", "Upstream admission decisions and 429 back-offs.", ["pool", "event"])
+BREAKER_EVENTS = Counter(
+    "ailab_breaker_events_total", "Circuit breaker transitions, rejections, failures and SLO breaches.",
+    ["breaker", "event"])
+HEDGE_EVENTS = Counter(
+    "ailab_hedge_events_total", "Hedged upstream calls and which attempt won.", ["hedger", "event"])
+COALESCE_EVENTS = Counter(
+    "ailab_coalesce_events_total", "Single-flight leaders and coalesced followers.", ["event"])
+SESSION_EVENTS = Counter(
+    "ailab_session_events_total", "Doctor-chat sessions started, resumed and saved.", ["event"])
+SESSION_HISTORY_TOKENS = Counter(
+    "ailab_session_history_tokens_total",
+    "Estimated conversation-history tokens: sent (budgeted) vs. full (whole history resent).", ["kind"])
+
+
+def _route():
+    rule = g.get("metrics_route")
+    return rule or "other"
+
+
+@contextmanager
+def phase(name):
+    """Time a block as one phase of the current request (no-op outside a request)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - start)
+
+
+def add_phase(name, seconds):
+    if not has_request_context():
+        return
+    phases = g.setdefault("phases", {})
+    phases[name] = phases.get(name, 0.0) + seconds
+
+
+def observe_bytes(kind, size):
+    if size is None or not has_request_context() or not g.get("metrics_route"):
+        return
+    PAYLOAD_BYTES.labels(_route(), kind).observe(size)
+
+
+def observe_upstream(kind, status, seconds, backend="default"):
+    """Record one upstream call; status is the HTTP code or "error" when no response came back."""
+    UPSTREAM_REQUESTS.labels(kind, backend, str(status)).inc()
+    UPSTREAM_LATENCY.labels(kind, backend).observe(seconds)
+
+
+def observe_tokens(kind, model, usage):
+    for token_type in ("prompt_tokens", "completion_tokens"):
+        count = (usage or {}).get(token_type)
+        if count:
+            TOKENS.labels(kind, model, token_type.split("_")[0]).inc(count)
+
+
+def start_request(route):
+    g.metrics_route = route
+    g.metrics_start = time.perf_counter()
+    IN_PROGRESS.labels(route).inc()
+
+
+def finish_request(method, response):
+    route = g.get("metrics_route")
+    if not route:
+        return
+    g.metrics_route = None
+    IN_PROGRESS.labels(route).dec()
+    REQUESTS.labels(route, method, str(response.status_code)).inc()
+    REQUEST_LATENCY.labels(route).observe(time.perf_counter() - g.metrics_start)
+    for name, seconds in g.get("phases", {}).items():
+        PHASE_LATENCY.labels(route, name).observe(seconds)
+    if not response.is_streamed:
+        PAYLOAD_BYTES.labels(route, "response").observe(response.calculate_content_length() or 0)
+
+
+def render():
+    """(body, content type) of the scrape output, merged across workers when multiprocess mode is on."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,365 @@
+"""
+Near-duplicate answer cache for free-text questions (doctor-chat).
+
+Questions are normalized (lowercase, common abbreviations expanded, filler
+words dropped, plurals folded) into a set of words, so "What is high blood
+pressure?" and "what does high BP mean" both become {high, blood, pressure}.
+Equal word sets always match. Beyond that, each set gets a MinHash
+signature; the fraction of equal signature slots estimates the Jaccard
+similarity of two questions, and a stored answer is served when the best
+match reaches `threshold`, subject to two guards:
+- both questions carry exactly the same GUARD_WORDS (negation, "with" /
+  "without", and who is asking about: children, pregnancy, ...), since one
+  such word flips the medical answer while barely moving the similarity
+- the question has at least `min_words` words; shorter ones are too coarse
+  for MinHash to tell apart, so they only match exactly
+
+Signatures live in one preallocated numpy array (max_entries x num_perm
+uint32). An LSH index (`bands` bands of num_perm / bands rows) finds the few
+candidate rows to compare, so a lookup costs a handful of dict probes and one
+small vectorized comparison regardless of cache size. Only the newest
+`bucket_scan` entries of a band bucket are compared, which bounds lookups
+when many similar questions pile into one bucket. Full, it evicts with the
+CLOCK algorithm (an approximation of LRU) and entries expire after `ttl`.
+
+Keys are (namespace, question); answers from different namespaces (prompt
+version, model) never match each other.
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+# Expanded before filler words are dropped; the longest phrase wins.
+SYNONYMS = {
+    "bp": "blood pressure",
+    "hbp": "high blood pressure",
+    "htn": "high blood pressure",
+    "hypertension": "high blood pressure",
+    "hypotension": "low blood pressure",
+    "hr": "heart rate",
+    "pulse": "heart rate",
+    "mi": "heart attack",
+    "myocardial infarction": "heart attack",
+    "cardiac arrest": "heart stop",
+    "dm": "diabetes",
+    "diabetic": "diabetes",
+    "blood sugar": "glucose",
+    "blood glucose": "glucose",
+    "sugar level": "glucose",
+    "chol": "cholesterol",
+    "ha": "headache",
+    "head ache": "headache",
+    "flu": "influenza",
+    "uti": "urinary tract infection",
+    "copd": "chronic obstructive pulmonary disease",
+    "gerd": "acid reflux",
+    "heartburn": "acid reflux",
+    "meds": "medication",
+    "medicine": "medication",
+    "medicines": "medication",
+    "drug": "medication",
+    "drugs": "medication",
+    "pills": "medication",
+    "diabetics": "diabetes",
+    "kid": "child",
+    "kids": "child",
+    "children": "child",
+    "pediatric": "child",
+    "paediatric": "child",
+    "infant": "baby",
+    "infants": "baby",
+    "babies": "baby",
+    "newborn": "baby",
+    "newborns": "baby",
+    "teens": "teenager",
+    "teen": "teenager",
+    "adolescent": "teenager",
+    "adolescents": "teenager",
+    "adults": "adult",
+    "woman": "women",
+    "female": "women",
+    "females": "women",
+    "man": "men",
+    "male": "men",
+    "males": "men",
+    "pregnant": "pregnancy",
+    "elderly": "older adult",
+    "senior": "older adult",
+    "seniors": "older adult",
+    "breastfeeding": "breastfeed",
+    "dont": "not",
+    "doesnt": "not",
+    "cant": "not",
+    "isnt": "not",
+    "arent": "not",
+    "shouldnt": "not",
+    "wont": "not",
+    "never": "not",
+    "signs": "symptom",
+    "sign": "symptom",
+    "symptoms": "symptom",
+    "caused": "cause",
+    "causes": "cause",
+    "causing": "cause",
+    "reduce": "lower",
+    "decrease": "lower",
+    "bring down": "lower",
+    "dangerous": "danger",
+    "bad": "danger",
+    "harmful": "danger",
+    "normal range": "normal",
+}
+
+FILLER_WORDS = frozenset("""
+a an the is are was were be been being am do does did doing done have has had
+what whats which who whom this that these those there it its it's i im i'm me my
+mine we our you your yours he she they them their his her of to on at by
+from about as into than then so and or but if can could would will shall
+may might must please tell explain know mean means meaning meant definition
+define exactly really actually just very much some any thing things something
+doctor cal dr hi hello hey thanks thank want wanted wondering wonder curious like
+ask asking question
+""".split())
+
+# Words that change the answer: a near match must have exactly the same ones
+# (after SYNONYMS). Never filler.
+GUARD_WORDS = frozenset("""
+with without non not no
+child baby teenager adult older women men pregnancy breastfeed
+""".split())
+
+_WORD = re.compile(r"[a-z0-9]+")
+_PHRASES = re.compile(r"\b(" + "|".join(
+    re.escape(p) for p in sorted(SYNONYMS, key=len, reverse=True)) + r")\b")
+
+
+def normalize(question):
+    """Canonical word set of a question as a sorted, space-joined string ("" if nothing is left)."""
+    text = unicodedata.normalize("NFKC", str(question or "")).lower()
+    text = " ".join(_WORD.findall(text.replace("'", "")))
+    text = _PHRASES.sub(lambda m: SYNONYMS[m.group(1)], text)
+    words = set()
+    for word in text.split():
+        if word in FILLER_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return " ".join(sorted(words))
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _word_hashes(text):
+    return np.array([_hash64(w) for w in text.split()], dtype=np.uint64)
+
+
+def _guard_key(text):
+    """Hash of the GUARD_WORDS in a normalized question (equal iff the guard words are)."""
+    return _hash64(" ".join(w for w in text.split() if w in GUARD_WORDS))
+
+
+class QuestionCache:
+    """
+    Same get/set/note_bypass/stats interface as cache.ResponseCache, with
+    (namespace, question) keys. on_event(name), if given, is called with
+    each counter name as it is bumped.
+    """
+
+    def __init__(self, max_entries=5000, threshold=0.9, ttl=86400, num_perm=80, bands=16,
+                 bucket_scan=128, min_words=4, on_event=None, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.max_entries = max(0, max_entries)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.num_perm = num_perm
+        self.bands = bands
+        self.bucket_scan = bucket_scan
+        self.min_words = min_words
+        self.on_event = on_event
+
+        # Multiply-shift hash family: h(x) = (a * x + b) mod 2**64 >> 32, a odd.
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self._band_mix = rng.integers(1, 2 ** 63, num_perm // bands, dtype=np.uint64) | np.uint64(1)
+
+        n = self.max_entries
+        self._sigs = np.zeros((n, num_perm), dtype=np.uint32)
+        self._ns = np.full(n, -1, dtype=np.int32)        # -1 marks an empty slot
+        self._expires = np.zeros(n, dtype=np.float64)
+        self._guards = np.zeros(n, dtype=np.uint64)      # _guard_key of each entry
+        self._referenced = np.zeros(n, dtype=bool)       # CLOCK reference bits
+        self._texts = [None] * n
+        self._answers = [None] * n
+        self._exact = {}                                 # (ns, normalized text) -> slot
+        self._buckets = [{} for _ in range(bands)]       # band key -> [slots]
+        self._namespaces = {}
+        self._hand = 0
+        self._size = 0
+        self._answer_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "near_hits": 0, "misses": 0, "stores": 0, "bypasses": 0,
+                         "evictions": 0, "unsignable": 0}
+
+    def _count(self, name):
+        # Called with the lock held.
+        self.counters[name] += 1
+        if self.on_event is not None:
+            self.on_event(name)
+
+    def signature(self, text):
+        """MinHash signature (uint32 array) of a normalized question."""
+        hashes = _word_hashes(text)
+        mixed = (self._a[:, None] * hashes[None, :] + self._b[:, None]) >> np.uint64(32)
+        return mixed.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, sig):
+        rows = sig.reshape(self.bands, -1).astype(np.uint64)
+        return (rows * self._band_mix).sum(axis=1).tolist()
+
+    def similarity(self, a, b):
+        """Estimated similarity of two raw questions, 0..1 (for tuning the threshold)."""
+        a, b = normalize(a), normalize(b)
+        if not a or not b:
+            return 0.0
+        return float((self.signature(a) == self.signature(b)).mean())
+
+    def matches(self, a, b):
+        """Whether get() would serve the answer stored for question a to question b."""
+        a, b = normalize(a), normalize(b)
+        if not a or not b:
+            return False
+        if a == b:
+            return True
+        if len(b.split()) < self.min_words or _guard_key(a) != _guard_key(b):
+            return False
+        return float((self.signature(a) == self.signature(b)).mean()) >= self.threshold
+
+    def _prepare(self, question):
+        text = normalize(question)
+        if not text:
+            return None, None, None
+        sig = self.signature(text)
+        return text, sig, self._band_keys(sig)
+
+    def get(self, key):
+        namespace, question = key
+        if self.max_entries == 0:
+            return None
+        text, sig, band_keys = self._prepare(question)
+        now = time.time()
+        with self._lock:
+            if text is None:
+                self._count("unsignable")
+                return None
+            ns = self._namespaces.get(namespace)
+            slot = self._exact.get((ns, text)) if ns is not None else None
+            exact = slot is not None
+            if slot is None and ns is not None and len(text.split()) >= self.min_words:
+                slot = self._nearest(ns, _guard_key(text), sig, band_keys, now)
+            if slot is None or self._expires[slot] < now:
+                self._count("misses")
+                return None
+            self._referenced[slot] = True
+            self._count("hits" if exact else "near_hits")
+            return self._answers[slot]
+
+    def _nearest(self, ns, guard, sig, band_keys, now):
+        # Called with the lock held.
+        candidates = set()
+        for bucket, band_key in zip(self._buckets, band_keys):
+            candidates.update(bucket.get(band_key, ())[-self.bucket_scan:])
+        if not candidates:
+            return None
+        idx = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        idx = idx[(self._ns[idx] == ns) & (self._guards[idx] == np.uint64(guard)) & (self._expires[idx] >= now)]
+        if not len(idx):
+            return None
+        scores = (self._sigs[idx] == sig).mean(axis=1)
+        best = int(scores.argmax())
+        return int(idx[best]) if scores[best] >= self.threshold else None
+
+    def set(self, key, value):
+        namespace, question = key
+        if self.max_entries == 0:
+            return
+        text, sig, band_keys = self._prepare(question)
+        if text is None:
+            return
+        now = time.time()
+        with self._lock:
+            ns = self._namespaces.setdefault(namespace, len(self._namespaces))
+            slot = self._exact.get((ns, text))
+            if slot is None:
+                slot = self._free_slot(now)
+                self._sigs[slot] = sig
+                self._ns[slot] = ns
+                self._guards[slot] = _guard_key(text)
+                self._texts[slot] = text
+                self._exact[(ns, text)] = slot
+                for bucket, band_key in zip(self._buckets, band_keys):
+                    bucket.setdefault(band_key, []).append(slot)
+                self._size += 1
+            else:
+                self._answer_bytes -= len(self._answers[slot])
+            self._answers[slot] = value
+            self._answer_bytes += len(value)
+            self._expires[slot] = now + self.ttl
+            self._referenced[slot] = True
+            self._count("stores")
+
+    def _free_slot(self, now):
+        # Called with the lock held. CLOCK: sweep, clearing reference bits,
+        # until an empty, expired or unreferenced slot turns up.
+        while True:
+            slot = self._hand
+            self._hand = (self._hand + 1) % self.max_entries
+            if self._ns[slot] < 0:
+                return slot
+            if self._expires[slot] < now or not self._referenced[slot]:
+                self._remove(slot)
+                self._count("evictions")
+                return slot
+            self._referenced[slot] = False
+
+    def _remove(self, slot):
+        # Called with the lock held.
+        for bucket, band_key in zip(self._buckets, self._band_keys(self._sigs[slot])):
+            slots = bucket[band_key]
+            slots.remove(slot)
+            if not slots:
+                del bucket[band_key]
+        del self._exact[(int(self._ns[slot]), self._texts[slot])]
+        self._answer_bytes -= len(self._answers[slot])
+        self._ns[slot] = -1
+        self._texts[slot] = None
+        self._answers[slot] = None
+        self._size -= 1
+
+    def note_bypass(self):
+        with self._lock:
+            self._count("bypasses")
+
+    def __len__(self):
+        return self._size
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(entries=self._size, max_entries=self.max_entries, threshold=self.threshold,
+                         min_words=self.min_words,
+                         index_bytes=self._sigs.nbytes + self._ns.nbytes + self._expires.nbytes
+                         + self._guards.nbytes,
+                         answer_bytes=self._answer_bytes)
+        hits = stats["hits"] + stats["near_hits"]
+        lookups = hits + stats["misses"] + stats["unsignable"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,260 @@
+"""
+Routing of chat-completions calls across compatible backends.
+
+Backends come from UPSTREAM_BACKENDS, a JSON document (or "@path/to/file.json"):
+
+    {
+      "backends": [
+        {"name": "openai", "base_url": "https://api.openai.com/v1"},
+        {"name": "openai-b", "base_url": "https://api.openai.com/v1", "api_key_env": "OPENAI_API_KEY_B"},
+        {"name": "local", "base_url": "http://10.0.0.5:8000/v1", "api_key": "none", "cheap": true,
+         "vision": false, "models": {"gpt-4.1-nano": "qwen2.5-7b-instruct"}}
+      ],
+      "tool_models": {"bmi-analysis": "gpt-4.1-nano", "lab-blood": "gpt-4.1-nano", "chest-xray": "gpt-4.1"},
+      "cheap_tools": ["bmi-analysis", "lab-blood"]
+    }
+
+A backend authenticates with its "api_key", else the variable named by
+"api_key_env", else OPENAI_API_KEY. A missing api_key_env variable is a
+startup error rather than a silent fallback to OPENAI_API_KEY, which would
+send one provider's key to another. Without UPSTREAM_BACKENDS there is one
+backend, OPENAI_API_BASE with OPENAI_API_KEY, as before. TOOL_MODELS="tool=model,..." and CHEAP_TOOLS="tool,..." override
+the document's tool settings.
+
+Each call picks a model for its tool, then tries backends in order:
+- cheap backends (e.g. self-hosted) first for cheap tools; they serve nothing else
+- the rest ranked by EWMA latency x error rate x in-flight calls / weight,
+  with two random choices for the first pick so load spreads instead of
+  herding onto one backend
+A backend whose error EWMA passes 0.5 is skipped for EJECT_SECONDS, then
+retried. Connection failures, 429 and 5xx fail over to the next backend;
+read timeouts do not (they already used up the time budget).
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+
+import upstream
+
+
+class Backend:
+    """One OpenAI-compatible endpoint and its observed health."""
+
+    def __init__(self, name, base_url, api_key=None, weight=1.0, cheap=False, vision=True, models=None):
+        self.name = name
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.api_key = api_key
+        self.weight = max(0.01, float(weight))
+        self.cheap = bool(cheap)
+        self.vision = bool(vision)
+        self.models = dict(models or {})
+        self.latency_ewma = None
+        self.error_ewma = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def model(self, model):
+        """The name this backend serves `model` under."""
+        return self.models.get(model, model)
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "cheap": self.cheap,
+            "vision": self.vision,
+            "weight": self.weight,
+            "latency_ewma_ms": None if self.latency_ewma is None else round(self.latency_ewma * 1000, 1),
+            "error_ewma": round(self.error_ewma, 4),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejected_for": round(max(0.0, self.ejected_until - time.monotonic()), 1),
+        }
+
+
+class Router:
+    ALPHA = 0.2
+    EJECT_ERROR_RATE = 0.5
+    EJECT_SECONDS = 10.0
+
+    def __init__(self, backends, default_model, tool_models=None, cheap_tools=(), max_attempts=3):
+        if not backends:
+            raise ValueError("at least one backend is required")
+        self.backends = list(backends)
+        self.default_model = default_model
+        self.tool_models = dict(tool_models or {})
+        self.cheap_tools = set(cheap_tools)
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+
+    @property
+    def needs_default_key(self):
+        """Whether some backend authenticates with OPENAI_API_KEY (its api_key is None)."""
+        return any(b.api_key is None for b in self.backends)
+
+    def model_for(self, tool):
+        return self.tool_models.get(tool, self.default_model)
+
+    def _score(self, backend, fallback_latency):
+        latency = backend.latency_ewma if backend.latency_ewma is not None else fallback_latency
+        return latency * (1 + 4 * backend.error_ewma) * (1 + backend.in_flight) / backend.weight
+
+    def _rank(self, backends):
+        if len(backends) < 2:
+            return list(backends)
+        known = [b.latency_ewma for b in backends if b.latency_ewma is not None]
+        # Unseen backends score like the best known one, so they get tried.
+        fallback = min(known) if known else 1.0
+        a, b = random.sample(backends, 2)
+        first = min((a, b), key=lambda x: self._score(x, fallback))
+        rest = sorted((x for x in backends if x is not first), key=lambda x: self._score(x, fallback))
+        return [first] + rest
+
+    def candidates(self, tool, kind):
+        """Backends to try for one call, best first; ejected ones only as a last resort."""
+        eligible = [b for b in self.backends if kind != "vision" or b.vision] or list(self.backends)
+        if tool in self.cheap_tools:
+            tiers = [[b for b in eligible if b.cheap], [b for b in eligible if not b.cheap]]
+        else:
+            tiers = [[b for b in eligible if not b.cheap]]
+        if not any(tiers):
+            tiers = [eligible]
+        now = time.monotonic()
+        with self._lock:
+            ordered, ejected = [], []
+            for tier in tiers:
+                ordered += self._rank([b for b in tier if b.ejected_until <= now])
+                ejected += [b for b in tier if b.ejected_until > now]
+            ordered += sorted(ejected, key=lambda b: b.ejected_until)
+        return ordered[:self.max_attempts]
+
+    def _begin(self, backend):
+        with self._lock:
+            backend.in_flight += 1
+            backend.requests += 1
+
+    def _finish(self, backend, ok, seconds):
+        with self._lock:
+            backend.in_flight -= 1
+            if ok:
+                if backend.latency_ewma is None:
+                    backend.latency_ewma = seconds
+                else:
+                    backend.latency_ewma += self.ALPHA * (seconds - backend.latency_ewma)
+            else:
+                backend.failures += 1
+            backend.error_ewma += self.ALPHA * ((0.0 if ok else 1.0) - backend.error_ewma)
+            if backend.error_ewma > self.EJECT_ERROR_RATE:
+                backend.ejected_until = time.monotonic() + self.EJECT_SECONDS
+                # Come back half-trusted, so one more failure ejects it again.
+                backend.error_ewma = self.EJECT_ERROR_RATE / 2 + self.ALPHA
+
+    def post(self, make_body, model, tool, kind, headers_for, read_timeout, stream=False,
+             on_attempt=None, on_result=None):
+        """
+        Send one call, failing over between backends. make_body(model name)
+        builds the request body for a backend, headers_for(backend) its
+        headers. on_result(backend, status or "error", seconds), if given,
+        sees every attempt. Returns (response, backend); raises the last
+        requests.RequestException if no backend could be reached.
+        """
+        candidates = self.candidates(tool, kind)
+        for i, backend in enumerate(candidates):
+            last = i == len(candidates) - 1
+            body = make_body(backend.model(model))
+            self._begin(backend)
+            start = time.perf_counter()
+            try:
+                resp = upstream.post_chat_completion(
+                    body, headers_for(backend), read_timeout, stream=stream, on_attempt=on_attempt,
+                    url=backend.url,
+                    # Retry in place only on the last backend; before that, failing over is the retry.
+                    max_retries=None if last else 0,
+                )
+            except requests.RequestException as e:
+                elapsed = time.perf_counter() - start
+                self._finish(backend, False, elapsed)
+                if on_result is not None:
+                    on_result(backend, "error", elapsed)
+                if last or not isinstance(e, requests.ConnectionError):
+                    raise
+                continue
+            elapsed = time.perf_counter() - start
+            ok = resp.status_code < 500 and resp.status_code != 429
+            self._finish(backend, ok, elapsed)
+            if on_result is not None:
+                on_result(backend, resp.status_code, elapsed)
+            if ok or last:
+                return resp, backend
+            resp.close()
+
+    def stats(self):
+        with self._lock:
+            backends = {b.name: b.stats() for b in self.backends}
+        return {
+            "default_model": self.default_model,
+            "tool_models": self.tool_models,
+            "cheap_tools": sorted(self.cheap_tools),
+            "backends": backends,
+        }
+
+
+def _parse_pairs(text):
+    """"a=b, c=d" -> {"a": "b", "c": "d"}"""
+    pairs = {}
+    for item in text.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+def from_env(default_model, default_base_url):
+    """
+    Router configured from UPSTREAM_BACKENDS / TOOL_MODELS / CHEAP_TOOLS (see
+    module docstring). Raises ValueError if a backend's api_key_env is unset.
+    """
+    raw = os.environ.get("UPSTREAM_BACKENDS", "").strip()
+    if raw.startswith("@"):
+        with open(raw[1:]) as f:
+            raw = f.read()
+    config = json.loads(raw) if raw else {}
+
+    backends = []
+    for i, spec in enumerate(config.get("backends") or [{"name": "default", "base_url": default_base_url}]):
+        name = spec.get("name") or f"backend-{i}"
+        api_key = spec.get("api_key")
+        key_env = spec.get("api_key_env")
+        if api_key is None and key_env and key_env != "OPENAI_API_KEY":
+            api_key = os.environ.get(key_env)
+            if not api_key:
+                raise ValueError(f"backend {name!r}: {key_env} is not set")
+        backends.append(Backend(
+            name,
+            spec.get("base_url") or default_base_url,
+            api_key=api_key,
+            weight=spec.get("weight", 1.0),
+            cheap=spec.get("cheap", False),
+            vision=spec.get("vision", True),
+            models=spec.get("models"),
+        ))
+
+    tool_models = dict(config.get("tool_models") or {})
+    tool_models.update(_parse_pairs(os.environ.get("TOOL_MODELS", "")))
+    cheap_tools = config.get("cheap_tools") or []
+    if os.environ.get("CHEAP_TOOLS"):
+        cheap_tools = [t.strip() for t in os.environ["CHEAP_TOOLS"].split(",") if t.strip()]
+
+    return Router(
+        backends,
+        config.get("default_model") or default_model,
+        tool_models=tool_models,
+        cheap_tools=cheap_tools,
+        max_attempts=int(os.environ.get("ROUTER_MAX_ATTEMPTS", config.get("max_attempts", 3))),
+    )
@@ -0,0 +1,307 @@
+"""
+Server-side doctor-chat conversations with a token-budgeted context.
+
+A session keeps the last `keep_turns` question/answer pairs verbatim and
+folds older ones into a rolling extractive summary: one line per turn,
+holding the question and the answer sentence that overlaps it most. The
+oldest lines are dropped once the summary passes its token budget, so a
+session's size stays bounded however long the conversation runs.
+
+build_messages() assembles the prompt as: system prompt, summary, as many
+recent turns as fit in the context budget (newest first; the rest are
+summarized on the fly), then the new question. Prompt size stays flat as
+the conversation grows. Each session also counts the history tokens it
+sent against what resending the whole conversation would have cost.
+
+Sessions are stored as compact JSON in a SessionStore:
+- by default in a SQLite file (cache.SqliteStore) that all gunicorn workers
+  share, since a follow-up may land on any worker
+- otherwise, or when that file cannot be opened, in a per-process memory LRU
+Both are capped by session count and total bytes, and drop sessions idle
+for `idle_ttl`. Two requests racing on one session keep the later write.
+
+Token counts are estimates (about 4 characters per token), which is
+enough for budgeting without a tokenizer dependency.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import secrets
+import time
+from collections import OrderedDict
+
+import cache
+from question_cache import normalize
+
+log = logging.getLogger(__name__)
+
+SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# Greeting / disclaimer sentences say nothing about the topic.
+_BOILERPLATE = re.compile(
+    r"doctor cal|virtual (ai )?doctor|\bai\b|not a (real|human)|see a (real|licensed)|general information",
+    re.IGNORECASE,
+)
+
+
+def estimate_tokens(text):
+    """Rough token count of English text (about 4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def _clip(text, max_chars):
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars - 3].rstrip() + "..."
+
+
+def summarize_turn(question, answer, max_chars=240):
+    """One summary line: the question and the answer sentence sharing most words with it."""
+    topic = set(normalize(question).split())
+    sentences = [s for s in _SENTENCE_END.split(answer.strip()) if s]
+    informative = [s for s in sentences if not _BOILERPLATE.search(s)] or sentences
+    best = max(informative, key=lambda s: len(topic & set(normalize(s).split())), default="")
+    return _clip(f"Q: {_clip(question, 120)} A: {best}", max_chars)
+
+
+class Session:
+    def __init__(self, session_id, data=None):
+        data = data or {}
+        self.id = session_id
+        self.summary = list(data.get("summary", []))
+        self.turns = [tuple(t) for t in data.get("turns", [])]
+        self.turn_count = data.get("turn_count", len(self.turns))
+        self.history_tokens = data.get("history_tokens", 0)
+        self.sent_tokens = data.get("sent_tokens", 0)
+        self.full_tokens = data.get("full_tokens", 0)
+        self.created_at = data.get("created_at", time.time())
+
+    @property
+    def has_history(self):
+        return bool(self.turns or self.summary)
+
+    def to_dict(self):
+        return {
+            "summary": self.summary,
+            "turns": [list(t) for t in self.turns],
+            "turn_count": self.turn_count,
+            "history_tokens": self.history_tokens,
+            "sent_tokens": self.sent_tokens,
+            "full_tokens": self.full_tokens,
+            "created_at": self.created_at,
+        }
+
+    def add_turn(self, question, answer, keep_turns, summary_tokens):
+        """Append a finished turn, folding turns beyond keep_turns into the summary."""
+        self.turns.append((question, answer))
+        self.turn_count += 1
+        self.history_tokens += estimate_tokens(question) + estimate_tokens(answer)
+        while len(self.turns) > max(0, keep_turns):
+            self.summary.append(summarize_turn(*self.turns.pop(0)))
+        self.summary = _trim_summary(self.summary, summary_tokens)
+
+    def stats(self):
+        saved = self.full_tokens - self.sent_tokens
+        return {
+            "session_id": self.id,
+            "turns": self.turn_count,
+            "verbatim_turns": len(self.turns),
+            "summary_lines": len(self.summary),
+            "bytes": len(_dumps(self.to_dict())),
+            "age_s": round(time.time() - self.created_at, 1),
+            "history_tokens_sent": self.sent_tokens,
+            "history_tokens_full": self.full_tokens,
+            "saved_tokens": saved,
+            "saved_ratio": round(saved / self.full_tokens, 4) if self.full_tokens else 0.0,
+        }
+
+
+def _trim_summary(lines, max_tokens):
+    """Drop the oldest lines until the summary fits max_tokens."""
+    lines = list(lines)
+    while lines and sum(estimate_tokens(line) for line in lines) > max_tokens:
+        lines.pop(0)
+    return lines
+
+
+def build_messages(session, system_prompt, user_prompt, context_tokens, summary_tokens):
+    """
+    Chat messages for the next turn of `session` with at most about
+    context_tokens of history (summary_tokens of it for the summary).
+    Returns (messages, history tokens sent, history tokens of the full
+    conversation) and adds both to the session's counters.
+    """
+    summary = list(session.summary)
+    recent, overflow = [], []
+    budget = context_tokens - min(summary_tokens, sum(estimate_tokens(line) for line in summary))
+    for question, answer in reversed(session.turns):
+        cost = estimate_tokens(question) + estimate_tokens(answer)
+        if not overflow and cost <= budget:
+            recent.append((question, answer))
+            budget -= cost
+        else:
+            overflow.append((question, answer))
+    summary = _trim_summary(summary + [summarize_turn(q, a) for q, a in reversed(overflow)], summary_tokens)
+
+    messages = [{"role": "system", "content": system_prompt}]
+    sent = 0
+    if summary:
+        text = "Summary of the earlier conversation with this user:\n" + "\n".join(summary)
+        messages.append({"role": "system", "content": text})
+        sent += estimate_tokens(text)
+    for question, answer in reversed(recent):
+        messages.append({"role": "user", "content": question})
+        messages.append({"role": "assistant", "content": answer})
+        sent += estimate_tokens(question) + estimate_tokens(answer)
+    messages.append({"role": "user", "content": user_prompt})
+
+    session.sent_tokens += sent
+    session.full_tokens += session.history_tokens
+    return messages, sent, session.history_tokens
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+class MemoryStore:
+    """
+    Per-process LRU of JSON blobs, capped by entry count and total bytes,
+    dropping entries untouched for `ttl` seconds. Same get/set interface
+    as cache.SqliteStore.
+    """
+
+    def __init__(self, max_entries, ttl, max_bytes=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()   # key -> (touched_at, blob), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _drop(self, key):
+        _, blob = self._data.pop(key)
+        self._bytes -= len(blob)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] + self.ttl < now:
+                self._drop(key)
+                return None
+            self._data[key] = (now, item[1])
+            self._data.move_to_end(key)
+            return json.loads(item[1])
+
+    def set(self, key, value):
+        now = time.time()
+        blob = _dumps(value)
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (now, blob)
+            self._bytes += len(blob)
+            # Oldest first, so idle entries sit at the front.
+            while self._data:
+                oldest, (touched_at, _) = next(iter(self._data.items()))
+                over = len(self._data) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes)
+                if not over and touched_at + self.ttl >= now:
+                    break
+                self._drop(oldest)
+                self.evictions += 1
+
+    def total_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SessionStore:
+    """
+    Load/save Sessions by ID. With `path` they live in a SQLite file shared
+    by all worker processes, else (or if the file cannot be opened) in
+    memory. on_event(name), if given, is called with each counter name as
+    it is bumped.
+    """
+
+    def __init__(self, path=None, max_sessions=10000, max_bytes=64 * 1024 * 1024, idle_ttl=3600,
+                 on_event=None):
+        self.backend = None
+        if path:
+            try:
+                self.backend = cache.SqliteStore(path, max_sessions, idle_ttl, max_bytes=max_bytes)
+            except (sqlite3.Error, OSError) as e:
+                log.warning("session store %s unavailable, keeping sessions in memory: %s", path, e)
+        if self.backend is None:
+            self.backend = MemoryStore(max_sessions, idle_ttl, max_bytes=max_bytes)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.on_event = on_event
+        self._lock = threading.Lock()
+        self.counters = {"started": 0, "resumed": 0, "saved": 0, "store_errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+        if self.on_event is not None:
+            self.on_event(name)
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(24)
+
+    def create(self):
+        """A new, saved session under a fresh unguessable ID. Clients cannot pick IDs."""
+        session = Session(self.new_id())
+        self._count("started")
+        self.save(session)
+        return session
+
+    def load(self, session_id):
+        """The stored session, or None if this ID was never issued or has expired."""
+        try:
+            data = self.backend.get(session_id)
+        except sqlite3.Error:
+            self._count("store_errors")
+            return None
+        if data is None:
+            return None
+        self._count("resumed")
+        return Session(session_id, data)
+
+    def peek(self, session_id):
+        """The stored session or None, without counting it as a use."""
+        try:
+            data = self.backend.get(session_id)
+        except sqlite3.Error:
+            return None
+        return Session(session_id, data) if data is not None else None
+
+    def save(self, session):
+        try:
+            self.backend.set(session.id, session.to_dict())
+        except sqlite3.Error:
+            self._count("store_errors")
+            return
+        self._count("saved")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        try:
+            stats["sessions"] = len(self.backend)
+            stats["bytes"] = self.backend.total_bytes()
+        except sqlite3.Error:
+            stats["sessions"] = stats["bytes"] = None
+        stats.update(max_sessions=self.max_sessions, max_bytes=self.max_bytes,
+                     shared=isinstance(self.backend, cache.SqliteStore), pid=os.getpid())
+        if isinstance(self.backend, MemoryStore):
+            stats["evictions"] = self.backend.evictions
+        return stats
@@ -0,0 +1,167 @@
+"""
+Single-flight coalescing of identical upstream calls.
+
+When many requests with the same effective payload arrive together (a
+whole class opening the same demo), only the first one calls upstream;
+the others wait for it and share its result. Inside a worker this uses an
+in-memory table of in-flight calls. With a lock directory configured,
+workers on the same host also coalesce through per-key file locks and a
+short-lived result file.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def payload_key(*parts):
+    """Stable key for the JSON-serializable parts of an upstream call."""
+    blob = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    do(key, fn) runs fn() once per key at a time and hands its result to every
+    caller that arrived while it was running. fn must return something
+    JSON-serializable when a lock directory is used. on_event(name), if given,
+    is called with "leaders", "coalesced_local" or "coalesced_remote".
+    """
+
+    SWEEP_EVERY = 256
+    STALE_AFTER = 600
+
+    def __init__(self, lock_dir=None, wait_timeout=90, poll_interval=0.05, on_event=None):
+        self.lock_dir = lock_dir
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._writes = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = {"leaders": 0, "coalesced_local": 0, "coalesced_remote": 0}
+        self.on_event = on_event
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+        if self.on_event is not None:
+            self.on_event(name)
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._count("coalesced_local")
+            if not call.done.wait(self.wait_timeout):
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_across_workers(key, fn) if self.lock_dir else self._lead(fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _lead(self, fn):
+        self._count("leaders")
+        return fn()
+
+    def _run_across_workers(self, key, fn):
+        lock_path = os.path.join(self.lock_dir, key + ".lock")
+        result_path = os.path.join(self.lock_dir, key + ".json")
+        started = time.time()
+        with open(lock_path, "a+") as lock_file:
+            waited = False
+            deadline = started + self.wait_timeout
+            # Poll instead of a blocking flock so gevent workers keep serving.
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    waited = True
+                    if time.time() >= deadline:
+                        return self._lead(fn)
+                    time.sleep(self.poll_interval)
+            try:
+                if waited:
+                    shared = self._read_result(result_path, started)
+                    if shared is not None:
+                        self._count("coalesced_remote")
+                        return shared[0]
+                result = self._lead(fn)
+                self._write_result(result_path, result)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_result(path, not_before):
+        """Result written by another worker after we started waiting, else None."""
+        try:
+            if os.path.getmtime(path) < not_before:
+                return None
+            with open(path) as f:
+                return (json.load(f),)
+        except (OSError, ValueError):
+            return None
+
+    def _write_result(self, path, result):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(result, f)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            self._sweep()
+
+    def _sweep(self):
+        """Remove lock/result files of keys nobody has used for a while."""
+        cutoff = time.time() - self.STALE_AFTER
+        try:
+            entries = list(os.scandir(self.lock_dir))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters["in_flight"] = len(self._calls)
+        counters["pid"] = os.getpid()
+        return counters
@@ -0,0 +1,38 @@
+"""
+Per-user state directory for the backend's local files (caches, sessions,
+lock files, metrics, profiles).
+
+Fixed names in the shared temp dir would let any local user pre-create the
+files: plant cached answers, read chat histories or delete metrics. So
+everything lives under AILAB_STATE_DIR (default <tmp>/ailab-<uid>), created
+with mode 0700 and refused if someone else owns it or can write to it.
+"""
+import logging
+import os
+import tempfile
+
+log = logging.getLogger(__name__)
+
+
+def base_dir():
+    return os.environ.get("AILAB_STATE_DIR") or os.path.join(tempfile.gettempdir(), f"ailab-{os.getuid()}")
+
+
+def private_dir(name):
+    """
+    <state dir>/<name>, created for this user only (mode 0700). None, logged,
+    if it cannot be created or someone else owns or can write to it.
+    """
+    base = base_dir()
+    path = os.path.join(base, name)
+    try:
+        for directory in (base, path):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            st = os.lstat(directory)
+            if not os.path.isdir(directory) or os.path.islink(directory) or st.st_uid != os.getuid() \
+                    or st.st_mode & 0o077:
+                raise PermissionError(f"{directory} must be a directory owned by uid {os.getuid()} with mode 0700")
+    except OSError as e:
+        log.warning("state directory unavailable, falling back: %s", e)
+        return None
+    return path
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bench"))
+
+# Tests that import app keep its SQLite files and lock dirs out of the real state directory.
+os.environ.setdefault("AILAB_STATE_DIR", tempfile.mkdtemp(prefix="ailab-tests-"))
+
+from mock_upstream import make_server  # noqa: E402
+
+
+@pytest.fixture
+def mock_upstream():
+    """start(**make_server kwargs) -> chat-completions URL of a mock upstream running in a thread."""
+    servers = []
+
+    def start(**kwargs):
+        server = make_server(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+    yield start
+    for server in servers:
+        server.shutdown()
@@ -0,0 +1,108 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+import requests
+
+from admission import AdmissionPool, HostSemaphore, Rejected
+
+
+def test_queue_full_and_timeout_rejections():
+    pool = AdmissionPool("t", max_in_flight=1, max_queue=1, queue_timeout=0.1)
+    ticket = pool.acquire()
+    waiter_error = []
+
+    def waiter():
+        try:
+            pool.acquire()
+        except Rejected as e:
+            waiter_error.append(e.reason)
+
+    t = threading.Thread(target=waiter)
+    t.start()
+    time.sleep(0.02)
+    with pytest.raises(Rejected) as e:
+        pool.acquire()
+    assert e.value.reason == "queue full"
+    t.join(2)
+    assert waiter_error == ["queue timeout"]
+    pool.release(ticket)
+    assert pool.stats()["in_flight"] == 0
+
+
+def test_worker_limit_halves_on_429_and_grows_back():
+    pool = AdmissionPool("t", max_in_flight=8, max_queue=0, queue_timeout=0, cooldown=0)
+    pool.observe_status(429)
+    assert pool.limit == 4
+    for _ in range(40):
+        pool.observe_status(200)
+    assert pool.limit == 8
+
+
+def _hold_host_slot(lock_dir, results):
+    pool = AdmissionPool("chat", 1, 4, 0.3, host=HostSemaphore(lock_dir, "chat", 2))
+    try:
+        with pool.slot():
+            results.put("admitted")
+            time.sleep(0.8)
+    except Rejected as e:
+        results.put(e.reason)
+
+
+def test_host_cap_holds_across_processes(tmp_path):
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_hold_host_slot, args=(str(tmp_path), results)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(10)
+    outcomes = sorted(results.get(timeout=1) for _ in procs)
+    assert outcomes == ["admitted", "admitted", "host queue timeout", "host queue timeout"]
+
+
+def test_full_host_queue_rejects_at_once(tmp_path):
+    pool = AdmissionPool("chat", 4, 4, queue_timeout=5, host=HostSemaphore(str(tmp_path), "chat", 1, max_queue=0))
+    ticket = pool.acquire()
+    start = time.monotonic()
+    with pytest.raises(Rejected) as e:
+        pool.acquire()
+    assert e.value.reason == "host queue full"
+    assert time.monotonic() - start < 0.5
+    pool.release(ticket)
+
+
+def test_upstream_429_shrinks_the_host_limit_for_every_worker(tmp_path, mock_upstream):
+    throttled = mock_upstream(error_rate=1.0, error_status=429)
+    healthy = mock_upstream()
+    # Two sync workers: one call in flight each, so only the host limit can adapt.
+    workers = [AdmissionPool("chat", 1, 0, 1, cooldown=0, host=HostSemaphore(str(tmp_path), "chat", 8, cooldown=0))
+               for _ in range(2)]
+
+    with workers[0].slot():
+        status = requests.post(throttled, json={"model": "m", "messages": []}).status_code
+    workers[0].observe_status(status)
+    assert status == 429
+    assert workers[1].host.limit == 4
+    assert workers[0].stats()["host_throttled"] == 1
+
+    # Slots at or above the shrunken limit are off limits for new calls.
+    tickets = [workers[1].host.try_acquire() for _ in range(5)]
+    assert sorted(t for t in tickets if t is not None) == [0, 1, 2, 3]
+    for t in tickets:
+        if t is not None:
+            workers[1].host.release(t)
+
+    for _ in range(40):
+        with workers[1].slot():
+            status = requests.post(healthy, json={"model": "m", "messages": []}).status_code
+        workers[1].observe_status(status)
+    assert workers[0].host.limit == 8
+
+
+def test_host_throttle_respects_cooldown(tmp_path):
+    host = HostSemaphore(str(tmp_path), "chat", 8, cooldown=60)
+    assert host.observe_status(429)
+    assert not host.observe_status(429)
+    assert HostSemaphore(str(tmp_path), "chat", 8, cooldown=60).limit == 4
+
@@ -0,0 +1,51 @@
+import json
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def _bmi(weight):
+    return {"tool": "bmi-analysis", "payload": {"weight": weight, "height_cm": 170, "mode": "fast"}}
+
+
+def test_results_in_request_order_with_per_item_errors(client):
+    resp = client.post("/api/batch", json={"items": [
+        _bmi(60), {"tool": "nope", "payload": {}}, {"tool": "bmi-analysis"}, _bmi(80),
+    ]})
+    assert resp.status_code == 200
+    results = resp.get_json()["results"]
+    assert [(r["index"], r["status"]) for r in results] == [(0, 200), (1, 400), (2, 400), (3, 200)]
+    assert results[0]["computed"]["bmi"] == 20.8 and results[3]["computed"]["bmi"] == 27.7
+
+
+@pytest.mark.parametrize("body", [{}, {"items": []}, {"items": {}}, {"items": [_bmi(60)], "deadline_s": "x"}])
+def test_bad_requests(client, body):
+    assert client.post("/api/batch", json=body).status_code == 400
+
+
+def test_too_many_items(client, monkeypatch):
+    monkeypatch.setattr(app, "BATCH_MAX_ITEMS", 2)
+    assert client.post("/api/batch", json={"items": [_bmi(60)] * 3}).status_code == 400
+
+
+def test_stream_and_deadline(client, monkeypatch):
+    real = app.run_text_tool
+
+    def run_text_tool(tool, payload, cache_mode):
+        if payload["weight"] == 99:
+            time.sleep(0.5)
+        return real(tool, payload, cache_mode)
+
+    monkeypatch.setattr(app, "run_text_tool", run_text_tool)
+    resp = client.post("/api/batch?stream=1", json={"items": [_bmi(99), _bmi(60)], "deadline_s": 0.2})
+    assert resp.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    # The fast item arrives first; the slow one is cut off at the deadline.
+    assert [(r["index"], r["status"]) for r in lines] == [(1, 200), (0, 504)]
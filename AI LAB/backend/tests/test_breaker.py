@@ -0,0 +1,72 @@
+import pytest
+
+import breaker
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(breaker.time, "monotonic", clock)
+    return clock
+
+
+def _fail(cb, times=1, ok=False, seconds=0.1):
+    for _ in range(times):
+        cb.record(cb.before_call(), ok, seconds)
+
+
+def test_opens_after_consecutive_failures(clock):
+    cb = CircuitBreaker("t", failure_threshold=3, open_seconds=10)
+    _fail(cb, 2)
+    _fail(cb, 1, ok=True)           # a success resets the streak
+    _fail(cb, 2)
+    assert cb.state == CLOSED
+    _fail(cb, 1)
+    assert cb.state == OPEN
+    with pytest.raises(CircuitOpen) as e:
+        cb.before_call()
+    assert e.value.retry_after == 10
+    assert cb.open_retry_after() == 10
+
+
+def test_half_open_probe_closes_or_reopens(clock):
+    cb = CircuitBreaker("t", failure_threshold=1, open_seconds=10)
+    _fail(cb)
+    clock.now += 10.5
+    assert cb.open_retry_after() is None
+
+    token = cb.before_call()
+    assert token == HALF_OPEN and cb.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        cb.before_call()            # only one probe at a time
+    cb.record(token, False, 0.1)
+    assert cb.state == OPEN
+
+    clock.now += 10.5
+    cb.record(cb.before_call(), True, 0.1)
+    assert cb.state == CLOSED
+    assert cb.stats()["opened"] == 2 and cb.stats()["closed"] == 1
+
+
+def test_slow_success_counts_as_failure(clock):
+    cb = CircuitBreaker("t", failure_threshold=2, slo_seconds=1.0)
+    _fail(cb, 2, ok=True, seconds=2.0)
+    assert cb.state == OPEN
+    assert cb.stats()["slo_breaches"] == 2
+
+
+def test_calls_started_before_opening_do_not_count(clock):
+    cb = CircuitBreaker("t", failure_threshold=1, open_seconds=10)
+    early = cb.before_call()
+    _fail(cb)
+    cb.record(early, True, 0.1)
+    assert cb.state == OPEN
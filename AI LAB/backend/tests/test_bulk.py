@@ -0,0 +1,82 @@
+import json
+import sys
+
+import pytest
+
+import bulk
+from bulk import Checkpoint
+
+
+def _run(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["bulk.py", *argv])
+    bulk.main()
+
+
+def _results(path):
+    with open(path) as f:
+        return sorted((json.loads(line) for line in f), key=lambda r: r["row"])
+
+
+def test_checkpoint_watermark_and_round_trip(tmp_path):
+    ckpt = Checkpoint({"tool": "t"})
+    for row, ok in ((1, True), (0, True), (3, False)):
+        ckpt.mark(row, ok)
+    assert (ckpt.watermark, ckpt.done) == (2, {3})
+    assert ckpt.is_done(0) and ckpt.is_done(3) and not ckpt.is_done(2)
+
+    path = str(tmp_path / "out.ckpt")
+    ckpt.output_bytes = 42
+    ckpt.save(path)
+    loaded = Checkpoint.load(path)
+    assert (loaded.job, loaded.watermark, loaded.done, loaded.output_bytes, loaded.counts) == \
+        ({"tool": "t"}, 2, {3}, 42, {"ok": 2, "failed": 1})
+
+
+def test_iter_rows_csv_and_jsonl(tmp_path):
+    csv_path = tmp_path / "in.csv"
+    csv_path.write_text("id,weight,height_cm\nP1,60,170\nP2,,170\n")
+    assert [p for p, _ in bulk.iter_rows(str(csv_path), "csv")] == [
+        {"id": "P1", "weight": "60", "height_cm": "170"},
+        {"id": "P2", "weight": None, "height_cm": "170"},
+    ]
+
+    jsonl_path = tmp_path / "in.jsonl"
+    jsonl_path.write_text('{"id": "P1"}\n\nnot json\n[1]\n')
+    rows = list(bulk.iter_rows(str(jsonl_path), "jsonl"))
+    assert rows[0] == ({"id": "P1"}, None)
+    assert rows[1][0] is None and rows[1][1].startswith("Invalid JSON")
+    assert rows[2] == (None, "Each JSONL line must be an object.")
+
+
+def test_fast_run_writes_every_row_once_and_resumes(tmp_path, monkeypatch):
+    src = tmp_path / "cohort.csv"
+    src.write_text("id,weight,height_cm\n" + "".join(f"P{i},{50 + i},170\n" for i in range(10)) + "bad,,170\n")
+    out = tmp_path / "bmi.jsonl"
+    argv = ["bmi-analysis", str(src), "-o", str(out), "--mode", "fast", "--concurrency", "3",
+            "--checkpoint-every", "2"]
+    _run(monkeypatch, *argv)
+
+    results = _results(out)
+    assert [r["row"] for r in results] == list(range(11))
+    assert all(r["status"] == 200 for r in results[:10])
+    assert results[0]["id"] == "P0" and results[0]["computed"]["bmi"] == 17.3
+    assert results[10]["status"] == 400
+
+    # Running again without --resume would overwrite finished work.
+    with pytest.raises(SystemExit):
+        _run(monkeypatch, *argv)
+
+    # Simulate a crash after row 4: the output has extra bytes past the checkpoint.
+    with open(out, "rb") as f:
+        lines = f.readlines()
+    ckpt = Checkpoint({"tool": "bmi-analysis", "input": str(src.resolve())})
+    for row in range(5):
+        ckpt.mark(row, True)
+    ordered = sorted(lines, key=lambda line: json.loads(line)["row"])
+    kept = b"".join(ordered[:5])
+    out.write_bytes(kept + ordered[7])
+    ckpt.output_bytes = len(kept)
+    ckpt.save(str(out) + ".ckpt")
+
+    _run(monkeypatch, *argv, "--resume")
+    assert [r["row"] for r in _results(out)] == list(range(11))
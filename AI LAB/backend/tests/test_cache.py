@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+import cache
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1.0, True), (1, True), ("1", True), ("1.0", True), (True, True), ("Yes", True),
+    (0.0, False), (0, False), ("0", False), ("0.0", False), (False, False), ("no", False),
+    (None, None), ("maybe", "maybe"),
+])
+def test_canonical_bool(value, expected):
+    assert cache.canonical_bool(value) == expected
+
+
+def test_float_and_int_flags_share_a_key():
+    assert cache.make_key("cardiac-risk", 2, {"smoker": cache.canonical_bool(1.0)}) == \
+        cache.make_key("cardiac-risk", 2, {"smoker": cache.canonical_bool(1)})
+
+
+def _filled_store(path, rows, **kwargs):
+    store = cache.SqliteStore(str(path), max_entries=rows, ttl=3600, prune_every=10 ** 9, **kwargs)
+    for i in range(rows):
+        store.set(f"k{i}", {"v": "x" * 100})
+    store.prune_every = 1
+    return store
+
+
+def _seconds_per_store(store, n=200):
+    start = time.perf_counter()
+    for i in range(n):
+        store.set(f"new{i}", {"v": "x" * 100})
+    return (time.perf_counter() - start) / n
+
+
+def test_prune_cost_does_not_grow_with_the_table(tmp_path):
+    small = _seconds_per_store(_filled_store(tmp_path / "small.sqlite", 1000, max_bytes=1000 * 200))
+    large = _seconds_per_store(_filled_store(tmp_path / "large.sqlite", 20000, max_bytes=20000 * 200))
+    assert large < 3 * small + 0.001
+
+
+def test_prune_enforces_entry_and_byte_caps(tmp_path):
+    store = cache.SqliteStore(str(tmp_path / "c.sqlite"), max_entries=10, ttl=3600, max_bytes=500, prune_every=1)
+    for i in range(30):
+        store.set(f"k{i}", "x" * 40)       # 42 bytes of JSON each
+    assert len(store) == 10
+    store.set("big", "y" * 200)
+    assert store.total_bytes() <= 500
+    assert store.get("big") == "y" * 200
+    assert store.get("k0") is None
+
+
+def test_totals_follow_overwrites_and_expiry(tmp_path):
+    store = cache.SqliteStore(str(tmp_path / "c.sqlite"), max_entries=100, ttl=3600)
+    store.set("a", "x" * 10)
+    store.set("a", "x" * 100)
+    store.set("b", "x")
+    assert (len(store), store.total_bytes()) == (2, 102 + 3)
+    store.prune(now=time.time() + 7200)
+    assert (len(store), store.total_bytes()) == (0, 0)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+import engine
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1.0, True), (0.0, False), (1, True), (0, False), (2.5, True),
+    ("1.0", True), ("0.0", False), ("yes", True), ("no", False), (True, True),
+    (None, False), (float("nan"), False), ("garbage", False),
+])
+def test_to_bool_array(value, expected):
+    assert engine.to_bool_array([value]).tolist() == [expected]
+
+
+def test_to_bool_array_numeric_arrays():
+    assert engine.to_bool_array(np.array([1.0, 0.0, np.nan, -1.0])).tolist() == [True, False, False, True]
+
+
+def test_float_smoker_counts_as_risk_factor():
+    as_float = engine.cardiac_risk_factors(40, "male", 120, 1.0, 0.0, 4.0)
+    as_int = engine.cardiac_risk_factors(40, "male", 120, 1, 0, 4.0)
+    assert as_float["factors"]["smoking"].tolist() == [True]
+    assert as_float["factors"]["diabetes"].tolist() == [False]
+    assert as_float["count"].tolist() == as_int["count"].tolist() == [1]
+
+
+def test_bmi_and_category():
+    values = engine.bmi([50, 60, 70, 90, 70, None], [170, 170, 170, 170, 0, 170])
+    assert engine.bmi_category(values).tolist() == ["underweight", "normal", "overweight", "obese", "unknown", "unknown"]
+
+
+def test_lab_flags_use_sex_specific_hb_range():
+    flags = engine.lab_flags([13.0, 13.0, 16.0, None], [3.0, 7.0, 12.0, 7.0], [100, 200, 500, "x"],
+                             sex=["male", "female", "female", None])
+    assert flags["hb"].tolist() == ["low", "normal", "high", "unknown"]
+    assert flags["wbc"].tolist() == ["low", "normal", "high", "normal"]
+    assert flags["plt"].tolist() == ["low", "normal", "high", "unknown"]
+
+
+def test_cardiac_risk_band():
+    result = engine.cardiac_risk_factors([30, 60, 60], ["f", "m", "m"], [110, 140, 150],
+                                         ["no", "yes", 1], [False, False, True], [4.0, None, 6.0])
+    assert result["count"].tolist() == [0, 3, 5]
+    assert result["band"].tolist() == ["lower", "higher", "higher"]
@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from hedging import Hedger
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def _warm(hedger, seconds=0.01, calls=32):
+    """Run enough fast calls to set the hedge delay and fill the budget."""
+    for _ in range(calls):
+        hedger.run(lambda: (time.sleep(seconds) or "ok", None), lambda: ("hedge", None))
+
+
+def _slow(answer, seconds, err=None):
+    return lambda: (time.sleep(seconds) or answer, err)
+
+
+def test_no_hedge_before_enough_samples(executor):
+    hedger = Hedger("t", executor, budget_ratio=1.0, min_samples=20)
+    assert hedger.run(_slow("primary", 0.1), _slow("hedge", 0)) == ("primary", None)
+    assert hedger.stats()["hedged"] == 0 and hedger.stats()["delay_ms"] is None
+
+
+def test_slow_primary_is_hedged_and_the_hedge_wins(executor):
+    hedger = Hedger("t", executor, budget_ratio=1.0, burst=5, min_samples=16, min_delay=0.02)
+    _warm(hedger)
+    assert hedger.stats()["delay_ms"] is not None
+
+    assert hedger.run(_slow("primary", 0.5), _slow("hedge", 0)) == ("hedge", None)
+    stats = hedger.stats()
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_budget_limits_hedges(executor):
+    hedger = Hedger("t", executor, budget_ratio=0.05, burst=1, min_samples=16, min_delay=0.02)
+    _warm(hedger)
+    # 32 calls at 0.05 tokens each earned the one-token burst; only the first slow call hedges.
+    for _ in range(3):
+        hedger.run(_slow("primary", 0.15), _slow("hedge", 0))
+    stats = hedger.stats()
+    assert stats["hedged"] == 1 and stats["skipped_budget"] == 2
+
+
+def test_failed_hedge_falls_back_to_primary_and_unstarted_hedge_is_refunded(executor):
+    hedger = Hedger("t", executor, budget_ratio=1.0, burst=5, min_samples=16, min_delay=0.02)
+    _warm(hedger)
+
+    assert hedger.run(_slow("primary", 0.15), _slow(None, 0, err="boom")) == ("primary", None)
+    assert hedger.run(_slow(None, 0.15, err="primary failed"), _slow(None, 0, err="hedge failed")) == \
+        (None, "primary failed")
+
+    tokens = hedger.stats()["tokens"]
+    assert hedger.run(_slow("primary", 0.15), lambda: None) == ("primary", None)
+    stats = hedger.stats()
+    assert stats["skipped_no_slot"] == 1 and stats["hedged"] == 2
+    # The refund covers the hedge; the call itself still earns budget_ratio.
+    assert stats["tokens"] == min(5, tokens + 1.0)
+
+
+def test_on_event_sees_counter_names(executor):
+    events = []
+    lock = threading.Lock()
+
+    def on_event(name, event):
+        with lock:
+            events.append((name, event))
+
+    hedger = Hedger("chat", executor, budget_ratio=1.0, min_samples=16, min_delay=0.02, on_event=on_event)
+    _warm(hedger)
+    hedger.run(_slow("primary", 0.5), _slow("hedge", 0))
+    assert events == [("chat", "hedged"), ("chat", "hedge_wins")]
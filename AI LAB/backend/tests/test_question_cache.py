@@ -0,0 +1,60 @@
+import pytest
+
+from question_cache import QuestionCache, normalize
+
+# (stored question, new question): one negation / population word apart, so
+# the stored answer would be medically wrong for the new question.
+WRONG_ANSWER_PAIRS = [
+    ("can I safely take aspirin daily with alcohol", "can I safely take aspirin daily without alcohol"),
+    ("symptoms of heart attack", "symptoms of heart attack in women"),
+    ("normal resting heart rate for an adult", "normal resting heart rate for a child"),
+    ("ibuprofen for a headache", "ibuprofen for a headache in pregnancy"),
+    ("normal blood sugar level for non diabetics", "normal blood sugar level for diabetics"),
+    ("can adults take adult cough syrup safely", "can children take adult cough syrup safely"),
+    ("What is high blood pressure?", "What is low blood pressure?"),
+]
+
+PARAPHRASE_PAIRS = [
+    ("What is high blood pressure?", "what does high BP mean"),
+    ("What are the symptoms of diabetes?", "signs of diabetes?"),
+    ("Is aspirin safe for kids?", "is aspirin safe for children"),
+]
+
+
+@pytest.fixture
+def cache():
+    return QuestionCache(max_entries=100)
+
+
+@pytest.mark.parametrize("stored, asked", WRONG_ANSWER_PAIRS)
+def test_no_hit_across_negation_or_population(cache, stored, asked):
+    cache.set(("ns", stored), "stored answer")
+    assert cache.get(("ns", asked)) is None
+    assert not cache.matches(stored, asked)
+
+
+@pytest.mark.parametrize("stored, asked", PARAPHRASE_PAIRS)
+def test_paraphrase_hits(cache, stored, asked):
+    cache.set(("ns", stored), "stored answer")
+    assert cache.get(("ns", asked)) == "stored answer"
+
+
+def test_near_match_needs_threshold_and_min_words():
+    cache = QuestionCache(max_entries=100, threshold=0.5, min_words=4)
+    stored = "early warning symptoms of heart attack at night"
+    cache.set(("ns", stored), "stored answer")
+    assert cache.get(("ns", "early warning symptoms of heart attack during sleep")) == "stored answer"
+    assert cache.counters["near_hits"] == 1
+    # Three words: exact word-set match only.
+    cache.set(("ns", "heart attack warning"), "short answer")
+    assert cache.get(("ns", "heart attack danger")) is None
+
+
+def test_guard_words_are_not_filler():
+    assert normalize("aspirin with alcohol") != normalize("aspirin without alcohol")
+    assert "in" in normalize("headache in pregnancy").split()
+
+
+def test_namespaces_do_not_mix(cache):
+    cache.set(("v1", "What is high blood pressure?"), "answer")
+    assert cache.get(("v2", "What is high blood pressure?")) is None
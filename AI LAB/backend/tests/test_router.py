@@ -0,0 +1,90 @@
+import json
+import time
+
+import pytest
+import requests
+
+import router
+import upstream
+from router import Backend, Router
+
+
+def _base_url(url):
+    return url.rsplit("/chat/completions", 1)[0]
+
+
+def _post(r, tool="bmi-analysis", kind="chat"):
+    resp, backend = r.post(
+        lambda model: {"model": model, "messages": []}, r.model_for(tool), tool, kind,
+        lambda backend: {"Authorization": f"Bearer {backend.api_key}"}, read_timeout=5,
+    )
+    return resp, backend
+
+
+@pytest.fixture(autouse=True)
+def no_retries(monkeypatch):
+    # Only failover between backends, no backoff sleeps on the last one.
+    monkeypatch.setattr(upstream, "MAX_RETRIES", 0)
+
+
+def test_fails_over_then_ejects_the_failing_backend(mock_upstream):
+    broken = Backend("broken", _base_url(mock_upstream(error_rate=1.0, error_status=503)), cheap=True)
+    healthy = Backend("healthy", _base_url(mock_upstream()))
+    r = Router([broken, healthy], "m", cheap_tools=["bmi-analysis"])
+    r.EJECT_SECONDS = 0.3
+
+    # The cheap tier is tried first, so every call hits `broken` until it is ejected.
+    for _ in range(4):
+        resp, backend = _post(r)
+        assert resp.status_code == 200 and backend is healthy
+    assert broken.requests == 4 and broken.failures == 4
+    assert r.stats()["backends"]["broken"]["ejected_for"] > 0
+    assert r.candidates("bmi-analysis", "chat") == [healthy, broken]
+
+    resp, backend = _post(r)
+    assert backend is healthy and broken.requests == 4
+
+    time.sleep(0.35)
+    assert r.candidates("bmi-analysis", "chat")[0] is broken
+
+
+def test_unreachable_last_backend_raises():
+    # Nothing listens on port 9: the connection error of the only backend propagates.
+    r = Router([Backend("down", "http://127.0.0.1:9/v1")], "m")
+    with pytest.raises(requests.ConnectionError):
+        _post(r)
+
+
+def test_cheap_tier_serves_only_cheap_tools(mock_upstream):
+    local = Backend("local", _base_url(mock_upstream()), cheap=True, vision=False,
+                    models={"small": "local-small"})
+    hosted = Backend("hosted", _base_url(mock_upstream()))
+    r = Router([local, hosted], "big", tool_models={"bmi-analysis": "small"}, cheap_tools=["bmi-analysis"])
+
+    resp, backend = _post(r, "bmi-analysis")
+    assert backend is local and resp.json()["model"] == "local-small"
+
+    for tool, kind in (("doctor-chat", "chat"), ("chest-xray", "vision")):
+        resp, backend = _post(r, tool, kind)
+        assert backend is hosted and resp.json()["model"] == "big"
+    assert local.requests == 1
+
+    # A cheap tool falls back to the hosted tier for kinds the cheap backend cannot serve.
+    assert r.candidates("bmi-analysis", "vision") == [hosted]
+
+
+def test_missing_api_key_env_fails_at_startup(monkeypatch):
+    monkeypatch.setenv("UPSTREAM_BACKENDS", json.dumps({"backends": [
+        {"name": "a", "base_url": "http://a/v1"},
+        {"name": "b", "base_url": "http://b/v1", "api_key_env": "TEST_KEY_B"},
+    ]}))
+    monkeypatch.setenv("OPENAI_API_KEY", "key-a")
+    monkeypatch.delenv("TEST_KEY_B", raising=False)
+    with pytest.raises(ValueError, match="TEST_KEY_B"):
+        router.from_env("m", "http://default/v1")
+
+    monkeypatch.setenv("TEST_KEY_B", "key-b")
+    r = router.from_env("m", "http://default/v1")
+    a, b = r.backends
+    # `a` is the one meant to use OPENAI_API_KEY; `b` never does.
+    assert a.api_key is None and b.api_key == "key-b"
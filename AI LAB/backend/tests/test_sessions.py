@@ -0,0 +1,32 @@
+import sessions
+
+
+def test_unknown_ids_are_not_resumed():
+    store = sessions.SessionStore(path=None)
+    session = store.create()
+    assert store.load(session.id).id == session.id
+    assert store.load("client-chosen-id") is None
+    assert store.stats()["started"] == 1
+
+
+def test_prompt_history_stays_within_budget():
+    session = sessions.Session("s")
+    answer = "Blood pressure is the force of blood on artery walls. " * 10
+    sizes = []
+    for i in range(20):
+        messages, sent, full = sessions.build_messages(session, "system", f"question {i}", 300, 80)
+        session.add_turn(f"What about blood pressure, part {i}?", answer, keep_turns=3, summary_tokens=80)
+        sizes.append(sent)
+    # "About" the budget: the summary header comes on top.
+    assert max(sizes) < 1.2 * 300
+    assert session.full_tokens > 3 * session.sent_tokens
+    assert len(session.turns) == 3
+
+
+def test_sqlite_store_shares_sessions(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    first, second = sessions.SessionStore(path=path), sessions.SessionStore(path=path)
+    session = first.create()
+    session.add_turn("q", "a", keep_turns=2, summary_tokens=50)
+    first.save(session)
+    assert second.load(session.id).turns == [("q", "a")]
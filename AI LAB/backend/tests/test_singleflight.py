@@ -0,0 +1,96 @@
+import threading
+import time
+
+from singleflight import SingleFlight
+
+
+def _run_concurrently(flights, n, fn):
+    results, threads = [None] * n, []
+    for i in range(n):
+        def call(i=i):
+            results[i] = flights[i % len(flights)].do("key", fn)
+        threads.append(threading.Thread(target=call))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    return results
+
+
+def test_concurrent_identical_calls_share_one_run():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"answer": 42}
+
+    flight = SingleFlight()
+    assert _run_concurrently([flight], 8, fn) == [{"answer": 42}] * 8
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert (stats["leaders"], stats["coalesced_local"], stats["in_flight"]) == (1, 7, 0)
+
+
+def test_error_reaches_every_waiter():
+    flight, started = SingleFlight(), threading.Event()
+    errors = []
+
+    def fn():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("upstream down")
+
+    def call():
+        try:
+            flight.do("key", fn)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 2
+
+
+def test_sequential_calls_run_again():
+    flight, calls = SingleFlight(), []
+    for _ in range(3):
+        flight.do("key", lambda: calls.append(1) or len(calls))
+    assert len(calls) == 3
+
+
+def test_lock_dir_coalesces_across_instances(tmp_path):
+    # Separate instances stand in for separate gunicorn workers.
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.3)
+        return ["shared"]
+
+    flights = [SingleFlight(lock_dir=str(tmp_path), poll_interval=0.01) for _ in range(3)]
+    assert _run_concurrently(flights, 3, fn) == [["shared"]] * 3
+    assert len(calls) == 1
+    assert sum(f.stats()["coalesced_remote"] for f in flights) == 2
+
+
+def test_different_keys_do_not_coalesce():
+    flight, calls = SingleFlight(), []
+    barrier = threading.Barrier(2)
+
+    def fn():
+        calls.append(1)
+        barrier.wait(5)
+        return "ok"
+
+    threads = [threading.Thread(target=flight.do, args=(key, fn)) for key in ("a", "b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert len(calls) == 2
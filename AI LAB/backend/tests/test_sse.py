@@ -0,0 +1,70 @@
+import json
+import uuid
+
+import pytest
+
+import app
+import upstream
+from router import Backend, Router
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.fixture
+def upstream_at(monkeypatch, mock_upstream):
+    """Point the app's router at a fresh mock upstream started with these options."""
+    monkeypatch.setattr(upstream, "MAX_RETRIES", 0)
+    monkeypatch.setattr(app, "OPENAI_API_KEY", "test")
+
+    def start(**kwargs):
+        url = mock_upstream(**kwargs).rsplit("/chat/completions", 1)[0]
+        monkeypatch.setattr(app, "model_router", Router([Backend("mock", url)], "gpt-test"))
+    return start
+
+
+def _events(resp):
+    events = []
+    for block in resp.get_data(as_text=True).strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def _question():
+    # Unique per test run, so neither the question cache nor earlier runs answer it.
+    return f"What does a resting heart rate of {uuid.uuid4().hex} mean for adults?"
+
+
+def test_streams_deltas_then_done_and_frees_the_slot(client, upstream_at):
+    upstream_at(completion_tokens=5)
+    resp = client.post("/api/doctor-chat", json={"question": _question(), "stream": True})
+    assert resp.status_code == 200 and resp.mimetype == "text/event-stream"
+    events = _events(resp)
+
+    assert [e for e, _ in events] == ["delta"] * 5 + ["done"]
+    text = "".join(data["text"] for _, data in events[:-1])
+    assert events[-1][1]["answer"] == text == "Hi, I'm Doctor Cal (mock). "
+    assert app.chat_admission.stats()["in_flight"] == 0
+
+
+def test_streamed_answer_is_cached_and_replayed(client, upstream_at):
+    upstream_at()
+    body = {"question": _question(), "stream": True}
+    first = client.post("/api/doctor-chat", json=body)
+    answer = _events(first)[-1][1]["answer"]
+    assert first.headers["X-Cache"] == "MISS"
+
+    second = client.post("/api/doctor-chat", json=body, headers={"Accept": "text/event-stream"})
+    assert second.headers["X-Cache"] == "HIT"
+    assert _events(second) == [("delta", {"text": answer}), ("done", {"answer": answer})]
+
+
+def test_upstream_error_before_the_stream_is_a_json_502(client, upstream_at):
+    upstream_at(error_rate=1.0, error_status=500)
+    resp = client.post("/api/doctor-chat", json={"question": _question(), "stream": True},
+                       headers={"X-Cache-Mode": "bypass"})
+    assert resp.status_code == 502 and "status 500" in resp.get_json()["error"]
+    assert app.chat_admission.stats()["in_flight"] == 0
@@ -0,0 +1,44 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("route, body", [
+    ("/api/bmi-analysis", {"weight": [], "height_cm": 170}),
+    ("/api/bmi-analysis", {"weight": [70, 80], "height_cm": [170]}),
+    ("/api/bmi-analysis", {"weight": {"kg": 70}, "height_cm": 170}),
+    ("/api/cardiac-risk", {"age": [50, 60], "sbp": [120]}),
+    ("/api/cardiac-risk", {"age": 50, "sbp": 120, "smoker": []}),
+    ("/api/lab-blood", {"hb": [], "wbc": 7, "plt": 200}),
+    ("/api/lab-blood", {"hb": [13, 14], "wbc": [7], "plt": 200}),
+])
+@pytest.mark.parametrize("mode", [None, "fast"])
+def test_list_and_empty_inputs_are_rejected(client, route, body, mode):
+    resp = client.post(route, json={**body, "mode": mode})
+    assert resp.status_code == 400
+    assert "single values" in resp.get_json()["error"]
+
+
+def test_fast_mode_takes_numeric_strings(client):
+    resp = client.post("/api/bmi-analysis", json={"weight": "60", "height_cm": 170.0, "mode": "fast"})
+    assert resp.status_code == 200
+    assert resp.get_json()["computed"] == {"bmi": 20.8, "category": "normal"}
+
+
+def test_fast_mode_flags_float_smoker(client):
+    resp = client.post("/api/cardiac-risk", json={"age": 40, "sex": "m", "sbp": 120, "smoker": 1.0, "mode": "fast"})
+    assert resp.status_code == 200
+    factors = resp.get_json()["computed"]["factors"]
+    assert [name for name, present in factors.items() if present] == ["smoking"]
+
+
+def test_fast_mode_lab_flags(client):
+    resp = client.post("/api/lab-blood", json={"hb": "11", "wbc": 7, "plt": 500, "sex": "female", "mode": "fast"})
+    assert resp.status_code == 200
+    computed = resp.get_json()["computed"]
+    assert (computed["hb"], computed["wbc"], computed["plt"]) == ("low", "normal", "high")
@@ -0,0 +1,34 @@
+import base64
+import io
+import json
+
+import pytest
+
+import uploads
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 4, uploads.CHUNK_SIZE - 1, uploads.CHUNK_SIZE, 2 * uploads.CHUNK_SIZE + 5])
+def test_base64_body_round_trip_and_length(size):
+    data = bytes(i % 251 for i in range(size))
+    payload = {"model": "m", "messages": [{"content": [{"image_url": {"url": uploads.IMAGE_URL_PLACEHOLDER}}]}]}
+    body = uploads.image_payload_body(payload, io.BytesIO(data), "image/png")
+
+    raw = b"".join(body)
+    assert len(body) == len(raw)
+    url = json.loads(raw)["messages"][0]["content"][0]["image_url"]["url"]
+    prefix = "data:image/png;base64,"
+    assert url.startswith(prefix)
+    assert base64.b64decode(url[len(prefix):]) == data
+
+
+def test_base64_body_can_be_sent_again():
+    body = uploads.Base64JSONBody(b'{"x":"', io.BytesIO(b"hello world"), b'"}')
+    first = b"".join(body)
+    assert b"".join(body) == first == b'{"x":"' + base64.b64encode(b"hello world") + b'"}'
+
+
+def test_hash_stream_rewinds():
+    stream = io.BytesIO(b"abc" * 100000)
+    digest = uploads.hash_stream(stream)
+    assert stream.tell() == 0
+    assert digest == uploads.hash_stream(io.BytesIO(b"abc" * 100000))
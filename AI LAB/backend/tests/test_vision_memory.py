@@ -0,0 +1,30 @@
+"""Peak-RSS budget of one large vision upload (see bench/check_vision_memory.py). Linux only."""
+import argparse
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bench"))
+
+pytest.importorskip("PIL")
+if not os.path.exists("/proc/self/status"):
+    pytest.skip("needs /proc", allow_module_level=True)
+
+import check_vision_memory  # noqa: E402
+from mock_upstream import make_server  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def upstream_base():
+    server = make_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+
+
+@pytest.mark.parametrize("kind", ["opaque", "jpeg", "png"])
+def test_upload_peak_rss_within_budget(kind, upstream_base):
+    args = argparse.Namespace(size_mb=20, max_peak_mb=24, max_decode_factor=2.0)
+    assert check_vision_memory.run_case(kind, args, upstream_base)
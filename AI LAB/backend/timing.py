@@ -0,0 +1,184 @@
+"""
+Per-request timing: request IDs, the Server-Timing header, one structured
+log line per /api/* request and an opt-in profiler for slow requests.
+
+The phase durations are the ones collected by metrics.phase() on flask.g
+(form, hash, normalize, serialize, encode, upstream, parse).
+
+Slow-request profiling (off unless PROFILE_SLOW_PERCENT is set) samples the
+stacks of the threads serving requests every PROFILE_INTERVAL_MS and, for
+requests slower than the given percentile of recent ones, writes the
+samples as folded stacks to PROFILE_DIR (by default the per-user private
+state directory, see statedir.py, since stacks can reveal request data). Feed the files to flamegraph.pl or
+speedscope. It needs real threads (sync/gthread workers or the dev server)
+and is disabled under gevent, where all greenlets share one thread.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+from flask import g, request
+
+import statedir
+
+REQUEST_LOG = os.environ.get("REQUEST_LOG", "1") != "0"
+PROFILE_SLOW_PERCENT = float(os.environ.get("PROFILE_SLOW_PERCENT", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000.0
+
+_ID_UNSAFE = re.compile(r"[^A-Za-z0-9._-]")
+
+log = logging.getLogger("ailab.requests")
+if not log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+
+def _request_id():
+    """The caller's X-Request-ID (made safe for headers and file names), or a new one."""
+    given = _ID_UNSAFE.sub("", request.headers.get("X-Request-ID", ""))[:64]
+    return given or uuid.uuid4().hex
+
+
+def server_timing(phases, total):
+    """Server-Timing header value, durations in milliseconds."""
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def start_request():
+    g.request_id = _request_id()
+    g.request_start = time.perf_counter()
+    if profiler is not None:
+        profiler.start()
+
+
+def finish_request(route, response):
+    """Add X-Request-ID / Server-Timing, log the request and hand it to the profiler."""
+    if "request_start" not in g:
+        return response
+    total = time.perf_counter() - g.request_start
+    phases = g.get("phases", {})
+    response.headers["X-Request-ID"] = g.request_id
+    response.headers["Server-Timing"] = server_timing(phases, total)
+
+    if REQUEST_LOG:
+        record = {
+            "request_id": g.request_id,
+            "method": request.method,
+            "route": route,
+            "status": response.status_code,
+            "duration_ms": round(total * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+        }
+        if g.get("cache_status"):
+            record["cache"] = g.cache_status
+        if g.get("image_bytes"):
+            record["image_bytes_in"], record["image_bytes_out"] = g.image_bytes
+        log.info(json.dumps(record))
+
+    if profiler is not None:
+        profiler.stop(g.request_id, route, total)
+    return response
+
+
+def _fold(frame):
+    """Root-first "func (file:line);..." stack, the folded format flame graph tools read."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowRequestProfiler:
+    """
+    Samples the stacks of threads between start() and stop(). stop() keeps
+    the samples only if the request was among the slowest `percent` % of
+    the last `window` requests (once `min_requests` have been seen).
+    """
+
+    def __init__(self, out_dir, percent, interval=0.005, window=500, min_requests=20):
+        self.out_dir = out_dir
+        self.percent = percent
+        self.interval = interval
+        self.min_requests = min_requests
+        self._durations = deque(maxlen=window)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+        os.makedirs(out_dir, exist_ok=True)
+
+    def start(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._sampler is None:
+                # Started lazily so each gunicorn worker gets its own thread after fork.
+                self._sampler = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._sampler.start()
+
+    def stop(self, request_id, route, duration):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+            self._durations.append(duration)
+            ranked = sorted(self._durations)
+        if not samples or len(ranked) < self.min_requests:
+            return None
+        threshold = ranked[min(len(ranked) - 1, int(len(ranked) * (1 - self.percent / 100.0)))]
+        if duration < threshold:
+            return None
+        name = f"{int(time.time())}-{duration * 1000:.0f}ms-{route.strip('/').replace('/', '_')}-{request_id}.folded"
+        path = os.path.join(self.out_dir, name)
+        try:
+            with open(path, "w") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError:
+            return None
+        return path
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                idents = list(self._active)
+            if not idents:
+                continue
+            frames = sys._current_frames()
+            stacks = {ident: _fold(frames[ident]) for ident in idents if ident in frames}
+            with self._lock:
+                for ident, stack in stacks.items():
+                    counter = self._active.get(ident)
+                    if counter is not None:
+                        counter[stack] += 1
+
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+profiler = None
+if PROFILE_SLOW_PERCENT > 0:
+    if _gevent_patched():
+        log.warning("PROFILE_SLOW_PERCENT is ignored under gevent workers")
+    else:
+        PROFILE_DIR = PROFILE_DIR or statedir.private_dir("profiles")
+        if PROFILE_DIR:
+            profiler = SlowRequestProfiler(PROFILE_DIR, PROFILE_SLOW_PERCENT, PROFILE_INTERVAL)
+        else:
+            log.warning("PROFILE_SLOW_PERCENT is ignored: no private directory for the profiles")
@@ -0,0 +1,102 @@
+"""
+Bounded-memory handling of image uploads.
+
+Uploads are spooled to disk past UPLOAD_SPOOL_BYTES, hashed and measured in
+chunks, and base64-encoded straight into the outgoing request body. At no
+point does a vision request hold the whole image, its base64 text or the
+JSON payload as one string in memory.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+
+from flask import Request
+
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+SPOOL_BYTES = int(os.environ.get("UPLOAD_SPOOL_BYTES", str(512 * 1024)))
+
+# Multiple of 3 so every chunk encodes to whole base64 quanta (no padding mid-stream).
+CHUNK_SIZE = 3 * 16 * 1024
+
+# Put this where the image data URL belongs in a payload passed to image_payload_body().
+IMAGE_URL_PLACEHOLDER = "__IMAGE_DATA_URL__"
+
+
+class SpoolingRequest(Request):
+    """Flask request whose file parts spill to a temp file past SPOOL_BYTES."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, mode="rb+")
+
+
+def as_stream(image):
+    """Accept raw bytes or a seekable file object; return the file object rewound."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return io.BytesIO(image)
+    image.seek(0)
+    return image
+
+
+def stream_size(stream):
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def hash_stream(stream):
+    """SHA-256 hex digest of a seekable stream, read in chunks."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class Base64JSONBody:
+    """
+    Re-iterable request body: a JSON document with one base64 field filled in
+    from a stream while it is being sent. __len__ lets requests send a real
+    Content-Length instead of chunked encoding, and every __iter__ rewinds the
+    stream so the upstream client can retry. encode_seconds adds up the time
+    spent reading and base64-encoding the stream across all sends.
+    """
+
+    def __init__(self, prefix, stream, suffix):
+        self.prefix = prefix
+        self.stream = stream
+        self.suffix = suffix
+        raw = stream_size(stream)
+        self._length = len(prefix) + 4 * ((raw + 2) // 3) + len(suffix)
+        self.encode_seconds = 0.0
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        self.stream.seek(0)
+        yield self.prefix
+        while True:
+            start = time.perf_counter()
+            chunk = self.stream.read(CHUNK_SIZE)
+            encoded = base64.b64encode(chunk) if chunk else None
+            self.encode_seconds += time.perf_counter() - start
+            if encoded is None:
+                break
+            yield encoded
+        yield self.suffix
+
+
+def image_payload_body(payload, stream, mime):
+    """
+    Serialize `payload` as a streaming Base64JSONBody, with the single
+    IMAGE_URL_PLACEHOLDER replaced by a base64 data URL of `stream`.
+    """
+    prefix, suffix = json.dumps(payload).split(IMAGE_URL_PLACEHOLDER)
+    prefix += f"data:{mime};base64,"
+    return Base64JSONBody(prefix.encode("utf-8"), stream, suffix.encode("utf-8"))
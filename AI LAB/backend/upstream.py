@@ -0,0 +1,111 @@
+"""
+Shared HTTP client for the chat-completions upstream.
+
+Every gunicorn worker keeps one pooled keep-alive requests.Session, so
+repeated calls reuse the same TCP/TLS connection instead of paying a new
+handshake per request. Everything is configured through environment
+variables so the backend can be pointed at a local mock for benchmarks.
+"""
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/")
+CHAT_COMPLETIONS_URL = f"{OPENAI_API_BASE}/chat/completions"
+
+POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "10"))
+# Number of distinct upstream hosts whose connection pools are kept (see router.py).
+POOL_HOSTS = int(os.environ.get("UPSTREAM_POOL_HOSTS", "8"))
+CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", "8"))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the pooled session for the current worker process.
+    The session is created lazily and re-created after a fork, so gunicorn
+    workers never share sockets inherited from the master process.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+            _session_pid = pid
+    return _session
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, honouring Retry-After when the server sends one."""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def post_chat_completion(payload, headers, read_timeout, stream=False, on_attempt=None, url=None,
+                         max_retries=None):
+    """
+    POST a chat-completions payload through the pooled session.
+    `payload` is a dict sent as JSON, or a pre-serialized, re-iterable body
+    (see uploads.Base64JSONBody) sent as-is. With stream=True the response
+    body is left unread so server-sent events can be consumed as they arrive;
+    retries only happen before the first byte of a successful response.
+    Retries with jittered backoff on connection failures and 429/5xx.
+    on_attempt(status), if given, sees the status of every attempt. url and
+    max_retries default to CHAT_COMPLETIONS_URL and UPSTREAM_MAX_RETRIES.
+    Returns the final requests.Response; raises requests.RequestException
+    when the last attempt could not reach the server at all.
+    """
+    session = get_session()
+    body = {"json": payload} if isinstance(payload, dict) else {"data": payload}
+    url = url or CHAT_COMPLETIONS_URL
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        try:
+            resp = session.post(
+                url,
+                headers=headers,
+                **body,
+                timeout=(CONNECT_TIMEOUT, read_timeout),
+                stream=stream,
+            )
+        except requests.ConnectionError:
+            # Connect failures (including connect timeouts) are safe to retry;
+            # read timeouts are not, they already waited the full budget.
+            if attempt >= max_retries:
+                raise
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+
+        if on_attempt is not None:
+            on_attempt(resp.status_code)
+        if resp.status_code in RETRY_STATUSES and attempt < max_retries:
+            retry_after = resp.headers.get("Retry-After")
+            resp.close()
+            time.sleep(backoff_delay(attempt, retry_after))
+            attempt += 1
+            continue
+        return resp